@@ -0,0 +1,112 @@
+"""Throughput of python -m app.archive, and what it does to reads of the hot
+tables.
+
+Each run seeds a migrated SQLite database, settles --settled of the loans (the
+loan Paid, its installments Paid and due a year ago) and archives them
+--chunk-size loans per transaction. Before and after archiving it times
+reads of the hot tables: every loan as an admin's GET /loans/ lists them, a
+count of the unpaid installments, and the overdue sweep's indexed lookup of
+the oldest Pending installment (which should not change).
+
+    python -m Benchmarks.bench_archive --users 2000 --settled 0.8 --chunk-size 500 1000 5000
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.orm import sessionmaker
+
+from .bench_helper import BENCH_DIR, migrate_database, report, seed
+from app.archive import archive_settled_loans
+from app.main import list_loans
+from app.models.model import Loan, PaymentTerm
+
+
+def settle(engine, fraction):
+    # Pay off the first fraction of the loans, a year ago
+    year_ago = datetime.now() - timedelta(days=365)
+    with engine.begin() as connection:
+        ids = connection.execute(select(Loan.id).order_by(Loan.id)).scalars().all()
+        last_id = ids[int(len(ids) * fraction) - 1] if fraction else 0
+        connection.execute(
+            update(Loan).where(Loan.id <= last_id)
+            .values(status="Paid", remaining_installments=0, outstanding_balance=0)
+        )
+        connection.execute(
+            update(PaymentTerm).where(PaymentTerm.loan_id <= last_id)
+            .values(payment_status="Paid", due_date=year_ago)
+        )
+
+
+def time_reads(db, repeat):
+    # Best of repeat, in milliseconds
+    def best(fn):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            seconds.append(time.perf_counter() - start)
+        return round(min(seconds) * 1000, 2)
+
+    oldest_pending = select(func.min(PaymentTerm.due_date)).where(PaymentTerm.payment_status == "Pending")
+    return {
+        "all_loans_ms": best(lambda: list_loans(db, 0, True)),
+        "pending_installments_ms": best(lambda: db.execute(
+            select(func.count()).select_from(PaymentTerm).where(PaymentTerm.payment_status != "Paid")
+        ).scalar()),
+        "oldest_pending_ms": best(lambda: db.execute(oldest_pending).scalar()),
+    }
+
+
+def run(chunk_size, args):
+    database_url = f"sqlite:///{BENCH_DIR}/archive.db"
+    if os.path.exists(f"{BENCH_DIR}/archive.db"):
+        os.remove(f"{BENCH_DIR}/archive.db")
+    migrate_database(database_url)
+    engine = create_engine(database_url)
+    seed(engine, users=args.users, loans_per_user=args.loans_per_user, terms=args.terms)
+    settle(engine, args.settled)
+
+    db = sessionmaker(bind=engine)()
+    try:
+        before = time_reads(db, args.repeat)
+        result = archive_settled_loans(db, chunk_size=chunk_size, after_days=90)
+        after = time_reads(db, args.repeat)
+    finally:
+        db.close()
+    return {
+        "chunk_size": chunk_size,
+        "loans": result["loans"],
+        "installments": result["installments"],
+        "seconds": result["seconds"],
+        "rows_per_second": result["rows_per_second"],
+        "tables": result["tables"],
+        "reads_before": before,
+        "reads_after": after,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--loans-per-user", type=int, default=5)
+    parser.add_argument("--terms", type=int, default=12)
+    parser.add_argument("--settled", type=float, default=0.8, help="fraction of the loans paid off")
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[500, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report({
+        "benchmark": "archive",
+        "users": args.users,
+        "loans_per_user": args.loans_per_user,
+        "terms": args.terms,
+        "settled": args.settled,
+        "results": [run(chunk_size, args) for chunk_size in args.chunk_size],
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Concurrent-request throughput with a blocking Session vs an AsyncSession.
+
+    python -m Benchmarks.bench_async_db --requests 400 --concurrency 50 --latency-ms 2
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from .bench_helper import login, make_engines, report, seed, session_overrides, summarize
+from app.main import app, get_db
+
+ROUTES = ["/loans/", "/payments/pending-earliest-due-date"]
+
+
+async def drive(requests, concurrency):
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        headers = await login(client, "bench0", "benchpassword0")
+
+        async def one(i):
+            async with gate:
+                start = time.perf_counter()
+                response = await client.get(ROUTES[i % len(ROUTES)], headers=headers)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=os.environ["DATABASE_URL"])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=2.0,
+                        help="simulated per-statement round trip (SQLite only)")
+    args = parser.parse_args()
+
+    latency = args.latency_ms if args.db_url.startswith("sqlite") else 0
+    engine, async_engine = make_engines(args.db_url, latency, pool_size=args.concurrency)
+    seed(engine)
+    overrides = session_overrides(engine, async_engine)
+
+    results = []
+    for mode in ("sync", "async"):
+        app.dependency_overrides[get_db] = overrides[mode]
+        latencies, elapsed = asyncio.run(drive(args.requests, args.concurrency))
+        results.append(summarize(mode, latencies, elapsed))
+    app.dependency_overrides.clear()
+
+    report({"benchmark": "async_db", "concurrency": args.concurrency, "results": results})
+
+
+if __name__ == "__main__":
+    main()
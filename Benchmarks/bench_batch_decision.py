@@ -0,0 +1,98 @@
+"""Rows/second for approving loans one per request vs in one batch.
+
+    python -m Benchmarks.bench_batch_decision --loans 1000 10000 --terms 12
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from .bench_helper import BENCH_DIR, report
+from app.db import Base
+from app.main import decide_loan, decide_loans
+from app.models.model import LoanApprove, LoanBatchDecision, Loan, PaymentTerm, User
+
+
+def legacy_decide_loan(db, loan_id):
+    # The approval path before bulk inserts: one PaymentTerm object per
+    # installment through the unit of work
+    loan = db.query(Loan).filter(Loan.id == loan_id).first()
+    loan.status = 1
+    amount_per_installment = loan.amount / loan.terms
+    date = datetime.now()
+    for i in range(loan.terms):
+        db.add(PaymentTerm(
+            amount=amount_per_installment,
+            due_date=date + timedelta(days=7 * (i + 1)),
+            payment_status="Pending",
+            user_id=loan.user_id,
+            loan_id=loan.id,
+        ))
+    db.commit()
+
+
+def setup(name, loans, terms):
+    engine = create_engine(f"sqlite:///{BENCH_DIR}/{name}.db")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = SessionLocal()
+    admin = User(username="admin", password="adminpassword", email="admin@example.com", admin=1)
+    db.add(admin)
+    db.flush()
+    db.execute(insert(Loan), [
+        {"amount": 1200, "terms": terms, "user_id": admin.id, "status": "Waiting for approval"}
+        for _ in range(loans)
+    ])
+    db.commit()
+    loan_ids = [loan_id for (loan_id,) in db.query(Loan.id).order_by(Loan.id)]
+    db.close()
+    return SessionLocal, loan_ids
+
+
+def run(variant, loans, terms):
+    SessionLocal, loan_ids = setup(f"decision-{variant}-{loans}", loans, terms)
+    db = SessionLocal()
+
+    start = time.perf_counter()
+    if variant == "batch":
+        decide_loans(db, LoanBatchDecision(ids=loan_ids, decision=1))
+    elif variant == "per_request_bulk":
+        for loan_id in loan_ids:
+            decide_loan(db, LoanApprove(id=loan_id, decision=1))
+    else:
+        for loan_id in loan_ids:
+            legacy_decide_loan(db, loan_id)
+    elapsed = time.perf_counter() - start
+
+    rows = db.query(PaymentTerm).count()
+    db.close()
+    assert rows == loans * terms
+    return {
+        "name": variant,
+        "loans": loans,
+        "schedule_rows": rows,
+        "seconds": round(elapsed, 4),
+        "loans_per_second": round(loans / elapsed, 2),
+        "rows_per_second": round(rows / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--loans", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--terms", type=int, default=12)
+    args = parser.parse_args()
+
+    results = [
+        run(variant, loans, args.terms)
+        for loans in args.loans
+        for variant in ("per_request_legacy", "per_request_bulk", "batch")
+    ]
+    report({"benchmark": "batch_decision", "results": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Load and latency benchmark for every endpoint of the API.
+
+Seeds a local SQLite database (or the scratch database given by --db-url)
+with the requested volumes, then drives each route in-process with
+concurrent requests and reports throughput and p50/p95/p99 latency as JSON.
+Save runs with --output and diff two of them with --compare:
+
+    python -m Benchmarks.bench_endpoints --users 1000 --loans-per-user 3 --output before.json
+    python -m Benchmarks.bench_endpoints --users 1000 --loans-per-user 3 --output after.json
+    python -m Benchmarks.bench_endpoints --compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import timedelta
+
+import httpx
+from sqlalchemy import func, select
+
+from .bench_helper import add_sqlite_latency, make_engines, report, seed, session_overrides, summarize
+from app.main import app, create_access_token, get_db, password_hasher
+from app.models.model import Loan, PaymentTerm, User
+from app.security import hash_password
+
+PASSWORD = "benchpassword"
+
+
+class Context:
+    # Seeded ids and tokens the scenarios draw their requests from
+
+    def __init__(self, engine, batch_size):
+        with engine.connect() as connection:
+            users = connection.execute(select(User.id, User.username, User.admin).order_by(User.id)).all()
+            self.waiting_loans = connection.execute(
+                select(Loan.id).where(Loan.status == "Waiting for approval").order_by(Loan.id)
+            ).scalars().all()
+            self.pending_payments = connection.execute(
+                select(PaymentTerm.id, PaymentTerm.user_id, PaymentTerm.amount)
+                .where(PaymentTerm.payment_status == "Pending")
+                .order_by(PaymentTerm.id)
+            ).all()
+            self.max_loan_id = connection.execute(select(Loan.id).order_by(Loan.id.desc())).scalar() or 0
+            # Newest loans first, so prepayments stay clear of the installments
+            # make_payment pays from the oldest
+            self.prepay_loans = connection.execute(
+                select(PaymentTerm.loan_id, PaymentTerm.user_id, func.max(PaymentTerm.amount).label("amount"))
+                .where(PaymentTerm.payment_status == "Pending")
+                .group_by(PaymentTerm.loan_id, PaymentTerm.user_id)
+                .order_by(PaymentTerm.loan_id.desc())
+            ).all()
+            # Seeded users share one stored hash, which imported users reuse
+            self.password_hash = connection.execute(select(User.password).limit(1)).scalar()
+            self.first_due = connection.execute(select(func.min(PaymentTerm.due_date))).scalar()
+
+        self.usernames = [user.username for user in users if user.admin != 1]
+        self.tokens = {
+            user.id: {"Authorization": "Bearer " + create_access_token(
+                {"sub": user.username, "id": user.id, "admin": user.admin == 1}
+            )}
+            for user in users
+        }
+        self.admin = next(self.tokens[user.id] for user in users if user.admin == 1)
+        self.user_ids = [user.id for user in users if user.admin != 1]
+        self.batch_size = batch_size
+        self.random = random.Random(42)
+
+    def user(self, i):
+        return self.tokens[self.user_ids[i % len(self.user_ids)]]
+
+    def users_ndjson(self, i):
+        # batch_size new users for one /ingest/users request
+        return "\n".join(
+            json.dumps({"username": f"ingest{i}_{j}", "password": self.password_hash,
+                        "email": f"ingest{i}_{j}@example.com"})
+            for j in range(self.batch_size)
+        )
+
+
+SCENARIOS = {
+    # Reads
+    "login": lambda ctx, i: ("POST", "/user/login/", {
+        "data": {"username": ctx.usernames[i % len(ctx.usernames)], "password": PASSWORD}}),
+    "loans": lambda ctx, i: ("GET", "/loans/", {"headers": ctx.user(i)}),
+    "loans_stream": lambda ctx, i: ("GET", "/loans/", {"params": {"stream": "true"}, "headers": ctx.user(i)}),
+    "loans_admin_page": lambda ctx, i: ("GET", "/loans/", {
+        "params": {"limit": 100, "after": ctx.random.randrange(max(ctx.max_loan_id, 1))},
+        "headers": ctx.admin}),
+    "pending_earliest": lambda ctx, i: ("GET", "/payments/pending-earliest-due-date", {"headers": ctx.user(i)}),
+    "quote": lambda ctx, i: ("POST", "/loans/quote", {"json": {"loans": [
+        {"amount": 1200 + j, "terms": 12, "annual_rate": 0.12, "frequency": "monthly"}
+        for j in range(ctx.batch_size)
+    ]}, "headers": ctx.user(i)}),
+    "analytics": lambda ctx, i: ("GET", "/analytics/portfolio", {"headers": ctx.admin}),
+    "export_loans": lambda ctx, i: ("GET", "/export/loans", {"params": {"format": "csv"}, "headers": ctx.admin}),
+    # The first week of installments, so each export stays a bounded read
+    "export_payments": lambda ctx, i: ("GET", "/export/payments", {"params": {
+        "format": "parquet", "since": ctx.first_due.isoformat(),
+        "until": (ctx.first_due + timedelta(days=7)).isoformat(),
+    }, "headers": ctx.admin}),
+    "metrics": lambda ctx, i: ("GET", "/metrics", {}),
+    # Writes
+    "register": lambda ctx, i: ("POST", "/user/register/", {"json": {
+        "username": f"new{i}", "password": PASSWORD, "email": f"new{i}@example.com"}}),
+    "create_loan": lambda ctx, i: ("POST", "/loans/create", {
+        "json": {"amount": 1200, "terms": 12}, "headers": ctx.user(i)}),
+    "make_payment": lambda ctx, i: ("POST", "/payments/make-payment/", {
+        "json": {"payment_id": ctx.pending_payments[i].id, "amount": float(ctx.pending_payments[i].amount)},
+        "headers": ctx.tokens[ctx.pending_payments[i].user_id]}),
+    "decision": lambda ctx, i: ("POST", "/loans/decision", {
+        "json": {"id": ctx.waiting_loans[i], "decision": 1}, "headers": ctx.admin}),
+    "decision_batch": lambda ctx, i: ("POST", "/loans/decision/batch", {
+        "json": {"ids": ctx.waiting_loans[-(i + 1) * ctx.batch_size:][:ctx.batch_size], "decision": 1},
+        "headers": ctx.admin}),
+    # Pays the next installment of a different loan each time
+    "prepay": lambda ctx, i: ("POST", "/payments/prepay/", {
+        "json": {"loan_id": ctx.prepay_loans[i].loan_id, "amount": float(ctx.prepay_loans[i].amount)},
+        "headers": ctx.tokens[ctx.prepay_loans[i].user_id]}),
+    "ingest_users": lambda ctx, i: ("POST", "/ingest/users", {
+        "content": ctx.users_ndjson(i), "headers": ctx.admin}),
+}
+
+
+async def drive(client, ctx, scenario, requests, concurrency):
+    build = SCENARIOS[scenario]
+    latencies = []
+    statuses = {}
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        method, path, kwargs = build(ctx, i)
+        async with gate:
+            start = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    result = summarize(scenario, latencies, elapsed)
+    result["method"], result["path"] = build(ctx, 0)[:2]
+    result["errors"] = sum(count for code, count in statuses.items() if code >= 400)
+    result["status_codes"] = {str(code): count for code, count in sorted(statuses.items())}
+    return result
+
+
+async def run_all(ctx, scenarios, requests, concurrency):
+    async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        return [await drive(client, ctx, scenario, requests, concurrency) for scenario in scenarios]
+
+
+def compare(before_path, after_path):
+    # Relative change of each route's throughput and latency percentiles
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before = {result["name"]: result for result in json.load(before_file)["results"]}
+        after = {result["name"]: result for result in json.load(after_file)["results"]}
+
+    def change(old, new):
+        return round((new - old) / old * 100, 1) if old else None
+
+    return {
+        "benchmark": "endpoints_compare",
+        "before": before_path,
+        "after": after_path,
+        "results": [
+            {
+                "name": name,
+                **{
+                    f"{key}_change_pct": change(before[name][key], after[name][key])
+                    for key in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms")
+                },
+            }
+            for name in before
+            if name in after
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--db-url", default=os.environ["DATABASE_URL"],
+                        help="an empty scratch database; it is seeded")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--loans-per-user", type=int, default=2)
+    parser.add_argument("--terms", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=100, help="loans per batch decision")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="simulated per-statement round trip (SQLite only)")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.compare:
+        report(compare(*args.compare))
+        return
+
+    engine, async_engine = make_engines(args.db_url, pool_size=args.concurrency)
+    if args.latency_ms and args.db_url.startswith("sqlite"):
+        add_sqlite_latency(engine, args.latency_ms)
+        add_sqlite_latency(async_engine.sync_engine, args.latency_ms)
+
+    # Every user shares one password hashed at the configured cost, so logins
+    # measure a verification rather than a first-login rehash
+    started = time.perf_counter()
+    seed(
+        engine,
+        users=args.users,
+        loans_per_user=args.loans_per_user,
+        terms=args.terms,
+        admin=True,
+        waiting_loans=args.requests * (1 + args.batch_size),
+        password=hash_password(PASSWORD, password_hasher.cost),
+    )
+    seconds_seeding = time.perf_counter() - started
+
+    app.dependency_overrides[get_db] = session_overrides(engine, async_engine)[args.mode]
+    ctx = Context(engine, args.batch_size)
+    if len(ctx.pending_payments) < args.requests and "make_payment" in args.scenarios:
+        sys.exit("Not enough pending installments for make_payment; seed more loans.")
+    if len(ctx.prepay_loans) < args.requests and "prepay" in args.scenarios:
+        sys.exit("Not enough loans with pending installments for prepay; seed more loans.")
+    try:
+        results = asyncio.run(run_all(ctx, args.scenarios, args.requests, args.concurrency))
+    finally:
+        app.dependency_overrides.clear()
+        password_hasher.shutdown()
+
+    output = {
+        "benchmark": "endpoints",
+        "mode": args.mode,
+        "python": platform.python_version(),
+        "volumes": {
+            "users": args.users,
+            "loans": args.users * args.loans_per_user,
+            "payment_terms": args.users * args.loans_per_user * args.terms,
+            "seconds_seeding": round(seconds_seeding, 3),
+        },
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "latency_ms": args.latency_ms,
+        "results": results,
+    }
+    report(output)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(output, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import json
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Benchmarks run against a throwaway local SQLite database unless told otherwise
+BENCH_DIR = tempfile.mkdtemp(prefix="aspire-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{BENCH_DIR}/bench.db")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-benchmark-secret-key")
+# Benchmarks drive many requests per user and address; measure, don't throttle
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+os.environ.setdefault("IP_RATE_LIMIT_PER_SECOND", "0")
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db import Base, get_async_url, json_serializer
+from app.models.model import Loan, PaymentTerm, User
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+
+def migrate_database(database_url, revision="head", downgrade=False):
+    # Run the schema migrations against database_url
+    config = Config(ALEMBIC_INI)
+    config.attributes["url"] = database_url
+    config.attributes["configure_logger"] = False
+    if downgrade:
+        command.downgrade(config, revision)
+    else:
+        command.upgrade(config, revision)
+
+
+def make_engines(database_url, latency_ms=0, pool_size=5):
+    # Build a sync and an async engine on the same database. A blocking Session
+    # waiting on an exhausted pool stalls the loop that would return connections
+    # to it, so size the pools for the benchmark's concurrency.
+    options = {"json_serializer": json_serializer, "pool_size": pool_size}
+    if database_url.startswith("sqlite"):
+        # Concurrent writers queue on SQLite's database lock; wait for it
+        # instead of failing after the default 5 seconds
+        options["connect_args"] = {"timeout": 60}
+    engine = create_engine(database_url, **options)
+    async_engine = create_async_engine(get_async_url(database_url), **options)
+    if latency_ms:
+        add_sqlite_latency(engine, latency_ms)
+        add_sqlite_latency(async_engine.sync_engine, latency_ms)
+    Base.metadata.create_all(bind=engine)
+    return engine, async_engine
+
+
+def add_sqlite_latency(engine, latency_ms):
+    # Make every SQLite statement take latency_ms in the thread that runs it,
+    # standing in for a MySQL network round trip. A blocking Session sleeps on
+    # the event loop; aiosqlite sleeps in its own worker thread.
+    def delay(statement):
+        time.sleep(latency_ms / 1000)
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        if hasattr(dbapi_connection, "run_async"):
+            dbapi_connection.run_async(lambda conn: conn.set_trace_callback(delay))
+        else:
+            dbapi_connection.set_trace_callback(delay)
+
+
+def session_overrides(engine, async_engine):
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+    def get_sync_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    return {"sync": get_sync_db, "async": get_async_db}
+
+
+def seed(engine, users=10, loans_per_user=2, terms=6, admin=False, waiting_loans=0, password=None, chunk=5000):
+    # Bulk-load an empty database: users bench0..benchN (bench0 is the admin when
+    # admin is set) with approved loans and their pending weekly installments,
+    # plus waiting_loans loans awaiting a decision. Passwords are stored as
+    # given, or as benchpassword<N> in plain text.
+    now = datetime.now()
+    with engine.begin() as connection:
+        for start in range(0, users, chunk):
+            connection.execute(insert(User), [
+                {
+                    "username": f"bench{u}",
+                    "password": password if password is not None else f"benchpassword{u}",
+                    "email": f"bench{u}@example.com",
+                    "admin": 1 if admin and u == 0 else None,
+                }
+                for u in range(start, min(start + chunk, users))
+            ])
+        user_ids = connection.execute(select(User.id).order_by(User.id)).scalars().all()
+
+        loans = [
+            {"amount": 1200, "terms": terms, "start_date": now, "user_id": user_id, "status": "1",
+             "remaining_installments": terms, "outstanding_balance": 1200}
+            for user_id in user_ids for _ in range(loans_per_user)
+        ]
+        loans += [
+            {"amount": 1200, "terms": terms, "start_date": now, "user_id": user_ids[i % len(user_ids)],
+             "status": "Waiting for approval", "remaining_installments": 0, "outstanding_balance": 0}
+            for i in range(waiting_loans)
+        ]
+        for start in range(0, len(loans), chunk):
+            connection.execute(insert(Loan), loans[start:start + chunk])
+
+        approved = connection.execute(
+            select(Loan.id, Loan.user_id).where(Loan.status == "1").order_by(Loan.id)
+        ).all()
+        for start in range(0, len(approved), chunk):
+            connection.execute(insert(PaymentTerm), [
+                {
+                    "amount": 1200 / terms,
+                    "due_date": now + timedelta(days=7 * (i + 1)),
+                    "payment_status": "Pending",
+                    "user_id": loan.user_id,
+                    "loan_id": loan.id,
+                }
+                for loan in approved[start:start + chunk]
+                for i in range(terms)
+            ])
+
+
+async def login(client, username, password):
+    response = await client.post(
+        "/user/login/", data={"username": username, "password": password}
+    )
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name, latencies, elapsed):
+    return {
+        "name": name,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def report(results):
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,96 @@
+"""Per-row CPU time and allocations of building the /loans/ response body from
+ORM entities and LoanView models vs from column-projected Core rows.
+
+Each variant lists every loan of an admin (so the whole table) and renders
+the JSON body the endpoint would send:
+
+    orm_pydantic  db.query(Loan).all(), a LoanView per loan, FastAPI's
+                  jsonable_encoder and JSONResponse
+    core_rows     list_loans (select of the five columns, one dict per row)
+                  and JSONResponse
+
+    python -m Benchmarks.bench_list_projection --rows 10000 100000 --repeat 5
+"""
+import argparse
+import time
+import tracemalloc
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import sessionmaker
+
+from .bench_helper import BENCH_DIR, make_engines, report, seed
+from app.main import list_loans
+from app.models.model import Loan, LoanView
+
+
+def orm_pydantic(db):
+    loans = [
+        LoanView(id=loan.id, amount=loan.amount, terms=loan.terms, status=loan.status, user_id=loan.user_id)
+        for loan in db.query(Loan).order_by(Loan.id.asc()).all()
+    ]
+    return JSONResponse(jsonable_encoder(loans)).body
+
+
+def core_rows(db):
+    return JSONResponse(list_loans(db, 0, True)).body
+
+
+VARIANTS = {"orm_pydantic": orm_pydantic, "core_rows": core_rows}
+
+
+def measure(Session, build, rows, repeat):
+    # Best CPU time of repeat runs, then the peak traced allocation of one more
+    # run, each with a fresh session so no identity map carries over
+    seconds = []
+    for _ in range(repeat):
+        with Session() as db:
+            start = time.process_time()
+            body = build(db)
+            seconds.append(time.process_time() - start)
+
+    with Session() as db:
+        tracemalloc.start()
+        build(db)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    best = min(seconds)
+    return {
+        "cpu_seconds": round(best, 4),
+        "cpu_us_per_row": round(best / rows * 1e6, 3),
+        "peak_bytes_per_row": round(peak / rows, 1),
+        "body_bytes": len(body),
+    }
+
+
+def run(rows, repeat):
+    engine, _ = make_engines(f"sqlite:///{BENCH_DIR}/projection-{rows}.db")
+    seed(engine, users=max(1, rows // 10), loans_per_user=10, terms=1)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    results = {}
+    for name, build in VARIANTS.items():
+        results[name] = measure(Session, build, rows, repeat)
+    assert results["orm_pydantic"]["body_bytes"] == results["core_rows"]["body_bytes"]
+
+    baseline, projected = results["orm_pydantic"], results["core_rows"]
+    return {
+        "rows": rows,
+        "results": [{"name": name, **result} for name, result in results.items()],
+        "cpu_speedup": round(baseline["cpu_seconds"] / projected["cpu_seconds"], 2),
+        "allocation_ratio": round(baseline["peak_bytes_per_row"] / projected["peak_bytes_per_row"], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report({"benchmark": "list_projection", "runs": [run(rows, args.repeat) for rows in args.rows]})
+
+
+if __name__ == "__main__":
+    main()
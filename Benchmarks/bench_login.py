@@ -0,0 +1,93 @@
+"""Login throughput and latency at several password hash costs.
+
+Also samples event loop lag while logins run, to show hashing stays off the
+event loop (on a single core the pool still competes with it for CPU).
+
+    python -m Benchmarks.bench_login --costs 12 13 14 15 --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from sqlalchemy import update
+
+from .bench_helper import BENCH_DIR, make_engines, report, seed, session_overrides, summarize
+from app import main as app_main
+from app.main import app as api, get_db
+from app.models.model import User
+from app.security import PasswordHasher, hash_password
+
+PASSWORD = "benchpassword"
+
+
+async def drive(users, requests, concurrency):
+    latencies = []
+    loop_lag = []
+    gate = asyncio.Semaphore(concurrency)
+    done = asyncio.Event()
+
+    async def sample_loop_lag():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            loop_lag.append(time.perf_counter() - start - 0.005)
+
+    async with httpx.AsyncClient(app=api, base_url="http://bench") as client:
+        async def one(i):
+            async with gate:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/user/login/", data={"username": f"bench{i % users}", "password": PASSWORD}
+                )
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+        sampler = asyncio.ensure_future(sample_loop_lag())
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await sampler
+    return latencies, elapsed, max(loop_lag, default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--costs", type=int, nargs="+", default=[12, 13, 14, 15])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="hash pool size (default: CPUs)")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    args = parser.parse_args()
+
+    engine, async_engine = make_engines(f"sqlite:///{BENCH_DIR}/login.db")
+    seed(engine, users=args.users, loans_per_user=0)
+    api.dependency_overrides[get_db] = session_overrides(engine, async_engine)["sync"]
+
+    results = []
+    for cost in args.costs:
+        # Store every password at this cost so logins don't rehash
+        with engine.begin() as connection:
+            connection.execute(update(User).values(password=hash_password(PASSWORD, cost)))
+
+        options = {"cost": cost, "executor": args.executor, "max_pending": args.requests}
+        if args.workers:
+            options["workers"] = args.workers
+        app_main.password_hasher = PasswordHasher(**options)
+        try:
+            latencies, elapsed, lag = asyncio.run(drive(args.users, args.requests, args.concurrency))
+        finally:
+            app_main.password_hasher.shutdown()
+
+        result = summarize(f"cost={cost}", latencies, elapsed)
+        result["max_loop_lag_ms"] = round(lag * 1000, 3)
+        results.append(result)
+    api.dependency_overrides.clear()
+
+    report({"benchmark": "login", "concurrency": args.concurrency, "results": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Database load of clients polling /loans/ and the next due payment, with and
+without sending back the ETag of their previous response.
+
+Every round, each user polls both endpoints and an admin polls the first page
+of all loans; then --write-share of the users pay their next installment.
+Each variant seeds its own database and reports, per poll, the SQL statements
+and database time spent (from the request instrumentation) and the bytes
+sent, plus how many polls were answered 304.
+
+    python -m Benchmarks.bench_polling --users 200 --rounds 20 --write-share 0.05
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+from sqlalchemy import select
+
+from .bench_helper import BENCH_DIR, make_engines, report, seed, session_overrides, summarize
+from app import metrics
+from app.db import instrument_engine
+from app.main import app, create_access_token, get_db, next_due_cache
+from app.models.model import PaymentTerm, User
+
+ROUTES = ["/loans/", "/payments/pending-earliest-due-date"]
+
+
+async def drive(args, tokens, admin, payments, conditional):
+    etags = {}
+    latencies = []
+    counts = {"polls": 0, "not_modified": 0, "bytes": 0}
+    gate = asyncio.Semaphore(args.concurrency)
+    chooser = random.Random(42)
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        async def poll(path, headers):
+            async with gate:
+                key = (path, headers["Authorization"])
+                if conditional and key in etags:
+                    headers = dict(headers, **{"If-None-Match": etags[key]})
+                start = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code in (200, 304), response.text
+                if "ETag" in response.headers:
+                    etags[key] = response.headers["ETag"]
+                counts["polls"] += 1
+                counts["not_modified"] += response.status_code == 304
+                counts["bytes"] += len(response.content)
+
+        async def pay(user_id):
+            async with gate:
+                payment_id, amount = payments[user_id].pop(0)
+                response = await client.post(
+                    "/payments/make-payment/", json={"payment_id": payment_id, "amount": amount},
+                    headers=tokens[user_id],
+                )
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            polls = [poll(path, tokens[user_id]) for user_id in tokens for path in ROUTES]
+            polls.append(poll(f"/loans/?limit={args.admin_page}", admin))
+            await asyncio.gather(*polls)
+
+            payers = [user_id for user_id in tokens if payments[user_id]]
+            writers = chooser.sample(payers, min(len(payers), round(len(tokens) * args.write_share)))
+            await asyncio.gather(*(pay(user_id) for user_id in writers))
+        return latencies, time.perf_counter() - start, counts
+
+
+def db_load():
+    # Statements and database seconds spent by the polled routes so far
+    statements = seconds = 0.0
+    for route in ROUTES:
+        statements += metrics.DB_STATEMENTS_PER_REQUEST.sum(method="GET", route=route)
+        seconds += metrics.DB_TIME_PER_REQUEST.sum(method="GET", route=route)
+    return statements, seconds
+
+
+def run(variant, args):
+    engine, async_engine = make_engines(f"sqlite:///{BENCH_DIR}/polling-{variant}.db", pool_size=args.concurrency)
+    instrument_engine(engine, f"polling_{variant}")
+    seed(engine, users=args.users + 1, admin=True, loans_per_user=args.loans_per_user, terms=12)
+
+    with engine.connect() as connection:
+        users = connection.execute(select(User.id, User.username, User.admin)).all()
+        rows = connection.execute(
+            select(PaymentTerm.id, PaymentTerm.amount, PaymentTerm.user_id).order_by(PaymentTerm.due_date)
+        ).all()
+
+    def token(user):
+        return {"Authorization": "Bearer " + create_access_token(
+            {"sub": user.username, "id": user.id, "admin": user.admin == 1}
+        )}
+
+    tokens = {user.id: token(user) for user in users if user.admin != 1}
+    admin = next(token(user) for user in users if user.admin == 1)
+    payments = {user_id: [] for user_id in tokens}
+    for row in rows:
+        if row.user_id in payments:
+            payments[row.user_id].append((row.id, row.amount))
+
+    next_due_cache.clear()
+    app.dependency_overrides[get_db] = session_overrides(engine, async_engine)["sync"]
+    before = db_load()
+    try:
+        latencies, elapsed, counts = asyncio.run(drive(args, tokens, admin, payments, variant == "conditional"))
+    finally:
+        app.dependency_overrides.clear()
+    statements, seconds = (after - start for after, start in zip(db_load(), before))
+
+    result = summarize(variant, latencies, elapsed)
+    result.update(
+        polls=counts["polls"],
+        not_modified=counts["not_modified"],
+        statements_per_poll=round(statements / counts["polls"], 3),
+        db_ms_per_poll=round(seconds / counts["polls"] * 1000, 4),
+        bytes_per_poll=round(counts["bytes"] / counts["polls"], 1),
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--loans-per-user", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--write-share", type=float, default=0.05, help="share of users paying each round")
+    parser.add_argument("--admin-page", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    results = [run(variant, args) for variant in ("unconditional", "conditional")]
+    unconditional, conditional = results
+    report({
+        "benchmark": "polling",
+        "users": args.users,
+        "rounds": args.rounds,
+        "write_share": args.write_share,
+        "results": results,
+        "db_time_reduction": round(1 - conditional["db_ms_per_poll"] / unconditional["db_ms_per_poll"], 3),
+        "statement_reduction": round(1 - conditional["statements_per_poll"] / unconditional["statements_per_poll"], 3),
+    })
+
+
+if __name__ == "__main__":
+    main()
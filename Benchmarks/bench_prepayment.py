@@ -0,0 +1,133 @@
+"""Installments settled per second when paying loans off one installment per
+request vs one prepayment per loan, with concurrent payers.
+
+Each variant seeds its own database, pays off every loan and then checks that
+every installment was paid once and every loan's counters reached zero. It
+then drains the payments' outbox events --outbox-batch at a time, reporting
+events/second, and checks the portfolio totals they leave against a rebuild.
+
+    python -m Benchmarks.bench_prepayment --loans 200 --terms 12 --concurrency 20 --mode async
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .bench_helper import BENCH_DIR, make_engines, report, seed, session_overrides, summarize
+from app.analytics import portfolio_summary, rebuild_portfolio_summary
+from app.main import app, create_access_token, get_db
+from app.outbox import process_outbox
+from app.models.model import Loan, PaymentTerm, User
+
+
+def payment_requests(variant, engine):
+    # (path, body, user id) of every request that pays all loans off
+    with engine.connect() as connection:
+        if variant == "per_installment":
+            rows = connection.execute(
+                select(PaymentTerm.id, PaymentTerm.amount, PaymentTerm.user_id)
+                .order_by(PaymentTerm.loan_id, PaymentTerm.due_date)
+            ).all()
+            return [
+                ("/payments/make-payment/", {"payment_id": row.id, "amount": row.amount}, row.user_id)
+                for row in rows
+            ]
+        rows = connection.execute(select(Loan.id, Loan.outstanding_balance, Loan.user_id)).all()
+        return [
+            ("/payments/prepay/", {"loan_id": row.id, "amount": row.outstanding_balance}, row.user_id)
+            for row in rows
+        ]
+
+
+async def drive(requests, tokens, concurrency):
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        async def one(path, body, user_id):
+            async with gate:
+                start = time.perf_counter()
+                response = await client.post(path, json=body, headers=tokens[user_id])
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(*request) for request in requests))
+        return latencies, time.perf_counter() - start
+
+
+def check_paid_off(engine, installments):
+    with engine.connect() as connection:
+        paid = connection.execute(
+            select(func.count()).where(PaymentTerm.payment_status == "Paid")
+        ).scalar()
+        open_loans = connection.execute(
+            select(func.count()).where(
+                (Loan.remaining_installments != 0) | (Loan.outstanding_balance > 0.005) | (Loan.status != "Paid")
+            )
+        ).scalar()
+    assert paid == installments, f"{paid} of {installments} installments paid"
+    assert open_loans == 0, f"{open_loans} loans not settled"
+
+
+def run(variant, args):
+    engine, async_engine = make_engines(f"sqlite:///{BENCH_DIR}/prepayment-{variant}.db", pool_size=args.concurrency)
+    users = max(1, args.loans // args.loans_per_user)
+    seed(engine, users=users, loans_per_user=args.loans_per_user, terms=args.terms)
+    with Session(engine) as db:
+        rebuild_portfolio_summary(db)
+
+    with engine.connect() as connection:
+        tokens = {
+            user.id: {"Authorization": "Bearer " + create_access_token({"sub": user.username, "id": user.id})}
+            for user in connection.execute(select(User.id, User.username))
+        }
+    requests = payment_requests(variant, engine)
+
+    app.dependency_overrides[get_db] = session_overrides(engine, async_engine)[args.mode]
+    try:
+        latencies, elapsed = asyncio.run(drive(requests, tokens, args.concurrency))
+    finally:
+        app.dependency_overrides.clear()
+
+    installments = users * args.loans_per_user * args.terms
+    check_paid_off(engine, installments)
+    result = summarize(variant, latencies, elapsed)
+    result["installments_per_second"] = round(installments / elapsed, 2)
+
+    with Session(engine) as db:
+        drained = process_outbox(db, args.outbox_batch)
+        summary = portfolio_summary(db)
+        rebuild_portfolio_summary(db)
+        assert portfolio_summary(db) == summary, "outbox totals differ from a rebuild"
+    result["outbox_events"] = drained["processed"]
+    result["outbox_events_per_second"] = drained["events_per_second"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, default=200)
+    parser.add_argument("--loans-per-user", type=int, default=2)
+    parser.add_argument("--terms", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mode", choices=["sync", "async"], default="async")
+    parser.add_argument("--outbox-batch", type=int, default=500, help="outbox events processed per transaction")
+    args = parser.parse_args()
+
+    results = [run(variant, args) for variant in ("per_installment", "prepay")]
+    report({
+        "benchmark": "prepayment",
+        "mode": args.mode,
+        "loans": args.loans,
+        "terms": args.terms,
+        "concurrency": args.concurrency,
+        "results": results,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Schedules/second priced by the NumPy amortization engine vs the same
+arithmetic loan by loan in Python, and end to end through POST /loans/quote.
+
+Every variant prices the same mix of what-if loans (random amounts, terms up
+to --max-terms, rates from 0 to 30%, all three frequencies):
+
+    python_loop      per-loan, per-period Python arithmetic in whole cents
+    numpy            app.schedule.amortize over the whole batch
+    endpoint         POST /loans/quote with --batch loans per request, with
+                     schedules in the response, through the ASGI app
+    endpoint_totals  the same with include_schedules false: installments and
+                     totals only
+
+    python -m Benchmarks.bench_schedules --loans 1000 10000 --batch 1000 --repeat 3
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+import numpy as np
+
+from .bench_helper import report
+from app.main import app, create_access_token
+from app.schedule import FREQUENCIES, amortize
+
+
+def make_quotes(count, max_terms, seed=42):
+    chooser = random.Random(seed)
+    return [
+        (
+            round(chooser.uniform(100, 50000), 2),
+            chooser.randint(1, max_terms),
+            chooser.choice([0, 0.05, 0.12, 0.3]),
+            chooser.choice(list(FREQUENCIES)),
+        )
+        for _ in range(count)
+    ]
+
+
+def python_loop(quotes):
+    # The engine's arithmetic, one loan and one period at a time
+    schedules = []
+    for amount, terms, annual_rate, frequency in quotes:
+        rate = annual_rate / FREQUENCIES[frequency][0]
+        remaining = int(amount * 100 + 0.5)
+        if rate:
+            installment = int(remaining * rate / (1 - (1 + rate) ** -terms) + 0.5)
+        else:
+            installment = int(remaining / terms + 0.5)
+        rows = []
+        for period in range(terms):
+            interest = int(remaining * rate + 0.5)
+            principal = remaining if period == terms - 1 else min(max(installment - interest, 0), remaining)
+            remaining -= principal
+            rows.append((principal + interest, principal, interest, remaining))
+        schedules.append(rows)
+    return schedules
+
+
+def numpy_engine(quotes):
+    amounts, terms, rates, frequencies = zip(*quotes)
+    return amortize(amounts, terms, rates, np.array(frequencies, dtype=object))
+
+
+async def post_quotes(quotes, batch, include_schedules):
+    token = create_access_token({"sub": "bench", "id": 1, "admin": False})
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        for i in range(0, len(quotes), batch):
+            loans = [
+                {"amount": amount, "terms": terms, "annual_rate": rate, "frequency": frequency}
+                for amount, terms, rate, frequency in quotes[i:i + batch]
+            ]
+            response = await client.post(
+                "/loans/quote", json={"loans": loans, "include_schedules": include_schedules}, headers=headers
+            )
+            assert response.status_code == 200, response.text
+
+
+def run(variant, quotes, args):
+    seconds = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        if variant == "python_loop":
+            python_loop(quotes)
+        elif variant == "numpy":
+            numpy_engine(quotes)
+        else:
+            asyncio.run(post_quotes(quotes, args.batch, variant == "endpoint"))
+        seconds.append(time.perf_counter() - start)
+
+    best = min(seconds)
+    installments = sum(terms for _, terms, _, _ in quotes)
+    return {
+        "name": variant,
+        "loans": len(quotes),
+        "installments": installments,
+        "seconds": round(best, 4),
+        "schedules_per_second": round(len(quotes) / best, 1),
+        "installments_per_second": round(installments / best, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--max-terms", type=int, default=36)
+    parser.add_argument("--batch", type=int, default=1000, help="loans per POST /loans/quote")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    for count in args.loans:
+        quotes = make_quotes(count, args.max_terms)
+        # Both engines price every loan to the same cents
+        expected = python_loop(quotes[:200])
+        schedules = numpy_engine(quotes[:200])
+        for i, rows in enumerate(expected):
+            assert [row[0] for row in rows] == schedules.payment[i, :len(rows)].astype(int).tolist()
+        results.extend(run(variant, quotes, args) for variant in ("python_loop", "numpy", "endpoint", "endpoint_totals"))
+    report({"benchmark": "schedules", "max_terms": args.max_terms, "results": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Requests/second of python -m app serve at several worker counts on this
+machine, over real HTTP.
+
+For each --workers count the server is started against a migrated and seeded
+SQLite database, warmed up, and then driven with --requests GET /loans/ and
+GET /payments/pending-earliest-due-date calls from --clients client
+processes, each keeping --concurrency requests open. The client processes
+share the machine with the workers, so compare counts against the CPUs you
+have (reported as cpus).
+
+    python -m Benchmarks.bench_serve --workers 1 2 4 --requests 4000 --clients 2 --concurrency 20
+
+Pass --loop asyncio --http h11 to measure without uvloop and httptools.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import create_engine, select
+
+from .bench_helper import BENCH_DIR, migrate_database, percentile, report, seed
+from app.main import create_access_token
+from app.models.model import User
+
+ROUTES = ["/loans/", "/payments/pending-earliest-due-date"]
+
+
+async def drive(base_url, tokens, requests, concurrency):
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=None) as client:
+        async def call(i):
+            async with gate:
+                start = time.perf_counter()
+                response = await client.get(ROUTES[i % len(ROUTES)], headers=tokens[i % len(tokens)])
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+        await asyncio.gather(*(call(i) for i in range(requests)))
+    return latencies
+
+
+def client_process(base_url, tokens, requests, concurrency, results):
+    start = time.perf_counter()
+    latencies = asyncio.run(drive(base_url, tokens, requests, concurrency))
+    results.put((start, time.perf_counter(), latencies))
+
+
+def wait_until_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/metrics").status_code == 200:
+                return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def run(workers, args, database_url, tokens):
+    port = args.port + workers
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, DATABASE_URL=database_url)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app", "serve", "--workers", str(workers), "--port", str(port),
+         "--log-level", "warning", "--loop", args.loop, "--http", args.http],
+        env=env,
+    )
+    try:
+        wait_until_ready(base_url)
+        # Every worker opens its connections and compiles its statements first
+        asyncio.run(drive(base_url, tokens, workers * 100, args.concurrency))
+
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=client_process,
+                args=(base_url, tokens, args.requests // args.clients, args.concurrency, results),
+            )
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        samples = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    elapsed = max(end for _, end, _ in samples) - min(start for start, _, _ in samples)
+    latencies = [latency for _, _, sample in samples for latency in sample]
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--clients", type=int, default=2, help="client processes")
+    parser.add_argument("--concurrency", type=int, default=20, help="open requests per client process")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--loop", default="auto", help="event loop of the workers: auto, asyncio or uvloop")
+    parser.add_argument("--http", default="auto", help="HTTP parser of the workers: auto, h11 or httptools")
+    args = parser.parse_args()
+
+    database_url = f"sqlite:///{BENCH_DIR}/serve.db"
+    migrate_database(database_url)
+    engine = create_engine(database_url)
+    seed(engine, users=args.users, loans_per_user=3, terms=12)
+    with engine.connect() as connection:
+        users = connection.execute(select(User.id, User.username)).all()
+    tokens = [
+        {"Authorization": "Bearer " + create_access_token({"sub": user.username, "id": user.id, "admin": False})}
+        for user in users
+    ]
+
+    report({
+        "benchmark": "serve",
+        "cpus": os.cpu_count(),
+        "clients": args.clients,
+        "concurrency": args.concurrency,
+        "loop": args.loop,
+        "http": args.http,
+        "results": [run(workers, args, database_url, tokens) for workers in args.workers],
+    })
+
+
+if __name__ == "__main__":
+    main()
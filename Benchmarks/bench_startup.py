@@ -0,0 +1,130 @@
+"""Import time and cold start of a worker, with and without warming its pool.
+
+Each variant runs in a fresh Python process against a migrated and seeded
+SQLite database. Every new connection is delayed by --connect-ms, standing in
+for a MySQL handshake. The process reports how long importing app.main takes,
+how long the app's startup takes, and the latencies of a burst of
+--concurrency GET /loans/ requests sent right after it:
+
+    cold   DB_POOL_WARM=0: the first requests open the pool's connections
+    warm   DB_POOL_WARM=DB_POOL_SIZE: startup opens them before traffic
+
+    python -m Benchmarks.bench_startup --connect-ms 20 --concurrency 5 --repeat 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+VARIANTS = ("cold", "warm")
+
+
+def child(args):
+    # Runs in the measured process: nothing of the app is imported yet
+    start = time.perf_counter()
+    import app.main
+    import_seconds = time.perf_counter() - start
+
+    import httpx
+    from sqlalchemy import event
+
+    from app.db import database
+
+    database.start()
+
+    @event.listens_for(database.engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        time.sleep(args.connect_ms / 1000)
+
+    async def first_requests():
+        start = time.perf_counter()
+        await app.main.app.router.startup()
+        startup_seconds = time.perf_counter() - start
+
+        token = app.main.create_access_token({"sub": "bench1", "id": 2, "admin": False})
+        headers = {"Authorization": f"Bearer {token}"}
+        latencies = []
+        async with httpx.AsyncClient(app=app.main.app, base_url="http://bench", timeout=None) as client:
+            async def get_loans():
+                start = time.perf_counter()
+                response = await client.get("/loans/", headers=headers)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+            await asyncio.gather(*(get_loans() for _ in range(args.concurrency)))
+        await app.main.app.router.shutdown()
+        return startup_seconds, latencies
+
+    startup_seconds, latencies = asyncio.run(first_requests())
+    print(json.dumps({
+        "import_seconds": import_seconds,
+        "startup_seconds": startup_seconds,
+        "latencies": latencies,
+    }))
+
+
+def run(variant, args, database_url):
+    from .bench_helper import percentile
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        DB_POOL_SIZE=str(args.concurrency),
+        DB_POOL_WARM=str(args.concurrency if variant == "warm" else 0),
+    )
+    samples = []
+    for _ in range(args.repeat):
+        output = subprocess.run(
+            [sys.executable, "-m", "Benchmarks.bench_startup", "--child",
+             "--connect-ms", str(args.connect_ms), "--concurrency", str(args.concurrency)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    latencies = [latency for sample in samples for latency in sample["latencies"]]
+    return {
+        "name": variant,
+        "processes": args.repeat,
+        "import_ms": round(statistics.median(sample["import_seconds"] for sample in samples) * 1000, 1),
+        "startup_ms": round(statistics.median(sample["startup_seconds"] for sample in samples) * 1000, 1),
+        "first_request_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "first_request_max_ms": round(max(latencies) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connect-ms", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=5, help="first requests, and the pool size")
+    parser.add_argument("--repeat", type=int, default=3, help="processes started per variant")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    # Imported here, as it imports the app, which the measured processes must
+    # not have done before they start their clock
+    from sqlalchemy import create_engine
+    from .bench_helper import BENCH_DIR, migrate_database, report, seed
+
+    database_url = f"sqlite:///{BENCH_DIR}/startup.db"
+    migrate_database(database_url)
+    seed(create_engine(database_url), users=10)
+
+    report({
+        "benchmark": "startup",
+        "connect_ms": args.connect_ms,
+        "concurrency": args.concurrency,
+        "results": [run(variant, args, database_url) for variant in VARIANTS],
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Report the query plan of every statement the hot request paths send.
+
+Migrates and seeds a scratch database, runs each path's handler code while
+capturing its SQL, then EXPLAINs every captured SELECT/UPDATE/DELETE. Exits
+non-zero when a statement scans a whole table or sorts outside an index.
+
+    python -m Benchmarks.explain_hot_queries [--db-url sqlite:///scratch.db]
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from .bench_helper import BENCH_DIR, migrate_database, report, seed
+from app.main import (
+    apply_payment,
+    create_user,
+    decide_loan,
+    find_earliest_pending_payment,
+    find_user,
+    list_loans,
+)
+from app.sweeper import sweep_overdue_installments
+from app.versions import user_data_version
+from app.models.model import Loan, LoanApprove, MakePayment, PaymentTerm, User, UserCreate
+
+EXPLAINED = ("SELECT", "UPDATE", "DELETE")
+
+
+def hot_paths(db):
+    # The handler code behind each endpoint, called the way its route does
+    user = db.query(User).filter(User.username == "bench1").first()
+    admin = db.query(User).filter(User.admin == 1).first()
+    payment = db.query(PaymentTerm).filter(PaymentTerm.user_id == user.id).first()
+    loan = db.query(Loan).filter(Loan.user_id == user.id).first()
+    db.add(Loan(amount=1200, terms=12, user_id=user.id, status="Waiting for approval"))
+    db.commit()
+    waiting = db.query(Loan).filter(Loan.status == "Waiting for approval").first()
+    user_id, admin_id, payment_id, loan_id, waiting_id = user.id, admin.id, payment.id, loan.id, waiting.id
+    db.close()
+
+    return {
+        "register": lambda: create_user(db, UserCreate(username="new", password="new", email="new@example.com"), "hash"),
+        "login": lambda: find_user(db, "bench1"),
+        "data_version": lambda: user_data_version(db, user_id),
+        "loans": lambda: list_loans(db, user_id, False, 100),
+        "loans_admin_page": lambda: list_loans(db, admin_id, True, 100, loan_id),
+        "decision": lambda: decide_loan(db, LoanApprove(id=waiting_id, decision=1)),
+        "pending_earliest": lambda: find_earliest_pending_payment(db, user_id),
+        "make_payment": lambda: apply_payment(db, MakePayment(payment_id=payment_id, amount=1000), user_id),
+        "overdue_sweep": lambda: sweep_overdue_installments(db, datetime.now() + timedelta(days=8)),
+    }
+
+
+def capture(engine, fn):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(EXPLAINED):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def explain(connection, statement, parameters):
+    # Returns the plan lines plus whether they show a full scan or a sort
+    if connection.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        plan = [row[-1] for row in rows]
+        full_scan = any(line.startswith("SCAN ") and " USING " not in line for line in plan)
+        sort = any("TEMP B-TREE" in line for line in plan)
+    else:
+        result = connection.exec_driver_sql("EXPLAIN " + statement, parameters)
+        rows = [dict(row._mapping) for row in result]
+        plan = [
+            f"{row.get('table')}: type={row.get('type')} key={row.get('key')} extra={row.get('Extra')}"
+            for row in rows
+        ]
+        full_scan = any(row.get("type") == "ALL" for row in rows)
+        sort = any("filesort" in (row.get("Extra") or "") for row in rows)
+    return plan, full_scan, sort
+
+
+def explain_hot_queries(engine):
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    results = []
+    for name, fn in hot_paths(db).items():
+        statements = capture(engine, fn)
+        db.close()
+        with engine.connect() as connection:
+            for statement, parameters in statements:
+                plan, full_scan, sort = explain(connection, statement, parameters)
+                results.append({
+                    "path": name,
+                    "statement": " ".join(statement.split()),
+                    "plan": plan,
+                    "full_scan": full_scan,
+                    "sort": sort,
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=f"sqlite:///{BENCH_DIR}/explain.db",
+                        help="an empty scratch database; it is migrated and seeded")
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    migrate_database(args.db_url)
+    engine = create_engine(args.db_url)
+    seed(engine, users=args.users, loans_per_user=2, terms=12, admin=True)
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as connection:
+            for table in ("users", "loans", "payment_status"):
+                connection.exec_driver_sql(f"ANALYZE TABLE {table}")
+
+    results = explain_hot_queries(engine)
+    flagged = [result for result in results if result["full_scan"] or result["sort"]]
+    report({"benchmark": "explain_hot_queries", "flagged": len(flagged), "results": results})
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
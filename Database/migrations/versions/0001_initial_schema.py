@@ -0,0 +1,66 @@
+"""Initial schema, as previously dumped to Database/Main_Database.sql
+
+Databases created from that dump are at this revision: mark them with
+alembic stamp 0001 before upgrading.
+
+Revision ID: 0001
+Revises:
+Create Date: 2023-09-19 01:47:23
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("username", sa.String(255)),
+        sa.Column("email", sa.String(255)),
+        sa.Column("password", sa.String(255), nullable=False),
+        sa.Column("admin", sa.Integer),
+        mysql_engine="InnoDB",
+    )
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+    op.create_index("ix_users_id", "users", ["id"])
+
+    op.create_table(
+        "loans",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("amount", sa.Numeric(10, 2), nullable=False),
+        sa.Column("terms", sa.Integer, nullable=False),
+        sa.Column("start_date", sa.Date),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id", name="fk_user_id")),
+        sa.Column("status", sa.String(256), nullable=False),
+        mysql_engine="InnoDB",
+    )
+    op.create_index("fk_user_id", "loans", ["user_id"])
+
+    op.create_table(
+        "payment_status",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("amount", sa.Numeric(10, 2), nullable=False),
+        sa.Column("due_date", sa.Date, nullable=False),
+        sa.Column(
+            "payment_status",
+            sa.Enum("Pending", "Paid", "Late", "Failed", name="payment_status"),
+            nullable=False,
+        ),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id", name="payment_status_ibfk_1")),
+        sa.Column("loan_id", sa.Integer, nullable=False),
+        mysql_engine="InnoDB",
+    )
+    op.create_index("user_id", "payment_status", ["user_id"])
+
+
+def downgrade():
+    op.drop_table("payment_status")
+    op.drop_table("loans")
+    op.drop_table("users")
@@ -0,0 +1,43 @@
+"""Loan settlement counters
+
+Existing loans get their counters from their unpaid installments, as
+python -m app.reconcile counts them, in one UPDATE.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("loans") as batch_op:
+        batch_op.add_column(
+            sa.Column("remaining_installments", sa.Integer, nullable=False, server_default="0")
+        )
+        batch_op.add_column(
+            sa.Column("outstanding_balance", sa.Numeric(10, 2), nullable=False, server_default="0")
+        )
+
+    loans = sa.table("loans", sa.column("id"), sa.column("remaining_installments"), sa.column("outstanding_balance"))
+    terms = sa.table(
+        "payment_status", sa.column("id"), sa.column("loan_id"), sa.column("amount"), sa.column("payment_status")
+    )
+    unpaid = (terms.c.loan_id == loans.c.id) & (terms.c.payment_status != "Paid")
+    op.execute(loans.update().values(
+        remaining_installments=sa.select(sa.func.count(terms.c.id)).where(unpaid).scalar_subquery(),
+        outstanding_balance=sa.select(sa.func.coalesce(sa.func.sum(terms.c.amount), 0)).where(unpaid).scalar_subquery(),
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table("loans") as batch_op:
+        batch_op.drop_column("outstanding_balance")
+        batch_op.drop_column("remaining_installments")
@@ -0,0 +1,47 @@
+"""Composite indexes for the hot payment_status queries
+
+- (user_id, payment_status, due_date) serves the pending-earliest lookup
+  with an index range scan already in due_date order. Its user_id prefix
+  also backs the users foreign key, so the single-column user_id key goes.
+- (loan_id, payment_status, due_date) serves per-loan installment lookups
+  such as the counter reconciliation; loan_id had no index at all.
+- Databases built by create_all carry a unique index on users.password,
+  which costs every insert and serves no query; it is dropped and not
+  restored on downgrade.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_payment_status_user_status_due",
+        "payment_status",
+        ["user_id", "payment_status", "due_date"],
+    )
+    op.drop_index("user_id", table_name="payment_status")
+    op.create_index(
+        "ix_payment_status_loan_status_due",
+        "payment_status",
+        ["loan_id", "payment_status", "due_date"],
+    )
+
+    user_indexes = {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("users")}
+    if "ix_users_password" in user_indexes:
+        op.drop_index("ix_users_password", table_name="users")
+
+
+def downgrade():
+    op.drop_index("ix_payment_status_loan_status_due", table_name="payment_status")
+    op.create_index("user_id", "payment_status", ["user_id"])
+    op.drop_index("ix_payment_status_user_status_due", table_name="payment_status")
@@ -0,0 +1,25 @@
+"""Index for the overdue sweeper
+
+(payment_status, due_date) lets python -m app.sweeper find the overdue
+Pending installments, oldest first, with an index range scan instead of
+reading the whole table on every run.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_payment_status_status_due", "payment_status", ["payment_status", "due_date"])
+
+
+def downgrade():
+    op.drop_index("ix_payment_status_status_due", table_name="payment_status")
@@ -0,0 +1,39 @@
+"""Data versions for conditional GETs
+
+users.data_version and the data_versions shards are bumped by every write to
+loans and installments, so /loans/ and /payments/pending-earliest-due-date can
+answer If-None-Match with 304 after reading only a version.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+# DATA_VERSION_SHARDS of app/models/model.py
+DATA_VERSION_SHARDS = 16
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("data_version", sa.Integer, nullable=False, server_default="0"))
+
+    data_versions = op.create_table(
+        "data_versions",
+        sa.Column("shard", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("version", sa.Integer, nullable=False, server_default="0"),
+    )
+    op.bulk_insert(data_versions, [{"shard": shard, "version": 0} for shard in range(DATA_VERSION_SHARDS)])
+
+
+def downgrade():
+    op.drop_table("data_versions")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("data_version")
@@ -0,0 +1,41 @@
+"""Portfolio summary tables for /analytics/portfolio
+
+Fill them from existing loans and installments afterwards with
+python -m app.analytics.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "loan_summary",
+        sa.Column("status", sa.String(255), primary_key=True),
+        sa.Column("shard", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("loans", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("amount", sa.Numeric(16, 2), nullable=False, server_default="0"),
+        sa.Column("outstanding_balance", sa.Numeric(16, 2), nullable=False, server_default="0"),
+        sa.Column("remaining_installments", sa.Integer, nullable=False, server_default="0"),
+    )
+    op.create_table(
+        "collection_summary",
+        sa.Column("due_date", sa.Date, primary_key=True),
+        sa.Column("shard", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("installments", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("amount", sa.Numeric(16, 2), nullable=False, server_default="0"),
+    )
+
+
+def downgrade():
+    op.drop_table("collection_summary")
+    op.drop_table("loan_summary")
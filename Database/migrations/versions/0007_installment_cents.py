@@ -0,0 +1,28 @@
+"""Installment amounts in cents
+
+Schedules are amortized to the cent, with the remainder on the last
+installment, so payment_status.amount keeps two decimals instead of being
+truncated to whole units. 0001 already created the column as Numeric(10, 2)
+(only the ORM model declared it Integer), so there is nothing to alter: the
+revision only keeps the chain, and neither direction rewrites the table.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 00:00:00
+"""
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # payment_status.amount is Numeric(10, 2) since 0001
+    pass
+
+
+def downgrade():
+    # Revisions before this one read and wrote Numeric(10, 2) too
+    pass
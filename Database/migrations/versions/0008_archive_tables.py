@@ -0,0 +1,49 @@
+"""History tables for archived loans and installments
+
+python -m app.archive moves settled loans and their installments here.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "loans_history",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("amount", sa.Integer),
+        sa.Column("terms", sa.Integer),
+        sa.Column("start_date", sa.DateTime),
+        sa.Column("status", sa.String(255)),
+        sa.Column("remaining_installments", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("outstanding_balance", sa.Numeric(10, 2), nullable=False, server_default="0"),
+        sa.Column("user_id", sa.Integer),
+        sa.Column("archived_at", sa.DateTime, nullable=False),
+    )
+    op.create_index("ix_loans_history_user_id", "loans_history", ["user_id"])
+
+    op.create_table(
+        "payment_status_history",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("amount", sa.Numeric(10, 2)),
+        sa.Column("due_date", sa.DateTime),
+        sa.Column("payment_status", sa.String(255)),
+        sa.Column("user_id", sa.Integer),
+        sa.Column("loan_id", sa.Integer),
+        sa.Column("archived_at", sa.DateTime, nullable=False),
+    )
+    op.create_index("ix_payment_status_history_loan_id", "payment_status_history", ["loan_id"])
+
+
+def downgrade():
+    op.drop_table("payment_status_history")
+    op.drop_table("loans_history")
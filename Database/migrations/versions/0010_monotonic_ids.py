@@ -0,0 +1,60 @@
+"""Never hand out the id of an archived loan or installment again
+
+Archived rows keep their ids in loans_history and payment_status_history.
+SQLite gives an INTEGER PRIMARY KEY without AUTOINCREMENT max(id) + 1, so
+archiving the newest loan let the next one take its id; loans and
+payment_status are rebuilt with AUTOINCREMENT. On every backend the next id
+starts past the archived ones. loans_history.amount becomes Numeric(10, 2),
+like loans.amount, so archiving keeps the cents.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+# Hot tables and their history tables
+TABLES = {"loans": "loans_history", "payment_status": "payment_status_history"}
+
+
+def upgrade():
+    connection = op.get_bind()
+    dialect = connection.dialect.name
+    for table, history in TABLES.items():
+        if dialect == "sqlite":
+            with op.batch_alter_table(table, recreate="always", table_kwargs={"sqlite_autoincrement": True}):
+                pass
+
+        last_id = connection.execute(sa.text(
+            f"SELECT MAX(id) FROM (SELECT id FROM {table} UNION ALL SELECT id FROM {history}) AS ids"
+        )).scalar()
+        if not last_id:
+            continue
+        if dialect == "sqlite":
+            connection.execute(sa.text("DELETE FROM sqlite_sequence WHERE name = :table"), {"table": table})
+            connection.execute(
+                sa.text("INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :seq)"),
+                {"table": table, "seq": last_id},
+            )
+        elif dialect == "mysql":
+            # InnoDB raises the counter to at least max(id) + 1 of the table itself
+            op.execute(f"ALTER TABLE {table} AUTO_INCREMENT = {last_id + 1}")
+
+    with op.batch_alter_table("loans_history") as batch_op:
+        batch_op.alter_column("amount", type_=sa.Numeric(10, 2), existing_type=sa.Integer)
+
+
+def downgrade():
+    # loans_history.amount stays Numeric(10, 2) rather than truncating the
+    # cents of archived loans
+    if op.get_bind().dialect.name == "sqlite":
+        for table in TABLES:
+            with op.batch_alter_table(table, recreate="always"):
+                pass
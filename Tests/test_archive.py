@@ -0,0 +1,114 @@
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics
+from app.archive import archive_settled_loans
+from app.db import Base
+from app.ingest import IngestReport, ingest_loans, ingest_payments
+from app.models.model import (
+    Loan, LoanHistory, LoanImport, PaymentImport, PaymentTerm, PaymentTermHistory, User,
+)
+
+
+def test_archive_moves_settled_loans():
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/archive.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    now = datetime.now()
+    user = User(username="archived", email="archived@example.com", password="x", data_version=0)
+    db.add(user)
+    db.commit()
+
+    # Settled long ago, settled too recently, and still being repaid
+    loans = {}
+    for name, status, paid, last_due in [
+        ("old", "Paid", 3, now - timedelta(days=200)),
+        ("old2", "Paid", 3, now - timedelta(days=100)),
+        ("recent", "Paid", 3, now - timedelta(days=10)),
+        ("open", "Approved", 1, now + timedelta(days=14)),
+    ] * 3:
+        loan = Loan(amount=300, terms=3, status=status, user_id=user.id,
+                    remaining_installments=3 - paid, outstanding_balance=100 * (3 - paid))
+        db.add(loan)
+        db.flush()
+        loans.setdefault(name, []).append(loan.id)
+        db.add_all([
+            PaymentTerm(amount=100, due_date=last_due - timedelta(weeks=2 - i),
+                        payment_status="Paid" if i < paid else "Pending", user_id=user.id, loan_id=loan.id)
+            for i in range(3)
+        ])
+    db.commit()
+
+    archived = metrics.ARCHIVED_ROWS.value(table="loans")
+    result = archive_settled_loans(db, now, chunk_size=4, after_days=90)
+    assert (result["loans"], result["installments"]) == (6, 18)
+    assert result["tables"]["loans"] == {"rows_before": 12, "rows_after": 6, "reduction_percent": 50.0}
+    assert result["tables"]["payment_status"]["rows_after"] == 18
+    assert metrics.ARCHIVED_ROWS.value(table="loans") == archived + 6
+
+    # The rows keep their ids and values, and a loan is in exactly one table
+    settled = sorted(loans["old"] + loans["old2"])
+    assert db.execute(select(LoanHistory.id).order_by(LoanHistory.id)).scalars().all() == settled
+    assert db.execute(select(Loan.id).where(Loan.id.in_(settled))).all() == []
+    history = db.execute(select(PaymentTermHistory.loan_id, PaymentTermHistory.amount)).all()
+    assert sorted({loan_id for loan_id, _ in history}) == settled
+    assert {amount for _, amount in history} == {100}
+    assert db.execute(select(PaymentTerm.id).where(PaymentTerm.loan_id.in_(settled))).all() == []
+
+    # Users' cached loan pages are invalidated
+    db.refresh(user)
+    assert user.data_version > 0
+
+    # A second run finds nothing new
+    result = archive_settled_loans(db, now, chunk_size=4, after_days=90)
+    assert (result["loans"], result["installments"]) == (0, 0)
+    assert db.execute(select(func.count()).select_from(LoanHistory)).scalar() == 6
+    db.close()
+
+
+def test_archived_ids_are_not_used_again():
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/archive_ids.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    now = datetime.now()
+    user = User(username="archived", email="archived@example.com", password="x", data_version=0)
+    db.add(user)
+    db.commit()
+
+    def add_loan(status, paid):
+        loan = Loan(amount=300.75, terms=1, status=status, user_id=user.id,
+                    remaining_installments=0 if paid else 1, outstanding_balance=0 if paid else 300.75)
+        db.add(loan)
+        db.flush()
+        installment = PaymentTerm(amount=300.75, due_date=now - timedelta(days=200),
+                                  payment_status="Paid" if paid else "Pending", user_id=user.id, loan_id=loan.id)
+        db.add(installment)
+        db.commit()
+        return loan.id, installment.id
+
+    add_loan("1", paid=False)
+    # The newest loan and installment are archived
+    loan_id, installment_id = add_loan("Paid", paid=True)
+    assert archive_settled_loans(db, now, after_days=90)["loans"] == 1
+    assert db.execute(select(LoanHistory.amount)).scalar() == 300.75
+
+    new_loan_id, new_installment_id = add_loan("Paid", paid=True)
+    assert new_loan_id > loan_id and new_installment_id > installment_id
+    # So the next run archives the new loan without a clash
+    assert archive_settled_loans(db, now, after_days=90)["loans"] == 1
+
+    # Imports may not take archived ids either
+    report = IngestReport()
+    ingest_loans(db, [(1, LoanImport(id=loan_id, user_id=user.id, amount=100, terms=1))], report)
+    open_loan = db.execute(select(Loan.id)).scalar()
+    ingest_payments(db, [(2, PaymentImport(id=installment_id, loan_id=open_loan, amount=100, due_date=now))], report)
+    assert report.as_dict()["errors"] == [
+        {"line": 1, "error": "Loan id already in use"},
+        {"line": 2, "error": "Payment id already in use"},
+    ]
+    db.close()
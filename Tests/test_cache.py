@@ -0,0 +1,46 @@
+import time
+
+from app.cache import TTLCache
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_expire():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("short", 1, ttl=0.01)
+    cache.set("default", 2)
+    time.sleep(0.02)
+
+    assert cache.get("short") is None
+    assert cache.get("default") == 2
+    assert len(cache) == 1
+
+    assert cache.pop("default") == 2
+    assert cache.get("default", "gone") == "gone"
+
+
+def test_fills_racing_an_invalidation_are_refused():
+    cache = TTLCache(maxsize=10)
+    generation = cache.generation
+
+    # A write invalidates the key while the fill was reading the database
+    cache.invalidate("user")
+    assert not cache.set_unless_invalidated("user", "stale", generation)
+    assert cache.get("user") is None
+
+    assert cache.set_unless_invalidated("user", "fresh", cache.generation)
+    assert cache.get("user") == "fresh"
@@ -1,12 +1,17 @@
 from sqlalchemy import delete
 from sqlalchemy.orm import Session
-from app.models.model import User, Loan, PaymentTerm
+from app.models.model import CollectionSummary, LoanHistory, LoanSummary, OutboxEvent, PaymentTermHistory, User, Loan, PaymentTerm
 
 def cleanup_database(db: Session):
     # Delete all records from the User and Loan tables to clean up the database
     db.execute(delete(PaymentTerm))
     db.execute(delete(Loan))
     db.execute(delete(User))
+    db.execute(delete(LoanSummary))
+    db.execute(delete(CollectionSummary))
+    db.execute(delete(PaymentTermHistory))
+    db.execute(delete(LoanHistory))
+    db.execute(delete(OutboxEvent))
     db.commit()
     db.close()
 
@@ -32,7 +37,7 @@ def create_test_user(db, username, password, email, admin = False, addLoans = Fa
             "amount": 1000,
             "terms": 6,
             "user_id": new_user.id,
-            "status": "Pending",
+            "status": "Waiting for approval",
         }
 
         # Create a new loan directly in the database
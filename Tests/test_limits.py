@@ -0,0 +1,59 @@
+import tempfile
+
+import pytest
+from fastapi import HTTPException
+
+from app.limits import AdmissionGate, MemoryBuckets, RateLimiter, SqliteBuckets, take_token
+
+
+def test_token_bucket_refills_at_rate_up_to_burst():
+    bucket, wait = take_token(None, rate=2, burst=3, now=100.0)
+    assert (bucket, wait) == ((2, 100.0), 0.0)
+    bucket, _ = take_token(bucket, 2, 3, 100.0)
+    bucket, _ = take_token(bucket, 2, 3, 100.0)
+    # Empty: the next token is half a second away
+    bucket, wait = take_token(bucket, 2, 3, 100.0)
+    assert wait == 0.5
+    bucket, wait = take_token(bucket, 2, 3, 100.5)
+    assert wait == 0.0
+    # Never refills past burst
+    bucket, _ = take_token(bucket, 2, 3, 1000.0)
+    assert bucket == (2, 1000.0)
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_rate_limiter_sheds_with_retry_after(shared):
+    if shared:
+        # Two stores on one file stand in for two worker processes
+        path = f"{tempfile.mkdtemp()}/buckets.db"
+        first, second = SqliteBuckets(path), SqliteBuckets(path)
+    else:
+        first = second = MemoryBuckets()
+    limiters = [RateLimiter("user", 0.5, 3, first), RateLimiter("user", 0.5, 3, second)]
+
+    for i in range(3):
+        limiters[i % 2].check(1)
+    with pytest.raises(HTTPException) as error:
+        limiters[1].check(1)
+    assert error.value.status_code == 429
+    assert error.value.headers["Retry-After"] == "2"
+
+    # Other keys and other limiters have buckets of their own
+    limiters[0].check(2)
+    RateLimiter("ip", 0.5, 3, first).check(1)
+    # A zero rate disables the limiter
+    RateLimiter("user", 0, 3, first).check(1)
+
+
+def test_admission_gate_sheds_past_its_limit():
+    gate = AdmissionGate(limit=2)
+    with gate.admit(), gate.admit():
+        assert gate.in_flight == 2
+        with pytest.raises(HTTPException) as error:
+            with gate.admit():
+                pass
+        assert error.value.status_code == 503
+        assert error.value.headers["Retry-After"] == "1"
+    assert gate.in_flight == 0
+    with gate.admit():
+        pass
@@ -1,15 +1,50 @@
+import asyncio
+import csv
 import datetime
+import httpx
+import io
 import os
+import pyarrow as pa
+import pyarrow.parquet as pq
 import json
+import jwt
+import tempfile
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine, delete
+from decimal import Decimal
+from sqlalchemy import Numeric, create_engine, delete, event, insert, literal, select, union_all, update
+from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
 from dotenv import load_dotenv
 from .test_helper import cleanup_database, create_test_user, login_user
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 # Import app and models
-from app.main import app, get_db
+from app.db import get_async_url
+from app.db import Base as AppBase
+from app.main import (
+    SECRET_KEY,
+    RowsJSONResponse,
+    encode_loans_ndjson,
+    find_earliest_pending_payment,
+    app,
+    get_db,
+    get_replica_db,
+    loans_statement,
+    next_due_cache,
+    password_hasher,
+    recent_writers,
+    token_cache,
+)
+from app.analytics import rebuild_portfolio_summary
+from app.archive import archive_settled_loans
+from app.export import ArrowEncoder, export_rows
+from app.limits import MemoryBuckets, RateLimiter
+from app.outbox import process_outbox
+from app.reconcile import reconcile_loan_counters
+from app.versions import bump_data_versions
+from app.writers import SqliteWriters
 from app.models.model import PaymentTerm, User, Loan
 
 load_dotenv()
@@ -59,6 +94,7 @@ def test_register_endpoint():
 
         # Assert that the user exists in the database
         assert created_user is not None
+        assert created_user.password != "testpassword"
 
     finally:
         cleanup_database(TestingSessionLocal())
@@ -320,4 +356,1105 @@ def test_make_payment():
     finally:
         # Clean up the database
         db = TestingSessionLocal()
-        cleanup_database(db)
\ No newline at end of file
+        cleanup_database(db)
+
+def test_async_session_mode():
+    # Each TestClient request runs on its own event loop, so don't pool connections
+    async_engine = create_async_engine(
+        get_async_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool
+    )
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_async_db
+    try:
+        test_user_data = {
+            "username": "testuser",
+            "password": "testpassword",
+            "email": "test@example.com",
+        }
+
+        # Register, log in and create a loan through the AsyncSession
+        response = client.post("/user/register/", json=test_user_data)
+        assert response.status_code == 200
+
+        response = client.post("/user/register/", json=test_user_data)
+        assert response.status_code == 400
+
+        login_response_data = login_user(client, "testuser", "testpassword")
+        headers = {
+            "Authorization": f"Bearer {login_response_data['access_token']}"
+        }
+
+        response = client.post("/loans/create", json={"amount": 1000, "terms": 6}, headers=headers)
+        assert response.status_code == 200
+
+        response = client.get("/loans/", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+
+        response = client.get("/loans/", params={"stream": "true"}, headers=headers)
+        assert response.status_code == 200
+        assert len(response.text.splitlines()) == 1
+
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+        cleanup_database(TestingSessionLocal())
+
+def test_get_loans_pagination_and_stream():
+    try:
+        db = TestingSessionLocal()
+
+        # Create a test user with five loans
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        user = db.query(User).filter_by(username="testuser").first()
+        for i in range(5):
+            db.add(Loan(amount=1000 + i, terms=6, user_id=user.id, status="Pending"))
+        db.commit()
+        loan_ids = [loan.id for loan in db.query(Loan).order_by(Loan.id).all()]
+        db.close()
+
+        login_response_data = login_user(client, "testuser", "testpassword")
+        headers = {
+            "Authorization": f"Bearer {login_response_data['access_token']}"
+        }
+
+        # Walk the pages using the cursor from the previous page
+        seen = []
+        params = {"limit": 2}
+        while True:
+            response = client.get("/loans/", params=params, headers=headers)
+            assert response.status_code == 200
+            seen += [loan["id"] for loan in response.json()]
+            if "X-Next-After" not in response.headers:
+                break
+            params["after"] = response.headers["X-Next-After"]
+        assert seen == loan_ids
+
+        # Stream every loan as NDJSON
+        response = client.get("/loans/", params={"stream": "true", "after": loan_ids[0]}, headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        streamed = [json.loads(line) for line in response.text.splitlines()]
+        assert [loan["id"] for loan in streamed] == loan_ids[1:]
+        assert streamed[0]["amount"] == 1001
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+def test_loan_amounts_keep_their_cents():
+    # loans.amount is DECIMAL(10,2); it is mapped without Decimal, and the
+    # list renders any Decimal that reaches it
+    sql = str(loans_statement(1, False).compile(dialect=mysql.dialect()))
+    assert "CAST" not in sql
+    response = RowsJSONResponse([{"id": 1, "amount": Decimal("1200.00"), "rate": Decimal("0.25")}])
+    assert json.loads(response.body) == [{"id": 1, "amount": 1200, "rate": 0.25}]
+    with engine.connect() as connection:
+        rows = connection.execute(union_all(*[
+            select(literal(loan_id).label("id"), literal(amount, Numeric(10, 2)).label("amount"))
+            for loan_id, amount in ((2, Decimal("300.00")), (3, Decimal("450.50")))
+        ])).all()
+    assert isinstance(rows[0].amount, Decimal)
+    assert encode_loans_ndjson(rows) == '{"id": 2, "amount": 300}\n{"id": 3, "amount": 450.5}\n'
+
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        user = db.query(User).filter_by(username="testuser").first()
+        db.execute(insert(Loan).values(amount=1200.75, terms=6, user_id=user.id, status="Pending"))
+        db.commit()
+        db.close()
+
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+        # The same on every backend, rather than rounded by one and truncated by another
+        assert [loan["amount"] for loan in client.get("/loans/", headers=headers).json()] == [1200.75]
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+def test_include_archived_loans():
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        create_test_user(db, "adminuser", "adminpassword", "admin@example.com", admin=True)
+        user = db.query(User).filter_by(username="testuser").first()
+        settled_due = datetime.now() - timedelta(days=200)
+        for status in ("Paid", "Pending", "Paid", "Pending"):
+            loan = Loan(amount=1000, terms=1, user_id=user.id, status=status, remaining_installments=0)
+            db.add(loan)
+            db.flush()
+            db.add(PaymentTerm(amount=1000, due_date=settled_due, payment_status="Paid" if status == "Paid" else "Pending",
+                               user_id=user.id, loan_id=loan.id))
+        db.commit()
+        loan_ids = [loan.id for loan in db.query(Loan).order_by(Loan.id).all()]
+        assert archive_settled_loans(db)["loans"] == 2
+        db.close()
+
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+        response = client.get("/loans/", headers=headers)
+        assert [loan["id"] for loan in response.json()] == [loan_ids[1], loan_ids[3]]
+
+        # Archived loans come back in id order, page by page and streamed
+        seen = []
+        params = {"limit": 3, "include_archived": "true"}
+        while True:
+            response = client.get("/loans/", params=params, headers=headers)
+            seen += response.json()
+            if "X-Next-After" not in response.headers:
+                break
+            params["after"] = response.headers["X-Next-After"]
+        assert [loan["id"] for loan in seen] == loan_ids
+        assert [loan["status"] for loan in seen] == ["Paid", "Pending", "Paid", "Pending"]
+
+        response = client.get("/loans/", params={"stream": "true", "include_archived": "true"}, headers=headers)
+        assert [json.loads(line)["id"] for line in response.text.splitlines()] == loan_ids
+
+        headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+        response = client.get("/export/payments", params={"status": "Paid", "include_archived": "true"}, headers=headers)
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [int(row["loan_id"]) for row in rows] == [loan_ids[0], loan_ids[2]]
+        response = client.get("/export/payments", params={"status": "Paid"}, headers=headers)
+        assert list(csv.DictReader(io.StringIO(response.text))) == []
+
+        # The portfolio totals still count archived loans
+        db = TestingSessionLocal()
+        rebuild_portfolio_summary(db)
+        db.close()
+        summary = client.get("/analytics/portfolio", headers=headers).json()
+        assert summary["loans"] == 4
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+def test_batch_loan_decision():
+    try:
+        db = TestingSessionLocal()
+
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        create_test_user(db, "admin", "adminpassword", "admin@example.com", admin=True)
+        user = db.query(User).filter_by(username="testuser").first()
+        for terms in (3, 4, 5):
+            db.add(Loan(amount=1200, terms=terms, user_id=user.id, status="Waiting for approval"))
+        db.commit()
+        loan_ids = [loan.id for loan in db.query(Loan).order_by(Loan.id).all()]
+        db.close()
+
+        batch_data = {"ids": loan_ids[:2] + [loan_ids[-1] + 100], "decision": 1}
+
+        # Regular users may not decide loans
+        login_response_data = login_user(client, "testuser", "testpassword")
+        headers = {"Authorization": f"Bearer {login_response_data['access_token']}"}
+        response = client.post("/loans/decision/batch", json=batch_data, headers=headers)
+        assert response.json() == {"message": "User is not permitted."}
+
+        # Approve two loans and report the unknown id
+        login_response_data = login_user(client, "admin", "adminpassword")
+        headers = {"Authorization": f"Bearer {login_response_data['access_token']}"}
+        response = client.post("/loans/decision/batch", json=batch_data, headers=headers)
+        assert response.status_code == 200
+        response_data = response.json()
+        assert response_data["updated"] == 2
+        assert response_data["skipped"] == []
+        assert response_data["not_found"] == [loan_ids[-1] + 100]
+
+        # Reject the third one
+        response = client.post("/loans/decision/batch", json={"ids": [loan_ids[2]], "decision": 0}, headers=headers)
+        assert response.json()["updated"] == 1
+
+        db = TestingSessionLocal()
+        statuses = [loan.status for loan in db.query(Loan).order_by(Loan.id).all()]
+        assert statuses == ["1", "1", "0"]
+        for loan_id, terms in zip(loan_ids, (3, 4, 0)):
+            payment_terms = db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan_id).all()
+            assert len(payment_terms) == terms
+            assert all(term.payment_status == "Pending" for term in payment_terms)
+        db.close()
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_decided_loans_are_not_decided_again():
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        create_test_user(db, "admin", "adminpassword", "admin@example.com", admin=True)
+        user = db.query(User).filter_by(username="testuser").first()
+        for terms in (3, 4):
+            db.add(Loan(amount=1200, terms=terms, user_id=user.id, status="Waiting for approval"))
+        db.commit()
+        loan_ids = [loan.id for loan in db.query(Loan).order_by(Loan.id).all()]
+        db.close()
+
+        headers = {"Authorization": f"Bearer {login_user(client, 'admin', 'adminpassword')['access_token']}"}
+        response = client.post("/loans/decision", json={"id": loan_ids[0], "decision": 1}, headers=headers)
+        assert response.json() == {"message": "Loan status updated successfully."}
+
+        # Approving again would schedule the installments twice, and rejecting
+        # would strand them
+        for decision in (1, 0):
+            response = client.post("/loans/decision", json={"id": loan_ids[0], "decision": decision}, headers=headers)
+            assert response.json() == {"message": "Loan has already been decided.", "skipped": [loan_ids[0]]}
+
+        response = client.post("/loans/decision/batch", json={"ids": loan_ids, "decision": 0}, headers=headers)
+        assert response.json() == {
+            "message": "Loan statuses updated successfully.",
+            "updated": 1,
+            "skipped": [loan_ids[0]],
+            "not_found": [],
+        }
+        response = client.post("/loans/decision/batch", json={"ids": loan_ids, "decision": 1}, headers=headers)
+        assert response.json()["updated"] == 0
+        assert response.json()["skipped"] == loan_ids
+
+        db = TestingSessionLocal()
+        assert [loan.status for loan in db.query(Loan).order_by(Loan.id).all()] == ["1", "0"]
+        assert db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan_ids[0]).count() == 3
+        assert db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan_ids[1]).count() == 0
+        # Only the two decisions that changed a loan published an event
+        assert process_outbox(db)["processed"] == 2
+        db.close()
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_payments_count_loans_without_counters():
+    # Loans written before the counters existed have zero in both; paying
+    # them counts their unpaid installments instead of closing them
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        user = db.query(User).filter_by(username="testuser").first()
+        loans = [Loan(amount=300, terms=3, user_id=user.id, status="1") for _ in range(2)]
+        db.add_all(loans)
+        db.flush()
+        db.add_all([
+            PaymentTerm(amount=100, due_date=datetime.now() + timedelta(days=7 * (i + 1)), payment_status="Pending",
+                        user_id=user.id, loan_id=loan.id)
+            for loan in loans for i in range(3)
+        ])
+        db.commit()
+        loan_ids = [loan.id for loan in loans]
+        payment_ids = [term.id for term in db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan_ids[0]).order_by(PaymentTerm.id)]
+        db.close()
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        client.post("/payments/make-payment/", json={"payment_id": payment_ids[0], "amount": 100}, headers=headers)
+        response = client.post("/payments/prepay/", json={"loan_id": loan_ids[1], "amount": 100}, headers=headers)
+        assert response.json()["remaining_installments"] == 2
+
+        db = TestingSessionLocal()
+        counters = [(loan.status, loan.remaining_installments, loan.outstanding_balance)
+                    for loan in db.query(Loan).order_by(Loan.id)]
+        assert counters == [("1", 2, 200), ("1", 2, 200)]
+        db.close()
+
+        for payment_id in payment_ids[1:]:
+            client.post("/payments/make-payment/", json={"payment_id": payment_id, "amount": 100}, headers=headers)
+        db = TestingSessionLocal()
+        assert db.query(Loan).filter(Loan.id == loan_ids[0]).one().status == "Paid"
+        db.close()
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_loan_settlement_counters():
+    try:
+        db = TestingSessionLocal()
+
+        create_test_user(db, "testuser", "testpassword", "test@example.com", addLoans=True)
+        create_test_user(db, "admin", "adminpassword", "admin@example.com", admin=True)
+        loan_id = db.query(Loan).first().id
+        db.close()
+
+        # Approving the loan sets its counters
+        login_response_data = login_user(client, "admin", "adminpassword")
+        headers = {"Authorization": f"Bearer {login_response_data['access_token']}"}
+        client.post("/loans/decision", json={"id": loan_id, "decision": 1}, headers=headers)
+
+        db = TestingSessionLocal()
+        loan = db.query(Loan).filter(Loan.id == loan_id).first()
+        assert loan.remaining_installments == 6
+        assert loan.outstanding_balance == 1000
+        payment_ids = [term.id for term in db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan_id).order_by(PaymentTerm.id)]
+        db.close()
+
+        login_response_data = login_user(client, "testuser", "testpassword")
+        headers = {"Authorization": f"Bearer {login_response_data['access_token']}"}
+
+        # Paying the same installment twice only counts once
+        for payment_id in (payment_ids[0], payment_ids[0]):
+            response = client.post("/payments/make-payment/", json={"payment_id": payment_id, "amount": 1000}, headers=headers)
+            assert response.status_code == 200
+
+        db = TestingSessionLocal()
+        loan = db.query(Loan).filter(Loan.id == loan_id).first()
+        assert loan.remaining_installments == 5
+        assert loan.status == "1"
+        db.close()
+
+        for payment_id in payment_ids[1:]:
+            response = client.post("/payments/make-payment/", json={"payment_id": payment_id, "amount": 1000}, headers=headers)
+            assert response.status_code == 200
+
+        # The last installment closes the loan
+        db = TestingSessionLocal()
+        loan = db.query(Loan).filter(Loan.id == loan_id).first()
+        assert loan.status == "Paid"
+        assert loan.remaining_installments == 0
+        assert abs(loan.outstanding_balance) < 0.01
+
+        # Reconciliation rebuilds counters from the installments
+        db.query(PaymentTerm).filter(PaymentTerm.id == payment_ids[0]).update({"payment_status": "Pending"})
+        db.query(Loan).update({"remaining_installments": 42, "outstanding_balance": 42})
+        db.commit()
+        assert reconcile_loan_counters(db, chunk_size=1) == 1
+        loan = db.query(Loan).filter(Loan.id == loan_id).first()
+        assert loan.remaining_installments == 1
+        assert abs(loan.outstanding_balance - 1000 / 6) < 0.01
+        db.close()
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_token_claims_and_cache():
+    try:
+        create_test_user(TestingSessionLocal(), "admin", "adminpassword", "admin@example.com", admin=True)
+        access_token = login_user(client, "admin", "adminpassword")["access_token"]
+
+        # The role and expiry travel in the token
+        payload = jwt.decode(access_token, SECRET_KEY, algorithms=["HS256"])
+        assert payload["admin"] is True
+        assert payload["exp"] > datetime.utcnow().timestamp()
+
+        headers = {"Authorization": f"Bearer {access_token}"}
+        response = client.get("/loans/", headers=headers)
+        assert response.status_code == 200
+        assert token_cache.get(access_token)["admin"] is True
+
+        # Expired tokens and tokens without an expiry are rejected
+        expired = jwt.encode(
+            {"sub": "admin", "id": 1, "admin": True, "exp": datetime.utcnow() - timedelta(minutes=1)},
+            SECRET_KEY, algorithm="HS256",
+        )
+        response = client.get("/loans/", headers={"Authorization": f"Bearer {expired}"})
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Token has expired"
+
+        no_expiry = jwt.encode({"sub": "admin", "id": 1, "admin": True}, SECRET_KEY, algorithm="HS256")
+        response = client.get("/loans/", headers={"Authorization": f"Bearer {no_expiry}"})
+        assert response.status_code == 401
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_login_rehashes_passwords():
+    try:
+        # create_test_user stores the password in plain text, as before hashing
+        create_test_user(TestingSessionLocal(), "testuser", "testpassword", "test@example.com")
+
+        assert "access_token" in login_user(client, "testuser", "testpassword")
+        db = TestingSessionLocal()
+        stored = db.query(User).filter_by(username="testuser").first().password
+        db.close()
+        assert stored != "testpassword"
+        assert not password_hasher.needs_rehash(stored)
+
+        # The hashed password keeps working, and wrong ones are still refused
+        assert "access_token" in login_user(client, "testuser", "testpassword")
+        response = client.post("/user/login/", data={"username": "testuser", "password": "wrong"})
+        assert response.status_code == 401
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_rate_limits_per_user_and_address(monkeypatch):
+    buckets = MemoryBuckets()
+    monkeypatch.setattr("app.main.user_limiter", RateLimiter("user", 0.1, 3, buckets))
+    monkeypatch.setattr("app.main.ip_limiter", RateLimiter("ip", 0.1, 2, buckets))
+    try:
+        create_test_user(TestingSessionLocal(), "testuser", "testpassword", "test@example.com")
+        create_test_user(TestingSessionLocal(), "otheruser", "otherpassword", "other@example.com")
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+        other_headers = {"Authorization": f"Bearer {login_user(client, 'otheruser', 'otherpassword')['access_token']}"}
+
+        # The client address has spent its two logins
+        response = client.post("/user/login/", data={"username": "testuser", "password": "testpassword"})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "10"
+
+        for _ in range(3):
+            assert client.get("/loans/", headers=headers).status_code == 200
+        response = client.get("/loans/", headers=headers)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) > 0
+
+        # Other users keep their own budget
+        assert client.get("/loans/", headers=other_headers).status_code == 200
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_read_replica_routing(monkeypatch):
+    # An empty second database stands in for a replica that lags behind
+    replica_engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/replica.db")
+    AppBase.metadata.create_all(bind=replica_engine)
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+
+    def override_get_replica_db():
+        db = ReplicaSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # Counts primary sessions opened
+    primary_sessions = []
+
+    def override_get_primary_db():
+        primary_sessions.append(True)
+        yield from override_get_db()
+
+    app.dependency_overrides[get_replica_db] = override_get_replica_db
+    app.dependency_overrides[get_db] = override_get_primary_db
+    recent_writers.clear()
+    try:
+        create_test_user(TestingSessionLocal(), "testuser", "testpassword", "test@example.com", addLoans=True)
+        login_response_data = login_user(client, "testuser", "testpassword")
+        headers = {"Authorization": f"Bearer {login_response_data['access_token']}"}
+
+        # Reads go to the replica, without a primary session or its admission
+        opened = len(primary_sessions)
+        response = client.get("/loans/", headers=headers)
+        assert response.json() == []
+        assert len(primary_sessions) == opened
+
+        # Right after their own write, the user reads from the primary
+        client.post("/loans/create", json={"amount": 1000, "terms": 6}, headers=headers)
+        response = client.get("/loans/", headers=headers)
+        assert len(response.json()) == 2
+
+        # Once the read-your-writes window has passed, reads return to the replica
+        recent_writers.clear()
+        response = client.get("/loans/", headers=headers)
+        assert response.json() == []
+
+        # A write taken by another worker process of the host routes reads
+        # to the primary too, through the shared store
+        path = f"{tempfile.mkdtemp()}/writers.db"
+        monkeypatch.setattr("app.main.recent_writers", SqliteWriters(path))
+        db = TestingSessionLocal()
+        user_id = db.query(User).filter(User.username == "testuser").first().id
+        db.close()
+        SqliteWriters(path).record(user_id)
+        response = client.get("/loans/", headers=headers)
+        assert len(response.json()) == 2
+
+    finally:
+        del app.dependency_overrides[get_replica_db]
+        app.dependency_overrides[get_db] = override_get_db
+        recent_writers.clear()
+        cleanup_database(TestingSessionLocal())
+
+
+def test_next_due_cache_never_serves_paid_installment():
+    next_due_cache.clear()
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "adminuser", "adminpassword", "admin@example.com", admin=True)
+        create_test_user(db, "testuser", "testpassword", "test@example.com", addLoans=True)
+        loan = db.query(Loan).order_by(Loan.id.desc()).first()
+        loan_id = loan.id
+        db.close()
+
+        admin_headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        # Nothing is due before approval, and that answer is cached too
+        response = client.get("/payments/pending-earliest-due-date", headers=headers)
+        assert response.json() == {"message": "No pending payments with future due dates found."}
+
+        # Approval invalidates the cached answer
+        client.post("/loans/decision", json={"id": loan_id, "decision": 1}, headers=admin_headers)
+        first = client.get("/payments/pending-earliest-due-date", headers=headers).json()
+        assert first["loan_id"] == loan_id
+
+        # Polls are served from the cache until the user pays
+        hits = next_due_cache.hits
+        assert client.get("/payments/pending-earliest-due-date", headers=headers).json() == first
+        assert next_due_cache.hits == hits + 1
+
+        for _ in range(6):
+            due = client.get("/payments/pending-earliest-due-date", headers=headers).json()
+            assert "id" in due
+            response = client.post(
+                "/payments/make-payment/", json={"payment_id": due["id"], "amount": 1000}, headers=headers
+            )
+            assert response.json()["message"] == "Payment successful. Payment marked as Paid."
+
+            # The paid installment is never served again
+            after = client.get("/payments/pending-earliest-due-date", headers=headers).json()
+            assert after.get("id") != due["id"]
+
+        assert after == {"message": "No pending payments with future due dates found."}
+
+    finally:
+        next_due_cache.clear()
+        cleanup_database(TestingSessionLocal())
+
+
+def test_next_due_cache_sees_writes_from_other_workers():
+    next_due_cache.clear()
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "adminuser", "adminpassword", "admin@example.com", admin=True)
+        create_test_user(db, "testuser", "testpassword", "test@example.com", addLoans=True)
+        loan_id = db.query(Loan).order_by(Loan.id.desc()).first().id
+        db.close()
+
+        admin_headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        client.post("/loans/decision", json={"id": loan_id, "decision": 1}, headers=admin_headers)
+        first = client.get("/payments/pending-earliest-due-date", headers=headers).json()
+        hits = next_due_cache.hits
+        assert client.get("/payments/pending-earliest-due-date", headers=headers).json() == first
+        assert next_due_cache.hits == hits + 1
+
+        # Another worker process takes the payment; this one's cache is not told
+        db = TestingSessionLocal()
+        user_id = db.query(User).filter(User.username == "testuser").first().id
+        db.execute(update(PaymentTerm).where(PaymentTerm.id == first["id"]).values(payment_status="Paid"))
+        bump_data_versions(db, [user_id])
+        db.commit()
+        db.close()
+
+        after = client.get("/payments/pending-earliest-due-date", headers=headers).json()
+        assert after["loan_id"] == loan_id
+        assert after["id"] != first["id"]
+
+    finally:
+        next_due_cache.clear()
+        cleanup_database(TestingSessionLocal())
+
+
+def test_conditional_get_with_etags():
+    next_due_cache.clear()
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "adminuser", "adminpassword", "admin@example.com", admin=True)
+        create_test_user(db, "testuser", "testpassword", "test@example.com", addLoans=True)
+        loan_id = db.query(Loan).order_by(Loan.id.desc()).first().id
+        db.close()
+
+        admin_headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        def revalidate(path, response, headers):
+            return client.get(path, headers=dict(headers, **{"If-None-Match": response.headers["ETag"]}))
+
+        loans = client.get("/loans/", headers=headers)
+        admin_loans = client.get("/loans/", headers=admin_headers)
+        due = client.get("/payments/pending-earliest-due-date", headers=headers)
+        assert revalidate("/loans/", loans, headers).status_code == 304
+        assert revalidate("/loans/", admin_loans, admin_headers).status_code == 304
+        assert revalidate("/payments/pending-earliest-due-date", due, headers).status_code == 304
+
+        # Without the cached answer the tag is checked against the version alone
+        next_due_cache.clear()
+        response = revalidate("/payments/pending-earliest-due-date", due, headers)
+        assert response.status_code == 304
+        assert response.headers["ETag"] == due.headers["ETag"]
+
+        # Approval changes the user's loans and schedule and every admin's view
+        client.post("/loans/decision", json={"id": loan_id, "decision": 1}, headers=admin_headers)
+        for path, response, request_headers in (
+            ("/loans/", loans, headers),
+            ("/loans/", admin_loans, admin_headers),
+            ("/payments/pending-earliest-due-date", due, headers),
+        ):
+            changed = revalidate(path, response, request_headers)
+            assert changed.status_code == 200
+            assert changed.headers["ETag"] != response.headers["ETag"]
+
+        due = client.get("/payments/pending-earliest-due-date", headers=headers)
+        client.post("/payments/make-payment/", json={"payment_id": due.json()["id"], "amount": 1000}, headers=headers)
+        response = revalidate("/payments/pending-earliest-due-date", due, headers)
+        assert response.status_code == 200
+        assert response.json()["id"] != due.json()["id"]
+
+    finally:
+        next_due_cache.clear()
+        cleanup_database(TestingSessionLocal())
+
+
+def test_next_due_with_date_due_dates(monkeypatch):
+    # The MySQL drivers return payment_status.due_date, a DATE column, as a date
+    def find_as_mysql(db, user_id):
+        payment = find_earliest_pending_payment(db, user_id)
+        return dict(payment, due_date=payment["due_date"].date()) if payment else None
+
+    monkeypatch.setattr("app.main.find_earliest_pending_payment", find_as_mysql)
+    next_due_cache.clear()
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "adminuser", "adminpassword", "admin@example.com", admin=True)
+        create_test_user(db, "testuser", "testpassword", "test@example.com", addLoans=True)
+        loan_id = db.query(Loan).order_by(Loan.id.desc()).first().id
+        db.close()
+
+        admin_headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+        client.post("/loans/decision", json={"id": loan_id, "decision": 1}, headers=admin_headers)
+
+        due = client.get("/payments/pending-earliest-due-date", headers=headers)
+        assert due.status_code == 200
+        assert due.json()["loan_id"] == loan_id
+        due_date = datetime.fromisoformat(due.json()["due_date"]).date()
+        assert due.headers["ETag"].strip('"').split("-")[1] == str(int(datetime.combine(due_date, datetime.min.time()).timestamp()))
+
+        # Revalidated from the version alone
+        next_due_cache.clear()
+        response = client.get("/payments/pending-earliest-due-date", headers=dict(headers, **{"If-None-Match": due.headers["ETag"]}))
+        assert response.status_code == 304
+
+        # And from the cached answer, whose due date is compared with now
+        assert client.get("/payments/pending-earliest-due-date", headers=headers).json() == due.json()
+        hits = next_due_cache.hits
+        assert client.get("/payments/pending-earliest-due-date", headers=headers).json() == due.json()
+        assert next_due_cache.hits == hits + 1
+
+    finally:
+        next_due_cache.clear()
+        cleanup_database(TestingSessionLocal())
+
+
+def test_prepay_loan():
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        user = db.query(User).order_by(User.id.desc()).first()
+        loan = Loan(amount=1200, terms=12, user_id=user.id, status="1",
+                    remaining_installments=12, outstanding_balance=1200)
+        db.add(loan)
+        db.commit()
+        db.add_all([
+            PaymentTerm(amount=100, due_date=datetime.now() + timedelta(days=7 * (i + 1)),
+                        payment_status="Pending", user_id=user.id, loan_id=loan.id)
+            for i in range(12)
+        ])
+        db.commit()
+        loan_id = loan.id
+        db.close()
+
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        response = client.post("/payments/prepay/", json={"loan_id": loan_id, "amount": 50}, headers=headers)
+        assert response.json()["message"] == "Transiction failed. Payment amount is less than the due amount."
+
+        # 250 settles the two earliest installments in full
+        response = client.post("/payments/prepay/", json={"loan_id": loan_id, "amount": 250}, headers=headers)
+        result = response.json()
+        assert len(result["paid_installments"]) == 2
+        assert result["amount_applied"] == 200
+        assert result["unapplied_amount"] == 50
+        assert result["remaining_installments"] == 10
+        assert result["outstanding_balance"] == 1000
+
+        db = TestingSessionLocal()
+        earliest = db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan_id).order_by(PaymentTerm.due_date).limit(2)
+        assert sorted(payment.id for payment in earliest) == sorted(result["paid_installments"])
+        db.close()
+
+        # Paying off the rest closes the loan
+        response = client.post("/payments/prepay/", json={"loan_id": loan_id, "amount": 1000}, headers=headers)
+        assert response.json()["remaining_installments"] == 0
+
+        db = TestingSessionLocal()
+        loan = db.query(Loan).filter(Loan.id == loan_id).first()
+        assert (loan.status, loan.remaining_installments, loan.outstanding_balance) == ("Paid", 0, 0)
+        db.close()
+
+        response = client.post("/payments/prepay/", json={"loan_id": loan_id + 1, "amount": 100}, headers=headers)
+        assert response.status_code == 404
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_concurrent_prepayments_apply_each_installment_once():
+    async_engine = create_async_engine(get_async_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_async_db
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        user = db.query(User).order_by(User.id.desc()).first()
+        loans = [
+            Loan(amount=1200, terms=12, user_id=user.id, status="1",
+                 remaining_installments=12, outstanding_balance=1200)
+            for _ in range(3)
+        ]
+        db.add_all(loans)
+        db.commit()
+        db.add_all([
+            PaymentTerm(amount=100, due_date=datetime.now() + timedelta(days=7 * (i + 1)),
+                        payment_status="Pending", user_id=user.id, loan_id=loan.id)
+            for loan in loans
+            for i in range(12)
+        ])
+        db.commit()
+        loan_ids = [loan.id for loan in loans]
+        installments = [(payment.id, payment.loan_id) for payment in db.query(PaymentTerm)]
+        db.close()
+
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        async def pay_concurrently():
+            # Prepayments race each other and single-installment payments
+            async with httpx.AsyncClient(app=app, base_url="http://test") as async_client:
+                requests = [
+                    async_client.post("/payments/prepay/", json={"loan_id": loan_id, "amount": 300}, headers=headers)
+                    for loan_id in loan_ids
+                    for _ in range(3)
+                ]
+                requests += [
+                    async_client.post("/payments/make-payment/", json={"payment_id": payment_id, "amount": 100},
+                                      headers=headers)
+                    for payment_id, loan_id in installments[::2]
+                ]
+                return await asyncio.gather(*requests)
+
+        # SQLite ignores FOR UPDATE, so this covers the compare-and-set
+        # retries but not MySQL's row locks or their order; that is what
+        # test_payments_lock_the_loan_first checks
+        responses = asyncio.run(pay_concurrently())
+        assert {response.status_code for response in responses} <= {200, 409}
+
+        # Counters agree with the installments marked paid, and every one of
+        # them was paid by exactly one request: make-payment's are all paid,
+        # and prepayments account for the rest
+        prepaid = [
+            payment_id
+            for response in responses
+            if response.status_code == 200 and "paid_installments" in response.json()
+            for payment_id in response.json()["paid_installments"]
+        ]
+        assert len(prepaid) == len(set(prepaid))
+
+        db = TestingSessionLocal()
+        for loan in db.query(Loan).filter(Loan.id.in_(loan_ids)):
+            unpaid = db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan.id, PaymentTerm.payment_status != "Paid").all()
+            assert loan.remaining_installments == len(unpaid)
+            assert loan.outstanding_balance == sum(payment.amount for payment in unpaid)
+            assert loan.status == ("Paid" if not unpaid else "1")
+        paid = {payment.id for payment in db.query(PaymentTerm).filter(PaymentTerm.payment_status == "Paid")}
+        assert {payment_id for payment_id, _ in installments[::2]} <= paid
+        assert set(prepaid) <= paid
+        db.close()
+
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+        cleanup_database(TestingSessionLocal())
+
+
+def test_payments_lock_the_loan_first():
+    # Both payment paths lock the loan before its installments, so that on
+    # MySQL they cannot deadlock each other
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        user = db.query(User).order_by(User.id.desc()).first()
+        loan = Loan(amount=300, terms=3, user_id=user.id, status="1", remaining_installments=3, outstanding_balance=300)
+        db.add(loan)
+        db.commit()
+        db.add_all([
+            PaymentTerm(amount=100, due_date=datetime.now() + timedelta(days=7 * (i + 1)),
+                        payment_status="Pending", user_id=user.id, loan_id=loan.id)
+            for i in range(3)
+        ])
+        db.commit()
+        loan_id = loan.id
+        payment_id = db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan_id).first().id
+        db.close()
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(" ".join(statement.split()))
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            for path, body in (
+                ("/payments/make-payment/", {"payment_id": payment_id, "amount": 100}),
+                ("/payments/prepay/", {"loan_id": loan_id, "amount": 100}),
+            ):
+                statements.clear()
+                assert client.post(path, json=body, headers=headers).status_code == 200
+                # The loan is locked before any installment is written
+                first_write = next(i for i, statement in enumerate(statements) if statement.startswith("UPDATE"))
+                assert statements[first_write].startswith("UPDATE loans") or any(
+                    "FROM loans " in statement for statement in statements[:first_write]
+                ), path
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_export_loans_and_payments():
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "adminuser", "adminpassword", "admin@example.com", admin=True)
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        user = db.query(User).filter(User.username == "testuser").first()
+        now = datetime.now()
+        db.add_all([
+            Loan(amount=1000 + i, terms=6, user_id=user.id, status="1" if i % 2 else "Paid",
+                 start_date=now - timedelta(days=i))
+            for i in range(5)
+        ])
+        db.commit()
+        loan = db.query(Loan).first()
+        db.add_all([
+            PaymentTerm(amount=1000 / 6, due_date=now + timedelta(days=7 * (i + 1)),
+                        payment_status="Pending" if i else "Late", user_id=user.id, loan_id=loan.id)
+            for i in range(6)
+        ])
+        db.commit()
+        db.close()
+
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+        response = client.get("/export/loans", headers=headers)
+        assert response.json() == {"message": "User is not permitted."}
+
+        headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+
+        # CSV, filtered by status and start date
+        response = client.get(
+            "/export/loans",
+            params={"status": "1", "since": (now - timedelta(days=3, hours=1)).isoformat()},
+            headers=headers,
+        )
+        assert response.headers["content-type"].startswith("text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [int(row["amount"]) for row in rows] == [1001, 1003]
+
+        # Parquet and Arrow IPC carry typed columns
+        response = client.get("/export/payments", params={"format": "parquet"}, headers=headers)
+        table = pq.read_table(io.BytesIO(response.content))
+        assert table.num_rows == 6
+        assert table.schema.field("due_date").type == pa.timestamp("us")
+
+        response = client.get("/export/payments", params={"format": "arrow", "status": "Late"}, headers=headers)
+        table = pa.ipc.open_stream(response.content).read_all()
+        assert table.column("payment_status").to_pylist() == ["Late"]
+
+        assert client.get("/export/users", headers=headers).status_code == 404
+
+        # Each chunk of rows becomes its own Parquet row group
+        output = io.BytesIO()
+        db = TestingSessionLocal()
+        assert export_rows(db, "payments", "parquet", output, chunk_size=2) == 6
+        db.close()
+        assert pq.ParquetFile(io.BytesIO(output.getvalue())).num_row_groups == 3
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_arrow_exports_take_date_values():
+    # The MySQL drivers return payment_status.due_date, a DATE column, as a date
+    rows = [(1, 1, 1, 100.0, date(2026, 1, 1), "Pending"), (2, 1, 1, 100.0, datetime(2026, 2, 1), "Paid")]
+    for fmt, read in (
+        ("parquet", lambda data: pq.read_table(io.BytesIO(data))),
+        ("arrow", lambda data: pa.ipc.open_stream(data).read_all()),
+    ):
+        encoder = ArrowEncoder("payments", fmt)
+        data = encoder.encode(rows) + encoder.finish()
+        assert read(data).column("due_date").to_pylist() == [datetime(2026, 1, 1), datetime(2026, 2, 1)]
+
+
+def test_bulk_ingest():
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "adminuser", "adminpassword", "admin@example.com", admin=True)
+        db.close()
+        headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+
+        users = "\n".join([
+            json.dumps({"username": "alice", "password": "alicepassword", "email": "alice@example.com"}),
+            json.dumps({"username": "bob", "password": "bobpassword", "email": "bob@example.com"}),
+            "{not json",
+            json.dumps({"username": "carol", "password": "carolpassword"}),
+            json.dumps({"username": "alice", "password": "again", "email": "alice2@example.com"}),
+            json.dumps({"username": "dave", "password": "scrypt$14$not-base64$", "email": "dave@example.com"}),
+        ])
+        response = client.post("/ingest/users", params={"chunk_size": 2}, data=users, headers=headers)
+        report = response.json()
+        assert (report["received"], report["inserted"], report["failed"]) == (6, 2, 4)
+        assert [error["line"] for error in report["errors"]] == [3, 4, 5, 6]
+        assert report["errors"][1]["error"] == "email: field required"
+        assert report["errors"][2]["error"] == "Username or email already in use"
+        assert report["errors"][3]["error"] == "Malformed scrypt password hash"
+
+        # Imported passwords are hashed, and the users can log in
+        assert "access_token" in login_user(client, "bob", "bobpassword")
+
+        loans = "id,username,amount,terms,status\n9001,alice,1200,12,1\n9002,bob,600,6,1\n,nobody,100,1,1\n9003,bob,100,24,1\n"
+        response = client.post(
+            "/ingest/loans", data=loans, headers=dict(headers, **{"Content-Type": "text/csv"})
+        )
+        report = response.json()
+        assert (report["inserted"], report["failed"]) == (2, 2)
+        assert report["errors"][0] == {"line": 4, "error": "User not found"}
+        assert report["errors"][1]["line"] == 5
+
+        due = datetime.now() + timedelta(days=7)
+        payments = "\n".join(
+            json.dumps({"loan_id": 9001, "amount": 100, "due_date": (due + timedelta(days=7 * i)).isoformat(),
+                        "payment_status": "Paid" if i < 2 else "Pending"})
+            for i in range(12)
+        ) + "\n" + json.dumps({"loan_id": 1, "amount": 100, "due_date": due.isoformat()})
+        report = client.post("/ingest/payments", data=payments, headers=headers).json()
+        assert (report["inserted"], report["failed"]) == (12, 1)
+
+        # The loans' settlement counters count the imported schedule
+        db = TestingSessionLocal()
+        loan = db.query(Loan).filter(Loan.id == 9001).first()
+        assert (loan.remaining_installments, loan.outstanding_balance) == (10, 1000)
+        db.close()
+
+        # So does the portfolio summary
+        summary = client.get("/analytics/portfolio", headers=headers).json()
+        assert (summary["loans"], summary["outstanding_balance"]) == (2, 1000)
+        db = TestingSessionLocal()
+        rebuild_portfolio_summary(db)
+        db.close()
+        assert client.get("/analytics/portfolio", headers=headers).json() == summary
+
+        user_headers = {"Authorization": f"Bearer {login_user(client, 'bob', 'bobpassword')['access_token']}"}
+        assert client.post("/ingest/users", data="", headers=user_headers).json() == {"message": "User is not permitted."}
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_portfolio_analytics_follow_writes():
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "adminuser", "adminpassword", "admin@example.com", admin=True)
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        db.close()
+        admin_headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        for amount, terms in ((1200, 12), (600, 6), (300, 3), (1000, 4)):
+            client.post("/loans/create", json={"amount": amount, "terms": terms}, headers=headers)
+        db = TestingSessionLocal()
+        loan_ids = [loan.id for loan in db.query(Loan).order_by(Loan.id)]
+        db.close()
+
+        client.post("/loans/decision", json={"id": loan_ids[0], "decision": 1}, headers=admin_headers)
+        client.post("/loans/decision/batch", json={"ids": loan_ids[1:3], "decision": 1}, headers=admin_headers)
+        client.post("/loans/decision/batch", json={"ids": [loan_ids[3]], "decision": 0}, headers=admin_headers)
+
+        due = client.get("/payments/pending-earliest-due-date", headers=headers).json()
+        client.post("/payments/make-payment/", json={"payment_id": due["id"], "amount": due["amount"]}, headers=headers)
+        client.post("/payments/prepay/", json={"loan_id": loan_ids[1], "amount": 300}, headers=headers)
+        # Paying off the last loan moves it to Paid
+        client.post("/payments/prepay/", json={"loan_id": loan_ids[2], "amount": 300}, headers=headers)
+
+        # Decisions and payments reach the totals through the outbox
+        summary = client.get("/analytics/portfolio", params={"weeks": 6}, headers=admin_headers).json()
+        assert {row["status"] for row in summary["by_status"]} == {"Waiting for approval"}
+        db = TestingSessionLocal()
+        assert process_outbox(db)["processed"] == 6
+        db.close()
+
+        response = client.get("/analytics/portfolio", params={"weeks": 6}, headers=admin_headers)
+        summary = response.json()
+        assert (summary["loans"], summary["principal"]) == (4, 3100)
+        by_status = {row["status"]: row for row in summary["by_status"]}
+        assert {status: row["loans"] for status, row in by_status.items()} == {"0": 1, "1": 2, "Paid": 1}
+        assert by_status["1"]["remaining_installments"] == 11 + 3
+        assert summary["outstanding_balance"] == 1100 + 300
+        assert summary["overdue"] == {"installments": 0, "amount": 0}
+        # Installments fall due weekly from a week today, so week 1 has none.
+        # The first loan's first and the second loan's first three are paid.
+        assert [week["installments"] for week in summary["upcoming"]] == [0, 0, 1, 1, 2, 2]
+
+        # The running totals match a rebuild from the loans and installments
+        db = TestingSessionLocal()
+        rebuild_portfolio_summary(db)
+        db.close()
+        assert client.get("/analytics/portfolio", params={"weeks": 6}, headers=admin_headers).json() == summary
+
+        response = client.get("/analytics/portfolio", headers=headers)
+        assert response.json() == {"message": "User is not permitted."}
+
+    finally:
+        cleanup_database(TestingSessionLocal())
+
+
+def test_quote_loans():
+    try:
+        db = TestingSessionLocal()
+        create_test_user(db, "testuser", "testpassword", "test@example.com")
+        db.close()
+        headers = {"Authorization": f"Bearer {login_user(client, 'testuser', 'testpassword')['access_token']}"}
+
+        response = client.post("/loans/quote", json={
+            "loans": [
+                {"amount": 10000, "terms": 12, "annual_rate": 0.12, "frequency": "monthly"},
+                {"amount": 1000, "terms": 6},
+            ],
+            "start_date": "2026-01-31",
+        }, headers=headers)
+        assert response.status_code == 200
+        quotes = response.json()
+        assert quotes["start_date"] == "2026-01-31"
+        monthly, weekly = quotes["loans"]
+        assert (monthly["installment"], monthly["total_interest"]) == (888.49, 661.86)
+        assert monthly["schedule"][0] == {
+            "due_date": "2026-02-28", "payment": 888.49, "principal": 788.49, "interest": 100.0, "balance": 9211.51,
+        }
+        assert [row["payment"] for row in weekly["schedule"]] == [166.67] * 5 + [166.65]
+
+        # Grids past MAX_QUOTE_INSTALLMENTS are refused
+        response = client.post("/loans/quote", json={
+            "loans": [{"amount": 1000, "terms": 520}] * 400, "include_schedules": False,
+        }, headers=headers)
+        assert response.status_code == 422
+
+        # Approved loans are scheduled by the same engine, to the cent
+        client.post("/loans/create", json={"amount": 1000, "terms": 6}, headers=headers)
+        db = TestingSessionLocal()
+        loan = db.query(Loan).order_by(Loan.id.desc()).first()
+        db.close()
+        create_test_user(TestingSessionLocal(), "adminuser", "adminpassword", "admin@example.com", admin=True)
+        admin_headers = {"Authorization": f"Bearer {login_user(client, 'adminuser', 'adminpassword')['access_token']}"}
+        client.post("/loans/decision", json={"id": loan.id, "decision": 1}, headers=admin_headers)
+        db = TestingSessionLocal()
+        amounts = [payment.amount for payment in db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan.id).order_by(PaymentTerm.due_date)]
+        db.close()
+        assert amounts == [166.67] * 5 + [166.65]
+
+    finally:
+        cleanup_database(TestingSessionLocal())
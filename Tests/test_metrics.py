@@ -0,0 +1,141 @@
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import sessionmaker
+
+from app import instrumentation, metrics
+from app.db import Base, InstrumentedQueuePool, instrument_engine
+from app.main import app, create_access_token, get_db
+from app.models.model import Loan, PaymentTerm, User
+
+
+def test_prometheus_text_format():
+    registry = metrics.Registry()
+    requests = registry.register(metrics.Counter("requests_total", "Requests.", ["route"]))
+    in_use = registry.register(metrics.Gauge("in_use", "In use."))
+    latency = registry.register(metrics.Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0)))
+
+    requests.inc(route="/loans/")
+    requests.inc(2, route="/loans/")
+    in_use.set_function(lambda: 3)
+    latency.observe(0.1)
+    latency.observe(5)
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="/loans/"} 3' in text
+    assert "in_use 3" in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+    assert "latency_seconds_count 2" in text
+
+
+def test_pool_instrumentation():
+    engine = create_engine(
+        f"sqlite:///{tempfile.mkdtemp()}/pool.db",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=1,
+        pool_timeout=0.05,
+    )
+    instrument_engine(engine, "test")
+
+    first = engine.connect()
+    second = engine.connect()  # served by the overflow connection
+    assert metrics.DB_POOL_CHECKED_OUT.value(engine="test") == 2
+    assert metrics.DB_POOL_CHECKOUTS.value(engine="test") == 2
+    assert metrics.DB_POOL_OVERFLOW_CHECKOUTS.value(engine="test") == 1
+
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    assert metrics.DB_POOL_TIMEOUTS.value(engine="test") == 1
+    assert metrics.DB_POOL_CHECKOUT_WAIT.count(engine="test") == 3
+
+    first.close()
+    second.close()
+    assert metrics.DB_POOL_CHECKED_OUT.value(engine="test") == 0
+
+
+def test_metrics_endpoint():
+    # The engines, and their pool metrics, come up with the app's startup
+    with TestClient(app) as client:
+        response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'db_pool_checked_out{engine="primary"}' in response.text
+
+
+def test_request_instrumentation(monkeypatch, caplog):
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/requests.db")
+    Base.metadata.create_all(bind=engine)
+    instrument_engine(engine, "requests")
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = SessionLocal()
+    user = User(username="metrics", password="password", email="metrics@example.com")
+    db.add(user)
+    db.flush()
+    loan = Loan(amount=600, terms=6, user_id=user.id, status="1", remaining_installments=6, outstanding_balance=600)
+    db.add(loan)
+    db.flush()
+    payment = PaymentTerm(amount=100, due_date=datetime.now() + timedelta(days=7),
+                          payment_status="Pending", user_id=user.id, loan_id=loan.id)
+    db.add(payment)
+    db.commit()
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": user.username, "id": user.id})}
+    payment_id = payment.id
+    db.close()
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        client = TestClient(app)
+        labels = {"method": "GET", "route": "/loans/"}
+        requests = metrics.DB_STATEMENTS_PER_REQUEST.count(**labels)
+        statements = metrics.DB_STATEMENTS_PER_REQUEST.sum(**labels)
+        # The data version, then the loans
+        response = client.get("/loans/", headers=headers)
+        assert response.status_code == 200
+        assert metrics.DB_STATEMENTS_PER_REQUEST.count(**labels) == requests + 1
+        assert metrics.DB_STATEMENTS_PER_REQUEST.sum(**labels) == statements + 2
+
+        # A revalidation reads only the version
+        response = client.get("/loans/", headers=dict(headers, **{"If-None-Match": response.headers["ETag"]}))
+        assert response.status_code == 304
+        assert metrics.DB_STATEMENTS_PER_REQUEST.sum(**labels) == statements + 3
+        assert metrics.HTTP_REQUEST_DURATION.count(status=200, **labels) >= 1
+
+        # Paying sends seven statements (the installment, the loan, its outbox
+        # event and the data versions), over a budget of two
+        monkeypatch.setattr(instrumentation, "DB_STATEMENT_BUDGET", 2)
+        labels = {"method": "POST", "route": "/payments/make-payment/"}
+        exceeded = metrics.DB_STATEMENT_BUDGET_EXCEEDED.value(**labels)
+        with caplog.at_level(logging.WARNING, logger="app.instrumentation"):
+            response = client.post(
+                "/payments/make-payment/", json={"payment_id": payment_id, "amount": 100}, headers=headers
+            )
+        assert response.status_code == 200
+        assert metrics.DB_STATEMENT_BUDGET_EXCEEDED.value(**labels) == exceeded + 1
+        assert "POST /payments/make-payment/ sent 7 SQL statements" in caplog.text
+
+        text = client.get("/metrics").text
+        assert 'http_request_duration_seconds_count{method="GET",route="/loans/",status="200"}' in text
+        assert 'db_time_per_request_seconds_count{method="POST",route="/payments/make-payment/"}' in text
+    finally:
+        if previous is None:
+            app.dependency_overrides.pop(get_db, None)
+        else:
+            app.dependency_overrides[get_db] = previous
@@ -0,0 +1,95 @@
+import tempfile
+
+from sqlalchemy import create_engine, inspect, text
+
+from Benchmarks.bench_helper import migrate_database, seed
+from Benchmarks.explain_hot_queries import explain_hot_queries
+
+
+def test_migrations_round_trip():
+    # Migrations run against a scratch SQLite database, not TEST_DATABASE_URL
+    url = f"sqlite:///{tempfile.mkdtemp()}/migrations.db"
+
+    migrate_database(url)
+    migrate_database(url, "base", downgrade=True)
+    assert inspect(create_engine(url)).get_table_names() == ["alembic_version"]
+
+    migrate_database(url)
+    indexes = {index["name"] for index in inspect(create_engine(url)).get_indexes("payment_status")}
+    assert indexes == {
+        "ix_payment_status_user_status_due",
+        "ix_payment_status_loan_status_due",
+        "ix_payment_status_status_due",
+    }
+
+
+def test_hot_queries_use_indexes():
+    url = f"sqlite:///{tempfile.mkdtemp()}/explain.db"
+    migrate_database(url)
+    engine = create_engine(url)
+    seed(engine, users=20, admin=True)
+
+    results = explain_hot_queries(engine)
+    assert {result["path"] for result in results} >= {"login", "loans", "pending_earliest", "make_payment", "overdue_sweep"}
+    assert [result for result in results if result["full_scan"] or result["sort"]] == []
+
+
+def test_settlement_counters_are_backfilled():
+    url = f"sqlite:///{tempfile.mkdtemp()}/counters.db"
+    migrate_database(url, "0001")
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO loans (id, amount, terms, status) VALUES (1, 300, 3, '1'), (2, 100, 1, '1')"))
+        connection.execute(text(
+            "INSERT INTO payment_status (amount, due_date, payment_status, loan_id) VALUES "
+            "(100, '2026-01-01', 'Paid', 1), (100, '2026-01-08', 'Pending', 1), (100, '2026-01-15', 'Late', 1)"
+        ))
+
+    migrate_database(url, "0002")
+    with engine.connect() as connection:
+        counters = connection.execute(
+            text("SELECT id, remaining_installments, outstanding_balance FROM loans ORDER BY id")
+        ).all()
+    assert [tuple(row) for row in counters] == [(1, 2, 200), (2, 0, 0)]
+
+
+def test_installment_cents_survive_a_downgrade():
+    url = f"sqlite:///{tempfile.mkdtemp()}/cents.db"
+    migrate_database(url, "0007")
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO loans (id, amount, terms, status) VALUES (1, 100, 3, '1')"))
+        connection.execute(text(
+            "INSERT INTO payment_status (amount, due_date, payment_status, loan_id) VALUES "
+            "(33.33, '2026-01-01', 'Pending', 1), (33.34, '2026-01-08', 'Pending', 1)"
+        ))
+
+    migrate_database(url, "0006", downgrade=True)
+    columns = {column["name"]: column["type"] for column in inspect(engine).get_columns("payment_status")}
+    assert (columns["amount"].precision, columns["amount"].scale) == (10, 2)
+    with engine.connect() as connection:
+        amounts = connection.execute(text("SELECT amount FROM payment_status ORDER BY id")).scalars().all()
+    assert [float(amount) for amount in amounts] == [33.33, 33.34]
+
+
+def test_archived_ids_are_skipped_after_upgrade():
+    # The newest loan was archived before the ids were made monotonic
+    url = f"sqlite:///{tempfile.mkdtemp()}/ids.db"
+    migrate_database(url, "0009")
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO loans (id, amount, terms, status) VALUES (1, 100, 1, '1')"))
+        connection.execute(text(
+            "INSERT INTO loans_history (id, amount, terms, status, archived_at) "
+            "VALUES (2, 100, 1, 'Paid', '2026-01-01')"
+        ))
+
+    migrate_database(url)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO loans (amount, terms, status) VALUES (250.50, 1, '1')"))
+        assert connection.execute(text("SELECT id FROM loans ORDER BY id")).scalars().all() == [1, 3]
+        connection.execute(text("DELETE FROM loans WHERE id = 3"))
+        connection.execute(text("INSERT INTO loans (amount, terms, status) VALUES (100, 1, '1')"))
+        assert connection.execute(text("SELECT MAX(id) FROM loans")).scalar() == 4
+    columns = {column["name"]: column["type"] for column in inspect(engine).get_columns("loans_history")}
+    assert (columns["amount"].precision, columns["amount"].scale) == (10, 2)
@@ -0,0 +1,85 @@
+import tempfile
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics, outbox
+from app.analytics import SummaryChanges, portfolio_summary, rebuild_portfolio_summary
+from app.db import Base
+from app.models.model import Loan, OutboxEvent
+from app.outbox import handles, process_outbox, publish
+
+
+def test_outbox_processes_events_in_batches(monkeypatch):
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/outbox.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    monkeypatch.setattr(outbox, "HANDLERS", outbox.HANDLERS.copy())
+
+    receipts = []
+
+    @handles("payment.made")
+    def send_receipts(db, events):
+        for event in events:
+            if event.payload["loan_id"] == 13:
+                raise ValueError("no such loan")
+            receipts.append(event.id)
+
+    # Each event counts a loan of 1000 with 100 outstanding in one installment
+    # due next week
+    due = datetime.now() + timedelta(days=7)
+    for loan_id in range(20):
+        changes = SummaryChanges()
+        changes.installment(1, due, 100)
+        changes.loan(1, "1", 1000, 100, 1)
+        publish(db, "payment.made", {"loan_id": loan_id}, changes)
+    publish(db, "loan.decided", {"loans": [1], "decision": 1})
+    db.commit()
+    # Published events leave the totals alone
+    assert portfolio_summary(db)["outstanding_balance"] == 0
+
+    processed = metrics.OUTBOX_PROCESSED.value(kind="payment.made")
+    result = process_outbox(db, batch_size=8)
+    assert (result["processed"], result["failed"]) == (20, 1)
+    assert metrics.OUTBOX_PROCESSED.value(kind="payment.made") == processed + 19
+    # At least once: the events before the failing one in its batch were
+    # handed to the handler again when the batch was retried
+    assert len(receipts) > 19
+    assert len(set(receipts)) == 19
+
+    # The totals of the processed events were added once each, and the failed
+    # one's not at all
+    summary = portfolio_summary(db)
+    assert (summary["loans"], summary["outstanding_balance"]) == (19, 1900)
+    assert summary["upcoming"][1]["installments"] == 19
+    failed = db.execute(select(OutboxEvent)).scalars().one()
+    assert (failed.payload["loan_id"], failed.attempts) == (13, 1)
+    assert "no such loan" in failed.last_error
+
+    # Failed events are retried by later runs, up to OUTBOX_MAX_ATTEMPTS
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    assert process_outbox(db)["failed"] == 1
+    result = process_outbox(db)
+    assert (result["processed"], result["failed"]) == (0, 0)
+    db.close()
+
+
+def test_rebuild_drops_totals_of_waiting_events():
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/outbox.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    # The loan is written and its event is still waiting when the totals are
+    # rebuilt, which counts the loan already
+    db.add(Loan(amount=500, terms=5, status="Waiting for approval", user_id=3,
+                remaining_installments=0, outstanding_balance=0))
+    changes = SummaryChanges()
+    changes.loan(3, "Waiting for approval", 500, 0, 0)
+    publish(db, "loan.decided", {"loans": [1], "decision": "Waiting for approval"}, changes)
+    db.commit()
+    rebuild_portfolio_summary(db)
+
+    assert process_outbox(db)["processed"] == 1
+    assert portfolio_summary(db, today=date.today())["principal"] == 500
+    db.close()
@@ -0,0 +1,53 @@
+from datetime import date, datetime
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.schedule import amortize, due_dates, installment_rows, quote_loans
+
+
+def test_interest_free_installments_add_up_to_the_cent():
+    schedules = amortize([1000, 0.05, 0.05], [6, 3, 12])
+    assert (schedules.payment[0, :6] / 100).tolist() == [166.67] * 5 + [166.65]
+    # The last installment takes what rounding left, whichever way it went
+    assert (schedules.payment[1, :3] / 100).tolist() == [0.02, 0.02, 0.01]
+    assert (schedules.payment[2] / 100).tolist() == [0] * 11 + [0.05]
+    assert schedules.principal.sum(axis=1).tolist() == [100000, 5, 5]
+    assert schedules.interest.sum() == 0
+    assert schedules.mask().sum(axis=1).tolist() == [6, 3, 12]
+
+
+def test_amortized_installments_with_interest():
+    # 10000 at 12% a year over 12 months, 1% a month
+    schedules = amortize([10000, 10000], [12, 12], [0.12, 0.12], np.array(["monthly", "weekly"], dtype=object))
+    monthly = schedules.payment[0] / 100
+    assert monthly[:11].tolist() == [888.49] * 11
+    assert monthly[11] == 888.47
+    assert schedules.interest[0, 0] / 100 == 100.0
+    assert schedules.principal.sum(axis=1).tolist() == [1000000, 1000000]
+    assert schedules.balance[:, -1].tolist() == [0, 0]
+    # The same rate charged weekly costs less over a shorter loan
+    assert schedules.interest[1].sum() < schedules.interest[0].sum()
+
+
+def test_due_dates_by_frequency():
+    assert [str(day) for day in due_dates(date(2026, 1, 31), 3, "monthly")] == ["2026-02-28", "2026-03-31", "2026-04-30"]
+    assert [str(day) for day in due_dates(date(2026, 1, 31), 2, "biweekly")] == ["2026-02-14", "2026-02-28"]
+    assert due_dates(datetime(2026, 1, 31, 10, 30), 1, "weekly").tolist() == [datetime(2026, 2, 7, 10, 30)]
+
+
+def test_installment_rows_and_quotes():
+    loans = [SimpleNamespace(id=1, user_id=7, amount=1000, terms=3), SimpleNamespace(id=2, user_id=8, amount=600, terms=2)]
+    rows = installment_rows(loans, datetime(2026, 1, 1))
+    assert [(row["loan_id"], row["user_id"], row["amount"]) for row in rows] == [
+        (1, 7, 333.33), (1, 7, 333.33), (1, 7, 333.34), (2, 8, 300.0), (2, 8, 300.0),
+    ]
+    assert rows[2]["due_date"] == datetime(2026, 1, 22)
+
+    quotes = quote_loans([(10000, 12, 0.12, "monthly"), (500, 2, 0, "weekly")], date(2026, 1, 31))
+    assert (quotes[0]["installment"], quotes[0]["total_interest"], quotes[0]["total_paid"]) == (888.49, 661.86, 10661.86)
+    assert quotes[1]["schedule"] == [
+        {"due_date": "2026-02-07", "payment": 250.0, "principal": 250.0, "interest": 0.0, "balance": 250.0},
+        {"due_date": "2026-02-14", "payment": 250.0, "principal": 250.0, "interest": 0.0, "balance": 0.0},
+    ]
+    assert "schedule" not in quote_loans([(500, 2, 0, "weekly")], date(2026, 1, 31), include_schedules=False)[0]
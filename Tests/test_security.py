@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.security import PasswordHasher, hash_password, is_password_hash, parse_password_hash, verify_password
+
+
+def test_hash_and_verify():
+    stored = hash_password("secret", cost=10)
+    assert is_password_hash(stored)
+    assert stored != hash_password("secret", cost=10)  # salted
+    assert verify_password("secret", stored)
+    assert not verify_password("wrong", stored)
+
+    # Plain text passwords from before hashing still verify
+    assert verify_password("secret", "secret")
+    assert not verify_password("wrong", "secret")
+
+
+def test_needs_rehash_on_cost_change():
+    hasher = PasswordHasher(cost=11, workers=1)
+    assert hasher.needs_rehash("secret")
+    assert hasher.needs_rehash(hash_password("secret", cost=10))
+    assert not hasher.needs_rehash(hash_password("secret", cost=11))
+
+
+def test_malformed_hashes_fail_verification():
+    stored = hash_password("secret", cost=10)
+    _, cost, salt, digest = stored.split("$")
+    hasher = PasswordHasher(cost=10, workers=1)
+    for malformed in (
+        "scrypt$",
+        "scrypt$10$" + salt,
+        "scrypt$ten$" + salt + "$" + digest,
+        "scrypt$-1$" + salt + "$" + digest,
+        "scrypt$40$" + salt + "$" + digest,
+        "scrypt$10$not base64$" + digest,
+        "scrypt$10$" + salt + "$" + digest[:8],
+        stored + "$extra",
+    ):
+        assert is_password_hash(malformed)
+        assert parse_password_hash(malformed) is None
+        assert not verify_password("secret", malformed)
+        assert not verify_password(malformed, malformed)
+        assert hasher.needs_rehash(malformed)
+
+
+def test_pool_hashing_and_admission_limit():
+    async def run(hasher):
+        stored = await hasher.hash("secret")
+        return await hasher.verify("secret", stored)
+
+    hasher = PasswordHasher(cost=10, workers=2)
+    try:
+        assert asyncio.run(run(hasher))
+        assert hasher.pending == 0
+    finally:
+        hasher.shutdown()
+
+    # Once max_pending hashes are in flight, further work is shed
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run(PasswordHasher(cost=10, max_pending=0)))
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "1"
@@ -0,0 +1,43 @@
+import signal
+import time
+
+import pytest
+import uvicorn
+
+from app.serve import DrainingServer, pool_sizes, shared_writers_store
+
+
+def test_pool_sizes_fit_the_connection_limit():
+    # No limit keeps the configured sizes
+    assert pool_sizes(4, 1, max_connections=0, pool_size=5, max_overflow=10) == (5, 10)
+    # 100 connections over 4 workers: 25 each, so both sizes fit
+    assert pool_sizes(4, 1, max_connections=100, pool_size=5, max_overflow=10) == (5, 10)
+    # Overflow gives way before the pool size
+    assert pool_sizes(4, 1, max_connections=32, pool_size=5, max_overflow=10) == (5, 3)
+    assert pool_sizes(4, 2, max_connections=24, pool_size=5, max_overflow=10) == (3, 0)
+    with pytest.raises(ValueError):
+        pool_sizes(8, 2, max_connections=10, pool_size=5, max_overflow=10)
+
+
+def test_workers_share_the_read_your_writes_window():
+    replica = "mysql+mysqlconnector://replica/aspire_loans"
+    # One process, or no replica to route reads to, needs no shared store
+    assert shared_writers_store(1, replica, environ={}) is None
+    assert shared_writers_store(4, None, environ={}) is None
+    # A configured store is kept, otherwise the workers get a new one
+    assert shared_writers_store(4, replica, environ={"READ_YOUR_WRITES_STORE": "/srv/writers.db"}) == "/srv/writers.db"
+    path = shared_writers_store(4, replica, environ={})
+    assert path.endswith("writers.db") and path != shared_writers_store(4, replica, environ={})
+
+
+def test_draining_server_forces_exit_only_after_the_drain():
+    server = DrainingServer(uvicorn.Config("app.main:app"))
+    server.drain_seconds = 0.2
+
+    server.handle_exit(signal.SIGINT, None)
+    # The supervisor's SIGTERM right behind Ctrl+C does not cut the drain short
+    server.handle_exit(signal.SIGTERM, None)
+    assert (server.should_exit, server.force_exit) == (True, False)
+
+    time.sleep(0.4)
+    assert server.force_exit
@@ -0,0 +1,38 @@
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics
+from app.db import Base
+from app.models.model import PaymentTerm
+from app.sweeper import sweep_overdue_installments
+
+
+def test_sweep_marks_overdue_installments_late():
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/sweeper.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    now = datetime.now()
+    rows = [("Pending", now - timedelta(days=i + 1)) for i in range(25)]
+    rows += [("Pending", now + timedelta(days=7))] * 5
+    rows += [("Paid", now - timedelta(days=3))] * 3
+    db.add_all([PaymentTerm(amount=100, payment_status=status, due_date=due_date) for status, due_date in rows])
+    db.commit()
+
+    marked = metrics.OVERDUE_MARKED.value()
+    result = sweep_overdue_installments(db, now, chunk_size=10)
+    assert result["marked"] == 25
+    assert 25 * 86400 <= result["lag_seconds"] < 26 * 86400
+    assert metrics.OVERDUE_MARKED.value() == marked + 25
+
+    counts = dict(db.query(PaymentTerm.payment_status, func.count()).group_by(PaymentTerm.payment_status).all())
+    assert counts == {"Late": 25, "Pending": 5, "Paid": 3}
+
+    # Nothing is left to do, and the lag is back to zero
+    result = sweep_overdue_installments(db, now, chunk_size=10)
+    assert (result["marked"], result["lag_seconds"]) == (0, 0)
+    assert metrics.OVERDUE_SWEEP_LAG.value() == 0
+    db.close()
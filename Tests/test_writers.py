@@ -0,0 +1,31 @@
+import tempfile
+
+import pytest
+
+from app.writers import MemoryWriters, SqliteWriters
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_writes_are_seen_by_every_store_of_a_host(shared):
+    if shared:
+        # Two stores on one file stand in for two worker processes
+        path = f"{tempfile.mkdtemp()}/writers.db"
+        first, second = SqliteWriters(path, window=5), SqliteWriters(path, window=5)
+    else:
+        first = second = MemoryWriters(window=5)
+
+    first.record(1)
+    assert second.wrote_recently(1)
+    assert not second.wrote_recently(2)
+    second.clear()
+    assert not first.wrote_recently(1)
+
+
+def test_shared_writes_leave_the_window():
+    writers = SqliteWriters(f"{tempfile.mkdtemp()}/writers.db", window=5)
+    writers.record(1, now=100.0)
+    assert writers.wrote_recently(1, now=104.0)
+    assert not writers.wrote_recently(1, now=105.0)
+    # A later write opens the window again
+    writers.record(1, now=110.0)
+    assert writers.wrote_recently(1, now=112.0)
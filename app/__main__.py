@@ -0,0 +1,21 @@
+"""python -m app <command>
+
+    serve    run the API with several worker processes (see app/serve.py)
+"""
+import sys
+
+COMMANDS = ("serve",)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        sys.exit(__doc__)
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == "serve":
+        from .serve import main as serve
+
+        serve(argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Portfolio totals for GET /analytics/portfolio.
+
+loan_summary and collection_summary hold running totals that every write
+changing a loan or an installment adds its difference to, so reading them
+costs a few dozen rows however large the portfolio is. Loan creation and
+ingestion add theirs in their own transaction; payments and loan decisions
+write theirs into an outbox event, added when app/outbox.py processes it.
+The totals can be rebuilt from scratch, after migrating or after
+python -m app.reconcile:
+
+    python -m app.analytics [--chunk-size 10000]
+
+The rebuild reads the columns it needs chunk by chunk into NumPy arrays and
+aggregates them with bincount instead of row by row. Run it while the loans
+are not being written: changes committed while it reads are not counted.
+"""
+import argparse
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select, union_all, update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+
+from .db import database
+from .models.model import DATA_VERSION_SHARDS, CollectionSummary, Loan, LoanHistory, LoanSummary, OutboxEvent, PaymentTerm
+
+# Rows read per round trip by the rebuild
+ANALYTICS_CHUNK = 10000
+# Weeks of upcoming collections reported by default, and at most
+ANALYTICS_WEEKS = 8
+MAX_ANALYTICS_WEEKS = 52
+
+LOAN_TOTALS = ("loans", "amount", "outstanding_balance", "remaining_installments")
+COLLECTION_TOTALS = ("installments", "amount")
+
+
+class SummaryChanges:
+    # Differences a transaction makes to the portfolio totals, collected as it
+    # writes and added to the summary tables by apply() before it commits
+
+    def __init__(self):
+        self.loans = defaultdict(lambda: [0, 0.0, 0.0, 0])
+        self.collections = defaultdict(lambda: [0, 0.0])
+
+    def loan(self, user_id: int, status, amount, outstanding_balance, remaining_installments, sign: int = 1):
+        # Count a loan in (sign 1) or out of (sign -1) its status' totals
+        totals = self.loans[(str(status), user_id % DATA_VERSION_SHARDS)]
+        totals[0] += sign
+        totals[1] += sign * (amount or 0)
+        totals[2] += sign * (outstanding_balance or 0)
+        totals[3] += sign * (remaining_installments or 0)
+
+    def installment(self, user_id: int, due_date: datetime, amount, sign: int = 1):
+        # Count an unpaid installment in (sign 1) or out of (sign -1) its due day
+        if isinstance(due_date, datetime):
+            due_date = due_date.date()
+        totals = self.collections[(due_date, user_id % DATA_VERSION_SHARDS)]
+        totals[0] += sign
+        totals[1] += sign * (amount or 0)
+
+    def to_payload(self):
+        # JSON-ready form, for an outbox event that adds the changes later
+        return {
+            "loans": [[status, shard, *totals] for (status, shard), totals in sorted(self.loans.items())],
+            "collections": [
+                [due_date.isoformat(), shard, *totals] for (due_date, shard), totals in sorted(self.collections.items())
+            ],
+        }
+
+    def add_payload(self, payload):
+        # Add the changes of a to_payload() to these
+        for status, shard, *values in payload["loans"]:
+            totals = self.loans[(status, shard)]
+            for i, value in enumerate(values):
+                totals[i] += value
+        for due_date, shard, *values in payload["collections"]:
+            totals = self.collections[(date.fromisoformat(due_date), shard)]
+            for i, value in enumerate(values):
+                totals[i] += value
+        return self
+
+    def apply(self, db: Session):
+        # One multi-row upsert per table. Rows go in key order so concurrent
+        # transactions lock them in the same order.
+        add_to_totals(db, LoanSummary, ("status", "shard"), LOAN_TOTALS, self.loans)
+        add_to_totals(db, CollectionSummary, ("due_date", "shard"), COLLECTION_TOTALS, self.collections)
+
+
+def add_to_totals(db: Session, table, keys, totals, changes):
+    rows = [
+        dict(zip(keys, key), **dict(zip(totals, values)))
+        for key, values in sorted(changes.items())
+        if any(abs(value) > 1e-9 for value in values)
+    ]
+    if not rows:
+        return
+
+    if db.get_bind().dialect.name == "mysql":
+        statement = mysql.insert(table).values(rows)
+        statement = statement.on_duplicate_key_update(
+            {name: getattr(table, name) + statement.inserted[name] for name in totals}
+        )
+    else:
+        statement = sqlite.insert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(table, name) + statement.excluded[name] for name in totals},
+        )
+    db.execute(statement)
+
+
+def portfolio_summary(db: Session, weeks: int = ANALYTICS_WEEKS, today: date = None):
+    # Totals by loan status, and unpaid installments overdue and due in each
+    # of the next `weeks` weeks (week 1 starts today), by due day
+    today = today or date.today()
+    by_status = [
+        dict(row._mapping)
+        for row in db.execute(
+            select(
+                LoanSummary.status,
+                func.sum(LoanSummary.loans).label("loans"),
+                func.sum(LoanSummary.amount).label("amount"),
+                func.sum(LoanSummary.outstanding_balance).label("outstanding_balance"),
+                func.sum(LoanSummary.remaining_installments).label("remaining_installments"),
+            )
+            .group_by(LoanSummary.status)
+            .having(func.sum(LoanSummary.loans) != 0)
+            .order_by(LoanSummary.status)
+        )
+    ]
+    for row in by_status:
+        row["amount"] = round(row["amount"], 2)
+        row["outstanding_balance"] = round(row["outstanding_balance"], 2)
+
+    overdue = {"installments": 0, "amount": 0.0}
+    upcoming = [
+        {
+            "week": week + 1,
+            "from": today + timedelta(weeks=week),
+            "until": today + timedelta(weeks=week + 1),
+            "installments": 0,
+            "amount": 0.0,
+        }
+        for week in range(weeks)
+    ]
+    days = db.execute(
+        select(
+            CollectionSummary.due_date,
+            func.sum(CollectionSummary.installments),
+            func.sum(CollectionSummary.amount),
+        )
+        .where(CollectionSummary.due_date < today + timedelta(weeks=weeks))
+        .group_by(CollectionSummary.due_date)
+    )
+    for due_date, installments, amount in days:
+        bucket = overdue if due_date < today else upcoming[(due_date - today).days // 7]
+        bucket["installments"] += installments
+        bucket["amount"] += amount
+    for bucket in [overdue] + upcoming:
+        bucket["amount"] = round(bucket["amount"], 2)
+
+    return {
+        "as_of": today,
+        "loans": sum(row["loans"] for row in by_status),
+        "principal": round(sum(row["amount"] for row in by_status), 2),
+        "outstanding_balance": round(sum(row["outstanding_balance"] for row in by_status), 2),
+        "by_status": by_status,
+        "overdue": overdue,
+        "upcoming": upcoming,
+    }
+
+
+def read_columns(db: Session, statement, dtypes, chunk_size: int):
+    # The columns of statement as NumPy arrays of dtypes, fetched chunk_size
+    # rows at a time through Core rows rather than ORM result processing
+    result = db.connection().execute(statement.execution_options(yield_per=chunk_size))
+    chunks = [
+        [np.array(column, dtype=dtype) for column, dtype in zip(zip(*rows), dtypes)]
+        for rows in result.partitions()
+    ]
+    return [
+        np.concatenate([chunk[i] for chunk in chunks]) if chunks else np.empty(0, dtype=dtype)
+        for i, dtype in enumerate(dtypes)
+    ]
+
+
+def group_totals(keys, columns):
+    # The distinct non-negative integer keys and the sum of each of columns
+    # over the rows of each
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, [np.bincount(inverse.reshape(-1), weights=column, minlength=len(unique)) for column in columns]
+
+
+def rebuild_portfolio_summary(db: Session, chunk_size: int = ANALYTICS_CHUNK):
+    start = time.perf_counter()
+    shards = DATA_VERSION_SHARDS
+
+    # Shards and due days are computed by the database, so no datetime is
+    # parsed in Python; due days arrive as dates (MySQL) or ISO strings (SQLite).
+    # Archived loans still count; none of their installments are unpaid.
+    def loan_columns(model):
+        return select(
+            model.status,
+            func.coalesce(model.user_id, 0) % shards,
+            func.coalesce(model.amount, 0),
+            model.outstanding_balance,
+            model.remaining_installments,
+        )
+
+    status, shard, amount, outstanding, remaining = read_columns(
+        db, union_all(loan_columns(Loan), loan_columns(LoanHistory)),
+        [object, np.int64, float, float, float], chunk_size,
+    )
+    statuses, status_codes = np.unique(status.astype(str), return_inverse=True)
+    keys, (loans, amounts, balances, installments_left) = group_totals(
+        status_codes.reshape(-1) * shards + shard,
+        [np.ones(len(status)), amount, outstanding, remaining],
+    )
+    loan_rows = [
+        {
+            "status": str(statuses[key // shards]),
+            "shard": int(key % shards),
+            "loans": int(loans[i]),
+            "amount": float(amounts[i]),
+            "outstanding_balance": float(balances[i]),
+            "remaining_installments": int(installments_left[i]),
+        }
+        for i, key in enumerate(keys)
+    ]
+
+    due_day, shard, amount = read_columns(db, select(
+        func.date(PaymentTerm.due_date),
+        func.coalesce(PaymentTerm.user_id, 0) % shards,
+        func.coalesce(PaymentTerm.amount, 0),
+    ).where(PaymentTerm.payment_status != "Paid"), ["datetime64[D]", np.int64, float], chunk_size)
+    days = due_day.astype(np.int64)
+    first_day = days.min() if len(days) else 0
+    keys, (installments, amounts) = group_totals((days - first_day) * shards + shard, [np.ones(len(days)), amount])
+    collection_rows = [
+        {
+            "due_date": date(1970, 1, 1) + timedelta(days=int(first_day + key // shards)),
+            "shard": int(key % shards),
+            "installments": int(installments[i]),
+            "amount": float(amounts[i]),
+        }
+        for i, key in enumerate(keys)
+    ]
+
+    # The changes of events still in the outbox are counted already, so they
+    # must not be added again when the events are processed
+    counted = [
+        {"id": event_id, "payload": {key: value for key, value in payload.items() if key != "totals"}}
+        for event_id, payload in db.execute(select(OutboxEvent.id, OutboxEvent.payload))
+        if "totals" in payload
+    ]
+    if counted:
+        db.execute(update(OutboxEvent), counted)
+
+    db.execute(delete(LoanSummary))
+    db.execute(delete(CollectionSummary))
+    if loan_rows:
+        db.execute(insert(LoanSummary), loan_rows)
+    if collection_rows:
+        db.execute(insert(CollectionSummary), collection_rows)
+    db.commit()
+
+    return {
+        "loans": len(status),
+        "unpaid_installments": len(days),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=ANALYTICS_CHUNK)
+    args = parser.parse_args()
+
+    db = database.session()
+    try:
+        result = rebuild_portfolio_summary(db, args.chunk_size)
+    finally:
+        db.close()
+    print(
+        f"Summarized {result['loans']} loans and {result['unpaid_installments']} unpaid installments "
+        f"in {result['seconds']}s."
+    )
+
+
+if __name__ == "__main__":
+    main()
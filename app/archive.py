@@ -0,0 +1,155 @@
+"""Move settled loans and their installments into history tables.
+
+    python -m app.archive [--chunk-size 1000] [--after-days 90] [--pause 0]
+
+A loan is settled when it is Paid and every one of its installments is Paid
+and fell due more than --after-days days ago. Settled loans are copied to
+loans_history and their installments to payment_status_history, keeping
+their ids, and deleted from loans and payment_status, chunk_size loans per
+transaction. The hot tables then only hold loans that can still change.
+
+Archived loans stay counted in the portfolio totals. GET /loans/ and
+GET /export/{table} read them back with include_archived=true.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, func, insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .db import database
+from .models.model import Loan, LoanHistory, PaymentTerm, PaymentTermHistory
+from .versions import bump_data_versions
+
+# Loans moved per transaction
+ARCHIVE_CHUNK = int(os.environ.get("ARCHIVE_CHUNK", 1000))
+# Days the last installment of a loan must have been due before it is archived
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 90))
+
+# The history table of each hot table
+ARCHIVES = {Loan: LoanHistory, PaymentTerm: PaymentTermHistory}
+
+
+def copy_columns(model):
+    # The columns a row keeps when it is archived
+    return [column.key for column in model.__table__.columns]
+
+
+def union_archived(statement_for, model):
+    # statement_for(model) builds a select of a hot table; the result selects
+    # the same from the table and its history table together, in id order.
+    # Filters go inside statement_for, so each side can use its own indexes.
+    union = union_all(statement_for(model), statement_for(ARCHIVES[model])).subquery()
+    return select(*union.c).order_by(union.c.id.asc())
+
+
+def count_rows(db: Session):
+    return {
+        model.__tablename__: db.execute(select(func.count()).select_from(model)).scalar()
+        for model in (Loan, PaymentTerm)
+    }
+
+
+def archive_settled_loans(db: Session, now: datetime = None, chunk_size: int = ARCHIVE_CHUNK,
+                          after_days: int = ARCHIVE_AFTER_DAYS, pause: float = 0.0):
+    # Archive settled loans chunk_size at a time. Each chunk's ids are read
+    # past the last id of the previous one (and locked), then its rows are
+    # copied with INSERT ... SELECT and deleted in the same transaction, so a
+    # loan is always in exactly one of the two tables.
+    now = now or datetime.now()
+    cutoff = now - timedelta(days=after_days)
+    unsettled = exists().where(
+        PaymentTerm.loan_id == Loan.id,
+        (PaymentTerm.payment_status != "Paid") | (PaymentTerm.due_date > cutoff),
+    )
+    settled = (Loan.status == "Paid") & (Loan.remaining_installments == 0) & ~unsettled
+
+    before = count_rows(db)
+    db.commit()
+    start = time.perf_counter()
+    archived = {table: 0 for table in before}
+    last_id = 0
+    while True:
+        chunk = db.execute(
+            select(Loan.id, Loan.user_id)
+            .where(settled, Loan.id > last_id)
+            .order_by(Loan.id.asc())
+            .limit(chunk_size)
+            .with_for_update()
+        ).all()
+        if not chunk:
+            break
+        ids = [loan_id for loan_id, _ in chunk]
+        last_id = ids[-1]
+
+        for model, key in ((Loan, Loan.id), (PaymentTerm, PaymentTerm.loan_id)):
+            columns = copy_columns(model)
+            history = ARCHIVES[model]
+            db.execute(insert(history).from_select(
+                columns + ["archived_at"],
+                select(*[getattr(model, column) for column in columns], literal(now)).where(key.in_(ids)),
+            ))
+        installments = db.execute(
+            delete(PaymentTerm).where(PaymentTerm.loan_id.in_(ids)).execution_options(synchronize_session=False)
+        ).rowcount
+        loans = db.execute(
+            delete(Loan).where(Loan.id.in_(ids)).execution_options(synchronize_session=False)
+        ).rowcount
+        bump_data_versions(db, [user_id for _, user_id in chunk if user_id is not None])
+        db.commit()
+
+        archived[Loan.__tablename__] += loans
+        archived[PaymentTerm.__tablename__] += installments
+        metrics.ARCHIVED_ROWS.inc(loans, table=Loan.__tablename__)
+        metrics.ARCHIVED_ROWS.inc(installments, table=PaymentTerm.__tablename__)
+
+        if len(chunk) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    seconds = time.perf_counter() - start
+    metrics.ARCHIVE_DURATION.observe(seconds)
+    moved = sum(archived.values())
+    return {
+        "loans": archived[Loan.__tablename__],
+        "installments": archived[PaymentTerm.__tablename__],
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(moved / seconds, 2) if seconds else 0.0,
+        "tables": {
+            table: {
+                "rows_before": rows,
+                "rows_after": rows - archived[table],
+                "reduction_percent": round(100 * archived[table] / rows, 1) if rows else 0.0,
+            }
+            for table, rows in before.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK)
+    parser.add_argument("--after-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between chunks")
+    args = parser.parse_args()
+
+    db = database.session()
+    try:
+        result = archive_settled_loans(db, chunk_size=args.chunk_size, after_days=args.after_days, pause=args.pause)
+    finally:
+        db.close()
+    print(
+        f"Archived {result['loans']} loans and {result['installments']} installments in {result['seconds']}s "
+        f"({result['rows_per_second']} rows/s)."
+    )
+    for table, sizes in result["tables"].items():
+        print(f"{table}: {sizes['rows_before']} -> {sizes['rows_after']} rows "
+              f"({sizes['reduction_percent']}% smaller)")
+
+
+if __name__ == "__main__":
+    main()
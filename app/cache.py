@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+
+
+class TTLCache:
+    # Bounded in-process cache: least recently used entries are evicted once
+    # maxsize is reached, and every entry expires after its own ttl (seconds).
+    # Safe to share between the event loop and threadpool dependencies.
+    # Named caches export their hits, misses, evictions and size on /metrics.
+
+    def __init__(self, maxsize: int, ttl: float = None, name: str = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped by invalidate(), see set_unless_invalidated()
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if name is not None:
+            metrics.CACHE_ENTRIES.set_function(self.__len__, cache=name)
+
+    def _count(self, attribute, metric):
+        setattr(self, attribute, getattr(self, attribute) + 1)
+        if self.name is not None:
+            metric.inc(cache=self.name)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._count("misses", metrics.CACHE_MISSES)
+                return default
+            self._entries.move_to_end(key)
+            self._count("hits", metrics.CACHE_HITS)
+            return entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else float("inf")
+        with self._lock:
+            self._store(key, value, expires_at)
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._count("evictions", metrics.CACHE_EVICTIONS)
+
+    def set_unless_invalidated(self, key, value, generation: int, ttl: float = None):
+        # Store a value read from the database after self.generation was
+        # generation, unless an entry was invalidated since: the read may have
+        # raced a write and returned what that write just changed.
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else float("inf")
+        with self._lock:
+            if self.generation != generation:
+                return False
+            self._store(key, value, expires_at)
+            return True
+
+    def invalidate(self, key):
+        # Drop key after a write and refuse fills that started before it
+        with self._lock:
+            self._entries.pop(key, None)
+            self.generation += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,17 +1,278 @@
+import asyncio
 import os
 import json
+import threading
+import time
+from datetime import date, datetime, time as time_of_day
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from . import metrics
+from .instrumentation import record_statement
+
+
+def env_flag(name, default="false"):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
 
 load_dotenv()
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
-engine = create_engine(
-    DATABASE_URL,
-    json_serializer=lambda obj: json.dumps(obj, ensure_ascii=False),
+# Serve requests through an AsyncSession instead of a blocking Session
+DATABASE_ASYNC = env_flag("DATABASE_ASYNC")
+DATABASE_ASYNC_URL = os.environ.get("DATABASE_ASYNC_URL")
+
+# Optional read-only replica for the read-only endpoints
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+# Seconds after a user's own write during which their reads stay on the primary
+READ_YOUR_WRITES_SECONDS = float(os.environ.get("READ_YOUR_WRITES_SECONDS", 5))
+
+# Connection pool of each engine, per worker process
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+# Replace connections older than this many seconds, ahead of MySQL's wait_timeout
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 3600))
+# Connections each pool opens at startup, before the worker takes traffic
+DB_POOL_WARM = int(os.environ.get("DB_POOL_WARM", 0))
+# Test each connection on checkout and transparently replace dead ones
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", "true")
+
+# Async drivers used when DATABASE_ASYNC_URL is not set
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def json_serializer(obj):
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def as_datetime(value):
+    # loans.start_date and payment_status.due_date are DATE columns, which the
+    # MySQL drivers return as a date while SQLite returns the model's datetime
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.combine(value, time_of_day.min)
+    return value
+
+
+def get_async_url(url):
+    # Swap the driver of a sync connection string for its async counterpart
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    return url.set(drivername=drivername)
+
+
+class InstrumentedPoolMixin:
+    # Records checkout waits, overflow checkouts and timeouts of a QueuePool
+    label = "default"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            metrics.DB_POOL_TIMEOUTS.inc(engine=self.label)
+            raise
+        finally:
+            metrics.DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start, engine=self.label)
+
+        metrics.DB_POOL_CHECKOUTS.inc(engine=self.label)
+        if self.checkedout() > self.size():
+            metrics.DB_POOL_OVERFLOW_CHECKOUTS.inc(engine=self.label)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.label = self.label
+        return pool
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(url, is_async=False):
+    options = {"json_serializer": json_serializer}
+
+    # In-memory SQLite keeps one connection per thread; there is no pool to size
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
     )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return options
+
+
+def _pool_stat(engine, name):
+    # Pools other than QueuePool (such as in-memory SQLite's) keep no counts
+    stat = getattr(engine.pool, name, None)
+    return stat() if stat is not None else 0
+
+
+def instrument_engine(engine, label):
+    # Label the engine's pool metrics, export its live counts and attribute its
+    # statements to the request being served
+    engine.pool.label = label
+    metrics.DB_POOL_SIZE.set_function(lambda: _pool_stat(engine, "size"), engine=label)
+    metrics.DB_POOL_CHECKED_OUT.set_function(lambda: _pool_stat(engine, "checkedout"), engine=label)
+    metrics.DB_POOL_CHECKED_IN.set_function(lambda: _pool_stat(engine, "checkedin"), engine=label)
+    metrics.DB_POOL_OVERFLOW.set_function(lambda: _pool_stat(engine, "overflow"), engine=label)
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.DB_POOL_INVALIDATIONS.inc(engine=label)
+
+    # Count statements and their execution time against the current request
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["statement_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_statement(statement, time.perf_counter() - conn.info.pop("statement_start"))
+
+
+class Database:
+    # The engines and session factories of this process. Importing the app
+    # creates none of them and opens no connection: start() builds them on
+    # the first session, or from the app's startup, which can also warm the
+    # pools before the worker takes traffic.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = False
+        self.engine = None
+        self.async_engine = None
+        self.replica_engine = None
+        self.session_factory = None
+        self.async_session_factory = None
+        self.replica_session_factory = None
+        self.async_replica_session_factory = None
+
+    def start(self):
+        if not self.started:
+            with self._lock:
+                if not self.started:
+                    self._create_engines()
+                    self.started = True
+        return self
+
+    def _create_engines(self):
+        self.engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+        instrument_engine(self.engine, "primary")
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+        if DATABASE_ASYNC:
+            async_url = DATABASE_ASYNC_URL or get_async_url(DATABASE_URL)
+            self.async_engine = create_async_engine(async_url, **engine_options(async_url, is_async=True))
+            instrument_engine(self.async_engine.sync_engine, "primary_async")
+            self.async_session_factory = async_sessionmaker(self.async_engine, autoflush=False)
+
+        if DATABASE_REPLICA_URL:
+            if DATABASE_ASYNC:
+                replica_url = get_async_url(DATABASE_REPLICA_URL)
+                self.replica_engine = create_async_engine(replica_url, **engine_options(replica_url, is_async=True))
+                instrument_engine(self.replica_engine.sync_engine, "replica_async")
+                self.async_replica_session_factory = async_sessionmaker(self.replica_engine, autoflush=False)
+            else:
+                self.replica_engine = create_engine(DATABASE_REPLICA_URL, **engine_options(DATABASE_REPLICA_URL))
+                instrument_engine(self.replica_engine, "replica")
+                self.replica_session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.replica_engine)
+
+    def session(self):
+        # A blocking Session on the primary, for scripts and worker threads
+        return self.start().session_factory()
+
+    def engines(self):
+        # (engine, is_async) of every engine created
+        candidates = [(self.engine, False), (self.async_engine, True)]
+        if self.replica_engine is not None:
+            candidates.append((self.replica_engine, isinstance(self.replica_engine, AsyncEngine)))
+        return [(engine, is_async) for engine, is_async in candidates if engine is not None]
+
+    async def warm(self, connections: int = DB_POOL_WARM):
+        # Open up to connections of every pool (at most its pool_size, which is
+        # all it keeps) so the first requests do not pay for connecting.
+        # Returns the connections opened.
+        opened = 0
+        for engine, is_async in self.start().engines():
+            count = min(connections, _pool_stat(engine.sync_engine if is_async else engine, "size"))
+            if not count:
+                continue
+            if is_async:
+                held = [await engine.connect() for _ in range(count)]
+                for connection in held:
+                    await connection.close()
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, _hold_connections, engine, count)
+            opened += count
+        return opened
+
+    async def dispose(self):
+        for engine, is_async in self.engines():
+            if is_async:
+                await engine.dispose()
+            else:
+                engine.dispose()
+
+
+def _hold_connections(engine, count):
+    held = [engine.connect() for _ in range(count)]
+    for connection in held:
+        connection.close()
+
+
+database = Database()
+
+
+async def run_db(db, fn, *args):
+    # Run fn(session, *args) against either kind of session. An AsyncSession
+    # runs the ORM code through run_sync, so every round trip awaits the async
+    # driver instead of blocking the event loop.
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return fn(db, *args)
+
+
+def stream_chunks(db, statement, encode, size=1000):
+    # Stream the rows of statement through a server-side cursor, yielding
+    # encode(rows) for every partition of up to size rows. For an AsyncSession
+    # this is an async iterator; otherwise a plain iterator, which
+    # StreamingResponse drives from a worker thread.
+    statement = statement.execution_options(yield_per=size)
+    if isinstance(db, AsyncSession):
+        return _astream_chunks(db, statement, encode)
+    return _stream_chunks(db, statement, encode)
+
+
+def _stream_chunks(db, statement, encode):
+    for rows in db.execute(statement).partitions():
+        yield encode(rows)
+
+
+async def _astream_chunks(db, statement, encode):
+    result = await db.stream(statement)
+    async for rows in result.partitions():
+        yield encode(rows)
+
 
 Base = declarative_base()
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
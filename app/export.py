@@ -0,0 +1,240 @@
+"""Export loans or repayment schedules as CSV, Parquet or Arrow IPC.
+
+    python -m app.export loans --format parquet --output loans.parquet
+    python -m app.export payments --status Late --since 2026-01-01 --until 2026-07-01 > late.csv
+    python -m app.export loans --include-archived > all_loans.csv
+
+Rows are read through a server-side cursor and written chunk by chunk, so
+memory stays bounded however large the tables are. GET /export/{table} streams
+the same output to admins.
+"""
+import argparse
+import csv
+import io
+import sys
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .archive import union_archived
+from .db import as_datetime, database, stream_chunks
+from .models.model import Loan, PaymentTerm
+
+# Rows fetched per round trip and written per CSV chunk, Parquet row group or
+# Arrow record batch
+EXPORT_CHUNK = 10000
+
+# Exported columns of each table, with their Arrow types, and the columns the
+# status and date range filters apply to
+EXPORT_TABLES = {
+    "loans": {
+        "columns": [
+            (Loan.id, "int64"),
+            (Loan.user_id, "int64"),
+            (Loan.amount, "float64"),
+            (Loan.terms, "int64"),
+            (Loan.start_date, "timestamp"),
+            (Loan.status, "string"),
+            (Loan.remaining_installments, "int64"),
+            (Loan.outstanding_balance, "float64"),
+        ],
+        "status": Loan.status,
+        "date": Loan.start_date,
+        "id": Loan.id,
+    },
+    "payments": {
+        "columns": [
+            (PaymentTerm.id, "int64"),
+            (PaymentTerm.loan_id, "int64"),
+            (PaymentTerm.user_id, "int64"),
+            (PaymentTerm.amount, "float64"),
+            (PaymentTerm.due_date, "timestamp"),
+            (PaymentTerm.payment_status, "string"),
+        ],
+        "status": PaymentTerm.payment_status,
+        "date": PaymentTerm.due_date,
+        "id": PaymentTerm.id,
+    },
+}
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def export_statement(table: str, status: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     include_archived: bool = False):
+    # Rows of table in primary key order, optionally of one status and with
+    # their date (loans.start_date, payment_status.due_date) in [since, until),
+    # and optionally together with the rows archived from it
+    spec = EXPORT_TABLES[table]
+
+    def rows_of(model):
+        # The spec's columns are the hot table's; the history table has the
+        # same names
+        def column(attribute):
+            return getattr(model, attribute.key)
+
+        statement = select(*[column(attribute) for attribute, _ in spec["columns"]])
+        if status is not None:
+            statement = statement.where(column(spec["status"]) == status)
+        if since is not None:
+            statement = statement.where(column(spec["date"]) >= since)
+        if until is not None:
+            statement = statement.where(column(spec["date"]) < until)
+        return statement
+
+    model = spec["id"].class_
+    if include_archived:
+        return union_archived(rows_of, model)
+    return rows_of(model).order_by(spec["id"].asc())
+
+
+class _Drain(io.RawIOBase):
+    # A write-only file that hands back what was written since the last drain
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class CsvEncoder:
+    def __init__(self, table: str):
+        self.names = [column.name for column, _ in EXPORT_TABLES[table]["columns"]]
+        self.header = True
+
+    def encode(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if self.header:
+            writer.writerow(self.names)
+            self.header = False
+        writer.writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def finish(self):
+        # An empty export still gets its header row
+        return self.encode([]) if self.header else b""
+
+
+class ArrowEncoder:
+    # Parquet (one row group per chunk) or an Arrow IPC stream (one record
+    # batch per chunk). pyarrow is only imported by exports that need it.
+
+    def __init__(self, table: str, fmt: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(), "timestamp": pa.timestamp("us")}
+        self.pa = pa
+        self.schema = pa.schema([(column.name, types[kind]) for column, kind in EXPORT_TABLES[table]["columns"]])
+        # Dates from MySQL's DATE columns become timestamps like SQLite's datetimes
+        self.timestamps = {
+            i for i, (_, kind) in enumerate(EXPORT_TABLES[table]["columns"]) if kind == "timestamp"
+        }
+        self.sink = _Drain()
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(self.sink, self.schema)
+        else:
+            self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def encode(self, rows):
+        columns = list(zip(*rows)) if rows else [[] for _ in self.schema]
+        columns = [
+            [as_datetime(value) for value in values] if i in self.timestamps else values
+            for i, values in enumerate(columns)
+        ]
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema,
+        ))
+        return self.sink.drain()
+
+    def finish(self):
+        self.writer.close()
+        return self.sink.drain()
+
+
+def make_encoder(table: str, fmt: str):
+    return CsvEncoder(table) if fmt == "csv" else ArrowEncoder(table, fmt)
+
+
+def with_trailer(chunks, encoder):
+    # Append the encoder's closing bytes (Parquet footer, Arrow end-of-stream)
+    # to the chunks of stream_chunks, sync or async
+    if hasattr(chunks, "__aiter__"):
+        return _awith_trailer(chunks, encoder)
+    return _with_trailer(chunks, encoder)
+
+
+def _with_trailer(chunks, encoder):
+    yield from chunks
+    yield encoder.finish()
+
+
+async def _awith_trailer(chunks, encoder):
+    async for chunk in chunks:
+        yield chunk
+    yield encoder.finish()
+
+
+def export_rows(db: Session, table: str, fmt: str, output, status=None, since=None, until=None,
+                chunk_size: int = EXPORT_CHUNK, include_archived: bool = False):
+    # Write the export to the binary file output, returning the rows written
+    encoder = make_encoder(table, fmt)
+    exported = 0
+
+    def encode(rows):
+        nonlocal exported
+        exported += len(rows)
+        return encoder.encode(rows)
+
+    statement = export_statement(table, status, since, until, include_archived)
+    for chunk in with_trailer(stream_chunks(db, statement, encode, chunk_size), encoder):
+        output.write(chunk)
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("table", choices=list(EXPORT_TABLES))
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--status")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="earliest start/due date, inclusive")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="latest start/due date, exclusive")
+    parser.add_argument("--output", help="file to write; standard output by default")
+    parser.add_argument("--include-archived", action="store_true", help="also export the archived rows")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK)
+    args = parser.parse_args()
+
+    db = database.session()
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        exported = export_rows(db, args.table, args.format, output, args.status, args.since, args.until,
+                               args.chunk_size, args.include_archived)
+    finally:
+        db.close()
+        if args.output:
+            output.close()
+    print(f"Exported {exported} rows of {args.table}.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Bulk-load users, loans and existing repayment schedules from NDJSON or CSV.
+
+    python -m app.ingest users users.ndjson
+    python -m app.ingest loans loans.csv --format csv --chunk-size 5000
+    python -m app.ingest payments schedules.ndjson
+
+Every record is validated with the pydantic models of app/models/model.py and
+checked against the database chunk by chunk with set-based lookups; valid
+records go in with one multi-row INSERT per chunk. Invalid records are
+reported with their line number and skipped, and never abort the batch.
+POST /ingest/{kind} takes the same input from admins.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from datetime import datetime
+
+from pydantic import ValidationError
+from sqlalchemy import insert, or_, select, union, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from .analytics import SummaryChanges
+from .db import database, run_db
+from .models.model import (
+    Loan, LoanHistory, LoanImport, PaymentImport, PaymentTerm, PaymentTermHistory, User, UserCreate,
+)
+from .reconcile import loan_counter_values
+from .security import PasswordHasher, is_password_hash, parse_password_hash
+from .versions import bump_data_versions
+
+# Records validated and inserted per statement
+INGEST_CHUNK = 1000
+MAX_INGEST_CHUNK = 10000
+# Row errors listed in a report; the rest are only counted
+INGEST_MAX_ERRORS = 1000
+
+INGEST_KINDS = {"users": UserCreate, "loans": LoanImport, "payments": PaymentImport}
+
+
+class IngestReport:
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        # Borrowers whose loans or schedules changed, for cache invalidation
+        self.user_ids = set()
+
+    def error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < INGEST_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self):
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def parse_records(lines, fmt: str):
+    # Yield (line number, dict) per record, or (line number, error message)
+    # for lines that cannot be parsed
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Empty CSV fields mean "not given"
+            yield reader.line_num, {key: value for key, value in row.items() if value != ""}
+        return
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield number, "Invalid JSON: expected an object"
+            continue
+        yield number, record
+
+
+def validation_message(error: ValidationError):
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}" for detail in error.errors()
+    )
+
+
+def insert_rows(db: Session, table, rows, report: IngestReport):
+    # One multi-row INSERT for the chunk. When the database still rejects it,
+    # retry row by row so only the offending records are reported. Returns
+    # the values of the rows inserted.
+    if not rows:
+        return []
+    try:
+        db.execute(insert(table), [values for _, values in rows])
+        db.commit()
+        report.inserted += len(rows)
+        return [values for _, values in rows]
+    except DBAPIError:
+        db.rollback()
+
+    inserted = []
+    for line, values in rows:
+        try:
+            db.execute(insert(table), [values])
+            db.commit()
+            report.inserted += 1
+            inserted.append(values)
+        except DBAPIError as e:
+            db.rollback()
+            report.error(line, str(e.orig))
+    return inserted
+
+
+def ingest_users(db: Session, records, report: IngestReport):
+    # records: (line, UserCreate, stored password)
+    names = [user.username for _, user, _ in records]
+    emails = [user.email for _, user, _ in records]
+    taken = set()
+    for username, email in db.execute(
+        select(User.username, User.email).where(or_(User.username.in_(names), User.email.in_(emails)))
+    ):
+        taken.update((username, email))
+
+    rows = []
+    for line, user, password in records:
+        if user.username in taken or user.email in taken:
+            report.error(line, "Username or email already in use")
+            continue
+        taken.update((user.username, user.email))
+        rows.append((line, {"username": user.username, "email": user.email, "password": password}))
+    insert_rows(db, User, rows, report)
+
+
+def ingest_loans(db: Session, records, report: IngestReport):
+    user_ids = {loan.user_id for _, loan in records if loan.user_id is not None}
+    usernames = {loan.username for _, loan in records if loan.username is not None}
+    ids_by_name = dict(db.execute(select(User.username, User.id).where(User.username.in_(usernames))).all())
+    known_ids = set(db.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+    loan_ids = {loan.id for _, loan in records if loan.id is not None}
+    # Archived loans keep their ids, so those are taken too
+    taken = set(db.execute(union(
+        select(Loan.id).where(Loan.id.in_(loan_ids)),
+        select(LoanHistory.id).where(LoanHistory.id.in_(loan_ids)),
+    )).scalars())
+
+    now = datetime.now()
+    rows = []
+    for line, loan in records:
+        user_id = ids_by_name.get(loan.username) if loan.username is not None else loan.user_id
+        if user_id is None or (loan.username is None and user_id not in known_ids):
+            report.error(line, "User not found")
+            continue
+        if loan.id is not None and loan.id in taken:
+            report.error(line, "Loan id already in use")
+            continue
+        taken.add(loan.id)
+        rows.append((line, {
+            "id": loan.id,
+            "amount": loan.amount,
+            "terms": loan.terms,
+            "start_date": loan.start_date or now,
+            "status": loan.status,
+            "user_id": user_id,
+        }))
+    inserted = insert_rows(db, Loan, rows, report)
+
+    # insert_rows commits as it goes, so the summary and versions follow in a
+    # transaction of their own; until it commits, polls may still get 304 for
+    # the old list
+    if inserted:
+        changes = SummaryChanges()
+        for values in inserted:
+            changes.loan(values["user_id"], values["status"], values["amount"], 0, 0)
+        changes.apply(db)
+        borrowers = {values["user_id"] for values in inserted}
+        bump_data_versions(db, borrowers)
+        db.commit()
+        report.user_ids.update(borrowers)
+
+
+def ingest_payments(db: Session, records, report: IngestReport):
+    loan_ids = {payment.loan_id for _, payment in records}
+    borrowers = dict(db.execute(select(Loan.id, Loan.user_id).where(Loan.id.in_(loan_ids))).all())
+    payment_ids = {payment.id for _, payment in records if payment.id is not None}
+    taken = set(db.execute(union(
+        select(PaymentTerm.id).where(PaymentTerm.id.in_(payment_ids)),
+        select(PaymentTermHistory.id).where(PaymentTermHistory.id.in_(payment_ids)),
+    )).scalars())
+
+    rows = []
+    for line, payment in records:
+        if payment.loan_id not in borrowers:
+            report.error(line, "Loan not found")
+            continue
+        if payment.id is not None and payment.id in taken:
+            report.error(line, "Payment id already in use")
+            continue
+        taken.add(payment.id)
+        rows.append((line, {
+            "id": payment.id,
+            "amount": payment.amount,
+            "due_date": payment.due_date,
+            "payment_status": payment.payment_status,
+            "user_id": borrowers[payment.loan_id],
+            "loan_id": payment.loan_id,
+        }))
+    inserted = insert_rows(db, PaymentTerm, rows, report)
+
+    # Bring the settlement counters of the loans in this chunk up to date,
+    # and the portfolio summary with them
+    touched = {values["loan_id"] for values in inserted}
+    if touched:
+        changes = SummaryChanges()
+        for values in inserted:
+            if values["payment_status"] != "Paid":
+                changes.installment(values["user_id"], values["due_date"], values["amount"])
+
+        loan_state = select(
+            Loan.user_id, Loan.status, Loan.amount, Loan.outstanding_balance, Loan.remaining_installments
+        ).where(Loan.id.in_(touched))
+        for loan in db.execute(loan_state.with_for_update()):
+            changes.loan(*loan, sign=-1)
+        db.execute(
+            update(Loan)
+            .where(Loan.id.in_(touched))
+            .values(**loan_counter_values())
+            .execution_options(synchronize_session=False)
+        )
+        for loan in db.execute(loan_state):
+            changes.loan(*loan)
+        changes.apply(db)
+
+        users = {borrowers[loan_id] for loan_id in touched}
+        bump_data_versions(db, users)
+        db.commit()
+        report.user_ids.update(users)
+
+
+async def ingest_chunk(db: Session, kind: str, records, hasher: PasswordHasher, report: IngestReport):
+    if kind == "users":
+        # Hashes supplied by the source system are stored as they are, once
+        # they are known to be well formed; a malformed one would lock its
+        # user out
+        valid = []
+        for line, user in records:
+            if is_password_hash(user.password) and parse_password_hash(user.password) is None:
+                report.error(line, "Malformed scrypt password hash")
+            else:
+                valid.append((line, user))
+        records = valid
+        plain = [user.password for _, user in records if not is_password_hash(user.password)]
+        hashes = iter(await hasher.hash_many(plain))
+        records = [
+            (line, user, user.password if is_password_hash(user.password) else next(hashes))
+            for line, user in records
+        ]
+        await run_db(db, ingest_users, records, report)
+    elif kind == "loans":
+        await run_db(db, ingest_loans, records, report)
+    else:
+        await run_db(db, ingest_payments, records, report)
+
+
+async def ingest(db: Session, kind: str, records, hasher: PasswordHasher, chunk_size: int = INGEST_CHUNK):
+    # records: (line, dict or error message) pairs as from parse_records
+    model = INGEST_KINDS[kind]
+    report = IngestReport()
+    chunk = []
+    for line, record in records:
+        report.received += 1
+        if isinstance(record, str):
+            report.error(line, record)
+            continue
+        try:
+            chunk.append((line, model.parse_obj(record)))
+        except ValidationError as e:
+            report.error(line, validation_message(e))
+            continue
+        if len(chunk) == chunk_size:
+            await ingest_chunk(db, kind, chunk, hasher, report)
+            chunk = []
+    if chunk:
+        await ingest_chunk(db, kind, chunk, hasher, report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=list(INGEST_KINDS))
+    parser.add_argument("path", help="input file, - for standard input")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK)
+    args = parser.parse_args()
+
+    hasher = PasswordHasher()
+    db = database.session()
+    source = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    try:
+        records = parse_records(source, args.format)
+        report = asyncio.run(ingest(db, args.kind, records, hasher, args.chunk_size))
+    finally:
+        db.close()
+        hasher.shutdown()
+        if source is not sys.stdin:
+            source.close()
+    print(json.dumps(report.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from starlette.routing import Match
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# SQL statements one request may send before it is reported as a likely N+1
+# query pattern; 0 disables the check
+DB_STATEMENT_BUDGET = int(os.environ.get("DB_STATEMENT_BUDGET", 10))
+
+
+class RequestStats:
+    # Statements sent and time spent in the database while serving one request
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.repeated = Counter()
+
+
+# The stats of the request being served. Handlers running on a worker thread or
+# inside AsyncSession.run_sync see a copy of the context that still points at
+# the same RequestStats.
+request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+
+def record_statement(statement: str, seconds: float):
+    stats = request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += seconds
+        stats.repeated[statement] += 1
+
+
+def route_label(app, scope):
+    # The route's path template, so /loans/1 and /loans/2 share one series
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class RequestMetricsMiddleware:
+    # Records the latency, statement count and database time of every HTTP
+    # request, labelled by route. Timing wraps the whole ASGI call, so the body
+    # of a StreamingResponse and the queries feeding it are included.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_stats.reset(token)
+            self.record(scope, stats, status_code, elapsed)
+
+    def record(self, scope, stats, status_code, elapsed):
+        route = route_label(scope["app"], scope)
+        method = scope["method"]
+        metrics.HTTP_REQUEST_DURATION.observe(elapsed, method=method, route=route, status=status_code)
+        metrics.DB_STATEMENTS_PER_REQUEST.observe(stats.statements, method=method, route=route)
+        metrics.DB_TIME_PER_REQUEST.observe(stats.db_seconds, method=method, route=route)
+
+        if DB_STATEMENT_BUDGET and stats.statements > DB_STATEMENT_BUDGET:
+            metrics.DB_STATEMENT_BUDGET_EXCEEDED.inc(method=method, route=route)
+            statement, count = stats.repeated.most_common(1)[0]
+            logger.warning(
+                "%s %s sent %d SQL statements (budget %d); most repeated, %d times: %s",
+                method, route, stats.statements, DB_STATEMENT_BUDGET, count, " ".join(statement.split()),
+            )
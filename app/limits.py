@@ -0,0 +1,161 @@
+"""Per-client rate limiting and database admission control.
+
+Token buckets refill at rate tokens per second up to burst; a request takes
+one token or is turned away with 429 and the seconds until the next token in
+Retry-After. Buckets live in this process, or in a SQLite file shared by the
+worker processes of one host when RATE_LIMIT_STORE names one. The admission
+gate sheds requests with 503 once every pooled connection is busy and
+DB_ADMISSION_QUEUE more requests are already waiting for one.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi import HTTPException, status
+
+from . import metrics
+from .cache import TTLCache
+from .db import DB_MAX_OVERFLOW, DB_POOL_SIZE
+
+# Requests per second and burst allowed to each authenticated user; 0 disables
+RATE_LIMIT_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", 20))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 40))
+# The same for each client address on /user/login/ and /user/register/
+IP_RATE_LIMIT_PER_SECOND = float(os.environ.get("IP_RATE_LIMIT_PER_SECOND", 5))
+IP_RATE_LIMIT_BURST = int(os.environ.get("IP_RATE_LIMIT_BURST", 20))
+# SQLite file holding the buckets of every worker process on this host
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE")
+# Clients tracked per limiter by the in-process store
+RATE_LIMIT_CLIENTS = int(os.environ.get("RATE_LIMIT_CLIENTS", 100000))
+
+# Requests that may wait for a pooled connection once all are checked out
+DB_ADMISSION_QUEUE = int(os.environ.get("DB_ADMISSION_QUEUE", DB_POOL_SIZE))
+
+
+def take_token(bucket, rate: float, burst: int, now: float):
+    # Refill bucket, a (tokens, updated) pair or None for a full one, and take
+    # a token. Returns the new bucket and 0, or the seconds until a token.
+    tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    # Buckets of one process. Idle buckets expire once they would have
+    # refilled anyway, and the least recently seen are dropped past maxsize.
+
+    def __init__(self, maxsize: int = RATE_LIMIT_CLIENTS):
+        self.maxsize = maxsize
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, name: str, key, rate: float, burst: int, now: float):
+        with self._lock:
+            buckets = self._buckets.get(name)
+            if buckets is None:
+                buckets = self._buckets[name] = TTLCache(self.maxsize, ttl=burst / rate)
+            bucket, wait = take_token(buckets.get(key), rate, burst, now)
+            buckets.set(key, bucket)
+        return wait
+
+
+class SqliteBuckets:
+    # Buckets shared by the processes of one host through a local SQLite file.
+    # Each take is one short write transaction; BEGIN IMMEDIATE makes
+    # concurrent takes of the same bucket queue instead of both spending it.
+
+    PRUNE_EVERY = 10000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT, key TEXT, tokens REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (name, key))"
+            )
+            self._local.connection = connection
+        return connection
+
+    def take(self, name: str, key, rate: float, burst: int, now: float):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            bucket = connection.execute(
+                "SELECT tokens, updated FROM buckets WHERE name = ? AND key = ?", (name, str(key))
+            ).fetchone()
+            bucket, wait = take_token(bucket, rate, burst, now)
+            connection.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)", (name, str(key)) + bucket)
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                # Buckets idle long enough to have refilled are as good as absent
+                connection.execute("DELETE FROM buckets WHERE name = ? AND updated < ?", (name, now - burst / rate))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+
+def make_buckets(store: str = RATE_LIMIT_STORE):
+    return SqliteBuckets(store) if store else MemoryBuckets()
+
+
+class RateLimiter:
+    # A token bucket per key. check() raises a 429 for keys out of tokens.
+
+    def __init__(self, name: str, rate: float, burst: int, buckets):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.buckets = buckets
+
+    def check(self, key):
+        if not self.rate:
+            return
+        wait = self.buckets.take(self.name, key, self.rate, self.burst, time.time())
+        if wait:
+            metrics.RATE_LIMITED.inc(limiter=self.name)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please slow down",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+
+class AdmissionGate:
+    # Caps the requests holding or waiting for a database session. Requests
+    # past the cap would only queue on the pool until DB_POOL_TIMEOUT, slowing
+    # everyone down, so they get a 503 straight away instead.
+
+    def __init__(self, limit: int = DB_POOL_SIZE + DB_MAX_OVERFLOW + DB_ADMISSION_QUEUE):
+        self.limit = limit
+        self.in_flight = 0
+        metrics.DB_ADMISSION_IN_FLIGHT.set_function(lambda: self.in_flight)
+
+    @contextmanager
+    def admit(self):
+        # Only entered from the event loop, so the counter needs no lock
+        if self.in_flight >= self.limit:
+            metrics.DB_ADMISSION_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
@@ -1,56 +1,210 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import or_
+from sqlalchemy import case, insert, or_, select, update
 from sqlalchemy.orm import Session
+import asyncio
+import decimal
+import inspect
 import jwt
+import json
 import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
 from .models.model import (
     LoanApprove,
+    LoanBatchDecision,
     LoanCreate,
-    LoanView,
+    LoanPayment,
+    LoanQuoteBatch,
     MakePayment,
     PaymentTerm,
     User,
     Loan,
     UserCreate,
 )
-from .db import SessionLocal
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from . import metrics
+from .analytics import ANALYTICS_WEEKS, MAX_ANALYTICS_WEEKS, SummaryChanges, portfolio_summary
+from .archive import union_archived
+from .cache import TTLCache
+from .export import EXPORT_CHUNK, EXPORT_FORMATS, EXPORT_TABLES, export_statement, make_encoder, with_trailer
+from .db import DB_POOL_WARM, as_datetime, database, run_db, stream_chunks
+from .ingest import INGEST_CHUNK, INGEST_KINDS, MAX_INGEST_CHUNK, ingest, parse_records
+from .instrumentation import RequestMetricsMiddleware
+from .limits import (
+    IP_RATE_LIMIT_BURST,
+    IP_RATE_LIMIT_PER_SECOND,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_PER_SECOND,
+    AdmissionGate,
+    RateLimiter,
+    make_buckets,
+)
+from .outbox import OUTBOX_INTERVAL, publish, run_outbox_worker
+from .reconcile import loan_counter_values
+from .schedule import installment_rows, quote_loans
+from .security import PasswordHasher
+from .sweeper import OVERDUE_SWEEP_INTERVAL, run_sweeper
+from .versions import (
+    REVALIDATE,
+    bump_data_versions,
+    current_next_due_etag,
+    etag_matches,
+    global_data_version,
+    loans_etag,
+    next_due_etag,
+    user_data_version,
+)
+from .writers import make_writers
+from datetime import date, datetime, timedelta
 
 app = FastAPI()
-
-load_dotenv()
+# Per-route latency, SQL statement counts and database time, served by /metrics
+app.add_middleware(RequestMetricsMiddleware)
 
 SECRET_KEY = os.environ.get("SECRET_KEY")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
+
+# Principals of verified tokens, so authenticated requests skip jwt.decode
+token_cache = TTLCache(maxsize=int(os.environ.get("TOKEN_CACHE_SIZE", 10000)), name="token")
+
+# Password hashing runs on its own bounded worker pool
+password_hasher = PasswordHasher()
+
+# Largest page of /loans/, and rows fetched per round trip when streaming it
+MAX_LOANS_PAGE = 1000
+LOANS_STREAM_CHUNK = 1000
+
+# Loans looked up and scheduled per statement by /loans/decision/batch
+DECISION_CHUNK = 1000
+
+# Status of a loan that has not been approved or rejected yet; only these are
+# decided
+WAITING_FOR_APPROVAL = "Waiting for approval"
+
+# Earliest pending installment of each user (None when there is none), served
+# to the pending-earliest-due-date poll. Entries are checked against the
+# user's data version on every read, so writes made by other worker processes
+# are seen on the next poll; writes in this process also invalidate entries as
+# they commit.
+next_due_cache = TTLCache(
+    maxsize=int(os.environ.get("NEXT_DUE_CACHE_SIZE", 100000)),
+    ttl=float(os.environ.get("NEXT_DUE_CACHE_SECONDS", 60)),
+    name="next_due",
+)
+
+# Times a payment re-reads a loan that a concurrent payment changed
+PAYMENT_ATTEMPTS = 3
+
+# Users who wrote within the last READ_YOUR_WRITES_SECONDS, read from the
+# primary; shared by the workers of this host with READ_YOUR_WRITES_STORE
+recent_writers = make_writers()
+
+# Token buckets per user id (every authenticated route) and per client address
+# (login and registration)
+rate_limit_buckets = make_buckets()
+user_limiter = RateLimiter("user", RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST, rate_limit_buckets)
+ip_limiter = RateLimiter("ip", IP_RATE_LIMIT_PER_SECOND, IP_RATE_LIMIT_BURST, rate_limit_buckets)
+
+# Requests allowed to hold or wait for a primary database session
+admission_gate = AdmissionGate()
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/login/")
 
 
+@app.on_event("startup")
+async def start_database():
+    # Engines are created here rather than on import, and DB_POOL_WARM
+    # connections per pool are opened before the worker accepts traffic
+    database.start()
+    if DB_POOL_WARM:
+        await database.warm(DB_POOL_WARM)
+
+
+@app.on_event("startup")
+async def start_overdue_sweeper():
+    # Mark overdue installments Late in the background when configured
+    if OVERDUE_SWEEP_INTERVAL:
+        app.state.overdue_sweeper = asyncio.create_task(run_sweeper(OVERDUE_SWEEP_INTERVAL))
+
+
+@app.on_event("startup")
+async def start_outbox_worker():
+    # Process payment and approval events in the background when configured
+    if OUTBOX_INTERVAL:
+        app.state.outbox_worker = asyncio.create_task(run_outbox_worker(OUTBOX_INTERVAL))
+
+
+@app.on_event("shutdown")
+async def stop_overdue_sweeper():
+    sweeper = getattr(app.state, "overdue_sweeper", None)
+    if sweeper is not None:
+        sweeper.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_outbox_worker():
+    worker = getattr(app.state, "outbox_worker", None)
+    if worker is not None:
+        worker.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_database():
+    await database.dispose()
+
+
 def get_database_session():
-    return SessionLocal()
+    return database.session()
 
 
-def get_db():
-    db = get_database_session()
+async def get_db():
+    # Shed load with a 503 rather than queue on an exhausted pool
+    with admission_gate.admit():
+        if database.start().async_session_factory is not None:
+            async with database.async_session_factory() as db:
+                yield db
+            return
+
+        db = get_database_session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+async def get_replica_db():
+    # Yields None when no replica is configured
+    database.start()
+    if database.async_replica_session_factory is not None:
+        async with database.async_replica_session_factory() as db:
+            yield db
+        return
+
+    factory = database.replica_session_factory
+    db = factory() if factory is not None else None
     try:
         yield db
     finally:
-        db.close()
+        if db is not None:
+            db.close()
 
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
+    # Tokens verified before are served from the cache until they expire
+    principal = token_cache.get(token)
+    if principal is not None:
+        user_limiter.check(principal["id"])
+        return principal
+
     try:
-        # Get username and user id from the token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        # Get username, user id and role from the token
+        payload = jwt.decode(
+            token, SECRET_KEY, algorithms=["HS256"], options={"require": ["exp"]}
+        )
         username: str = payload.get("sub")
         user_id: int = payload.get("id")
-
-        if username is None or user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-            )
-        return {"username": username, "id": user_id}
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired"
@@ -58,16 +212,70 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
 
+    if username is None or user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+        )
+
+    principal = {"username": username, "id": user_id, "admin": bool(payload.get("admin"))}
+    token_cache.set(token, principal, ttl=payload["exp"] - time.time())
+    user_limiter.check(user_id)
+    return principal
+
+
+def limit_client_address(request: Request):
+    # Rate limit for routes called before the client has a token
+    ip_limiter.check(request.client.host if request.client else "unknown")
+
+
+async def get_read_db(
+    current_user: dict = Depends(get_current_user),
+    replica: Session = Depends(get_replica_db),
+):
+    # Read-only handlers use the replica, except right after the user's own
+    # writes. Only reads routed to the primary open a primary session and pass
+    # the admission gate.
+    if replica is not None and not recent_writers.wrote_recently(current_user["id"]):
+        metrics.DB_READ_ROUTING.inc(target="replica")
+        yield replica
+        return
+
+    metrics.DB_READ_ROUTING.inc(target="primary")
+    # Resolved the way Depends(get_db) would be, so overrides of it apply
+    primary = app.dependency_overrides.get(get_db, get_db)
+    if inspect.isasyncgenfunction(primary):
+        async with asynccontextmanager(primary)() as db:
+            yield db
+    else:
+        with contextmanager(primary)() as db:
+            yield db
+
+
+def record_write(user_id: int):
+    # Route the user's reads to the primary until replicas have caught up
+    recent_writers.record(user_id)
+
 
 def create_access_token(data: dict):
+    # Tokens carry their expiry, and the role claims set by the caller
+    data = dict(data, exp=datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     try:
         return jwt.encode(data, SECRET_KEY, algorithm="HS256")
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
 
 
-@app.post("/user/register/")
+@app.post("/user/register/", dependencies=[Depends(limit_client_address)])
 async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
+    # Hash on the worker pool, never on the event loop
+    password = await password_hasher.hash(user_data.password)
+    await run_db(db, create_user, user_data, password)
+
+    return {"Success": "New user is created"}
+
+
+def create_user(db: Session, user_data: UserCreate, password: str):
     # Check if the username or email is already in use
     existing_user = (
         db.query(User)
@@ -76,28 +284,23 @@ async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     )
 
     if existing_user:
-        db.close()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username or email already in use",
         )
 
-    # Create a new user
-    new_user = User(**user_data.dict())
+    # Create a new user with the hashed password
+    new_user = User(**dict(user_data.dict(), password=password))
     db.add(new_user)
     db.commit()
-    db.refresh(new_user)
-    db.close()
-
-    return {"Success": "New user is created"}
 
 
-@app.post("/user/login/", response_model=dict)
+@app.post("/user/login/", response_model=dict, dependencies=[Depends(limit_client_address)])
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
 ):
     # Check the username and password
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -105,21 +308,44 @@ async def login_for_access_token(
         )
 
     # Generate an access token for the user
-    access_token = create_access_token({"sub": user.username, "id": user.id})
+    access_token = create_access_token(
+        {"sub": user.username, "id": user.id, "admin": user.admin == 1}
+    )
 
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-def authenticate_user(username: str, password: str, db):
+async def authenticate_user(db: Session, username: str, password: str):
     # Find the user by username in the database
-    user = db.query(User).filter(or_(User.username == username)).first()
+    user = await run_db(db, find_user, username)
     if user is None:
         return None  # User not found
-    if password != user.password:
+    if not await password_hasher.verify(password, user.password):
         return None  # Password doesn't match
+
+    # Upgrade plain text passwords and hashes made at another cost
+    if password_hasher.needs_rehash(user.password):
+        password = await password_hasher.hash(password)
+        await run_db(db, update_password, user.id, password)
     return user  # Authentication successful
 
 
+def find_user(db: Session, username: str):
+    return db.execute(
+        select(User.id, User.username, User.password, User.admin).where(User.username == username)
+    ).first()
+
+
+def update_password(db: Session, user_id: int, password: str):
+    db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(password=password)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
 # Route to create a new loan
 @app.post("/loans/create")
 async def create_loan(
@@ -130,48 +356,124 @@ async def create_loan(
     if loan_data.terms > 12:
         return {"Error": "Please select terms less than or equal to 12."}
     else:
-        try:
-            # Create a new loan object
-            new_loan = Loan(
-                amount=loan_data.amount,
-                terms=loan_data.terms,
-                start_date=datetime.now(),
-                user_id=current_user["id"],
-                status="Waiting for approval",
-            )
-
-            # Add the new loan to the database
-            db.add(new_loan)
-            db.commit()
-            db.refresh(new_loan)
-
-            return {"Message": "Loan was created. Waiting for approval."}
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(status_code=400, detail=str(e))
+        await run_db(db, add_loan, loan_data, current_user["id"])
+        record_write(current_user["id"])
+
+        return {"Message": "Loan was created. Waiting for approval."}
+
+
+def add_loan(db: Session, loan_data: LoanCreate, user_id: int):
+    try:
+        # Create a new loan object
+        new_loan = Loan(
+            amount=loan_data.amount,
+            terms=loan_data.terms,
+            start_date=datetime.now(),
+            user_id=user_id,
+            status=WAITING_FOR_APPROVAL,
+        )
+
+        # Add the new loan to the database
+        db.add(new_loan)
+        changes = SummaryChanges()
+        changes.loan(user_id, new_loan.status, new_loan.amount, 0, 0)
+        changes.apply(db)
+        bump_data_versions(db, [user_id])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-# Endpoint to get all loans mapped to the logged-in user
+# Endpoint to get all loans mapped to the logged-in user. Pass limit (and the
+# X-Next-After header of the previous page as after) to page through them by id,
+# or stream=true to receive every loan as NDJSON. Pages carry an ETag; sending
+# it back in If-None-Match gets a 304 until the loans change. Settled loans
+# moved out by python -m app.archive are included with include_archived=true.
 @app.get("/loans/")
 async def get_loans_for_user(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LOANS_PAGE),
+    after: Optional[int] = None,
+    stream: bool = False,
+    include_archived: bool = False,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)):
+    db: Session = Depends(get_read_db)):
 
-    # Query the database to get all loans associated with the current user
+    if stream:
+        statement = loans_statement(current_user["id"], current_user["admin"], after, include_archived)
+        return StreamingResponse(
+            stream_chunks(db, statement, encode_loans_ndjson, LOANS_STREAM_CHUNK),
+            media_type="application/x-ndjson",
+        )
 
-    user = db.query(User).filter(User.id == current_user["id"]).first()
-    if user.admin == 1:
-        loans = db.query(Loan).all()
+    # Admins see every loan, so their pages follow the global version
+    if current_user["admin"]:
+        version = await run_db(db, global_data_version)
     else:
-        loans = db.query(Loan).filter(Loan.user_id == current_user["id"]).all()
+        version = await run_db(db, user_data_version, current_user["id"])
+    headers = {"ETag": loans_etag(current_user["admin"], version), "Cache-Control": REVALIDATE}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    loans_response = await run_db(
+        db, list_loans, current_user["id"], current_user["admin"], limit, after, include_archived
+    )
+
+    # One extra row was fetched to tell whether another page follows
+    if limit is not None and len(loans_response) > limit:
+        loans_response = loans_response[:limit]
+        headers["X-Next-After"] = str(loans_response[-1]["id"])
+
+    # The rows are plain JSON values already, so skip jsonable_encoder
+    return RowsJSONResponse(loans_response, headers=headers)
+
+
+def list_loans(db: Session, user_id: int, admin: bool, limit: Optional[int] = None, after: Optional[int] = None,
+               include_archived: bool = False):
+    # Fetch the LoanView columns as plain rows; no ORM entities are loaded or
+    # tracked and no pydantic model is built per loan
+    statement = loans_statement(user_id, admin, after, include_archived)
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    return [row._asdict() for row in db.execute(statement)]
+
+
+def loans_statement(user_id: int, admin: bool, after: Optional[int] = None, include_archived: bool = False):
+    # Select only the LoanView columns, in primary key order, optionally
+    # together with the archived loans
+    def rows_of(model):
+        statement = select(model.id, model.amount, model.terms, model.status, model.user_id)
+        if not admin:
+            statement = statement.where(model.user_id == user_id)
+        if after is not None:
+            statement = statement.where(model.id > after)
+        return statement
+
+    if include_archived:
+        return union_archived(rows_of, Loan)
+    return rows_of(Loan).order_by(Loan.id.asc())
+
+
+def json_number(value):
+    # json.dumps default for the Decimal values of numeric columns
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class RowsJSONResponse(JSONResponse):
+    # JSONResponse for plain database rows, which may hold Decimal values
 
-    # Convert the items to a list of ItemResponse models for the response
-    loans_response = [
-        LoanView(id=loan.id, amount=loan.amount, terms=loan.terms, status=loan.status, user_id=loan.user_id)
-        for loan in loans
-    ]
+    def render(self, content) -> bytes:
+        return json.dumps(
+            content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=json_number
+        ).encode("utf-8")
 
-    return loans_response
+
+def encode_loans_ndjson(rows):
+    # Runs after the 200 headers are sent, so it must not fail on a Decimal
+    return "".join(json.dumps(dict(row._mapping), default=json_number) + "\n" for row in rows)
 
 # Endpoint for approval/rejection
 @app.post("/loans/decision")
@@ -179,63 +481,204 @@ async def get_loans_for_user(loan_data: LoanApprove,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)):
 
-    user = db.query(User).filter(User.id == current_user["id"]).first()
-    if user.admin == 1:
-        loan = db.query(Loan).filter(Loan.id == loan_data.id).first()
-        if loan:
-            # Update loan approval status
-            loan.status = loan_data.decision
-
-            # If approved, save the payment terms in the database
-            if loan_data.decision == 1:
-                amount_per_installment = loan.amount / loan.terms
-                date = datetime.now()
-                for i in range(loan.terms):
-                    payment_status = PaymentTerm (
-                        amount = amount_per_installment,
-                        due_date = date + timedelta(days = 7 * (i+1)),
-                        payment_status = "Pending",
-                        user_id = loan.user_id,
-                        loan_id = loan.id
-                    )
-
-                    db.add(payment_status)
-
-            db.commit()
-            return {"message": "Loan status updated successfully."}
+    if current_user["admin"]:
+        result = await run_db(db, decide_loan, loan_data)
+        record_write(current_user["id"])
+        return result
     else:
         return {"message":"User is not permitted."}
-    
 
-# Endpoint to get pending payments with the earliest due date
+
+def decide_loan(db: Session, loan_data: LoanApprove):
+    loan = db.query(Loan).filter(Loan.id == loan_data.id).with_for_update().first()
+    if loan and loan.status != WAITING_FOR_APPROVAL:
+        # Deciding again would schedule an approved loan's installments twice
+        db.rollback()
+        return {"message": "Loan has already been decided.", "skipped": [loan.id]}
+    if loan:
+        changes = SummaryChanges()
+        changes.loan(loan.user_id, loan.status, loan.amount, loan.outstanding_balance,
+                     loan.remaining_installments, sign=-1)
+
+        # Update loan approval status
+        loan.status = loan_data.decision
+
+        # If approved, save the payment terms in the database
+        if loan_data.decision == 1:
+            for row in insert_payment_schedules(db, [loan], datetime.now()):
+                changes.installment(row["user_id"], row["due_date"], row["amount"])
+            loan.remaining_installments = loan.terms
+            loan.outstanding_balance = loan.amount
+
+        changes.loan(loan.user_id, loan.status, loan.amount, loan.outstanding_balance, loan.remaining_installments)
+        publish(db, "loan.decided", {"loans": [loan.id], "decision": loan_data.decision}, changes)
+        bump_data_versions(db, [loan.user_id])
+        db.commit()
+        next_due_cache.invalidate(loan.user_id)
+        return {"message": "Loan status updated successfully."}
+
+
+# Endpoint to approve or reject many loans in one transaction
+@app.post("/loans/decision/batch")
+async def decide_loans_batch(loan_data: LoanBatchDecision,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)):
+
+    if not current_user["admin"]:
+        return {"message": "User is not permitted."}
+
+    result = await run_db(db, decide_loans, loan_data)
+    record_write(current_user["id"])
+    return result
+
+
+def decide_loans(db: Session, loan_data: LoanBatchDecision):
+    loan_ids = list(dict.fromkeys(loan_data.ids))
+    date = datetime.now()
+    found = set()
+    decided = []
+    user_ids = set()
+    changes = SummaryChanges()
+
+    # Keep IN lists and schedule inserts bounded by working through the ids in chunks
+    for i in range(0, len(loan_ids), DECISION_CHUNK):
+        chunk = loan_ids[i:i + DECISION_CHUNK]
+        rows = db.execute(
+            select(
+                Loan.id, Loan.amount, Loan.terms, Loan.user_id,
+                Loan.status, Loan.outstanding_balance, Loan.remaining_installments,
+            ).where(Loan.id.in_(chunk)).with_for_update()
+        ).all()
+        found.update(loan.id for loan in rows)
+        # Loans that were already approved or rejected are skipped, not decided again
+        loans = [loan for loan in rows if loan.status == WAITING_FOR_APPROVAL]
+        if not loans:
+            continue
+        decided.extend(loan.id for loan in loans)
+        user_ids.update(loan.user_id for loan in loans)
+        for loan in loans:
+            changes.loan(loan.user_id, loan.status, loan.amount, loan.outstanding_balance,
+                         loan.remaining_installments, sign=-1)
+            if loan_data.decision == 1:
+                changes.loan(loan.user_id, loan_data.decision, loan.amount, loan.amount, loan.terms)
+            else:
+                changes.loan(loan.user_id, loan_data.decision, loan.amount, loan.outstanding_balance,
+                             loan.remaining_installments)
+
+        values = {"status": loan_data.decision}
+        if loan_data.decision == 1:
+            values.update(remaining_installments=Loan.terms, outstanding_balance=Loan.amount)
+        db.execute(
+            update(Loan)
+            .where(Loan.id.in_([loan.id for loan in loans]))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if loan_data.decision == 1:
+            for row in insert_payment_schedules(db, loans, date):
+                changes.installment(row["user_id"], row["due_date"], row["amount"])
+
+    if decided:
+        publish(db, "loan.decided", {"loans": sorted(decided), "decision": loan_data.decision}, changes)
+        bump_data_versions(db, user_ids)
+    db.commit()
+    for user_id in user_ids:
+        next_due_cache.invalidate(user_id)
+    decided_ids = set(decided)
+    return {
+        "message": "Loan statuses updated successfully.",
+        "updated": len(decided),
+        "skipped": [loan_id for loan_id in loan_ids if loan_id in found and loan_id not in decided_ids],
+        "not_found": [loan_id for loan_id in loan_ids if loan_id not in found],
+    }
+
+
+def insert_payment_schedules(db: Session, loans, date: datetime):
+    # One multi-row INSERT per batch of installments instead of a unit-of-work
+    # flush per PaymentTerm object. Returns the rows inserted.
+    rows = installment_rows(loans, date)
+    if rows:
+        db.execute(insert(PaymentTerm), rows)
+    return rows
+
+
+# Endpoint to price what-if loans: the installment, total interest and (unless
+# include_schedules is false) the amortized schedule of each, at any rate and
+# frequency. Nothing is read from or written to the database.
+@app.post("/loans/quote")
+async def quote_loans_batch(quote_data: LoanQuoteBatch, current_user: User = Depends(get_current_user)):
+    start = quote_data.start_date or date.today()
+    quotes = [(loan.amount, loan.terms, loan.annual_rate, loan.frequency) for loan in quote_data.loans]
+    # Large batches take a while to price, so keep them off the event loop
+    loans = await asyncio.get_running_loop().run_in_executor(
+        None, quote_loans, quotes, start, quote_data.include_schedules
+    )
+    # Plain JSON values already, so skip jsonable_encoder
+    return JSONResponse({"start_date": start.isoformat(), "loans": loans})
+
+
+NOT_CACHED = object()
+
+
+# Endpoint to get pending payments with the earliest due date. The answer
+# carries an ETag; sending it back in If-None-Match gets a 304 until the user's
+# data changes or the installment falls due.
 @app.get("/payments/pending-earliest-due-date")
 async def get_pending_payments_with_earliest_due_date(
-    db: Session = Depends(get_db),
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_user)
 ):
+    # Every poll reads the user's data version, which every write to their
+    # loans or installments bumps in any worker process. Cached as (data
+    # version, payment) and served only while that version is current.
+    generation = next_due_cache.generation
+    version = await run_db(db, user_data_version, current_user["id"])
+    now = datetime.now()
+    cached = next_due_cache.get(current_user["id"], NOT_CACHED)
+    # Entries whose due date has passed since they were cached are refreshed
+    if cached is NOT_CACHED or cached[0] != version or (cached[1] and as_datetime(cached[1]["due_date"]) <= now):
+        # A current tag needs only the version, not the installment
+        etag = current_next_due_etag(if_none_match, version, now)
+        if etag is not None:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+        cached = (version, await run_db(db, find_earliest_pending_payment, current_user["id"]))
+        next_due_cache.set_unless_invalidated(current_user["id"], cached, generation)
+
+    version, pending_payment = cached
+    etag = next_due_etag(version, pending_payment)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+
+    if pending_payment:
+        return pending_payment
+    else:
+        return {"message": "No pending payments with future due dates found."}
+
+
+def find_earliest_pending_payment(db: Session, user_id: int):
     # Get the current date and time
     current_datetime = datetime.now()
 
     # Query for pending payments with the earliest due date
-    pending_payment = (
-        db.query(PaymentTerm)
-        .filter(PaymentTerm.user_id == current_user["id"])
-        .filter(PaymentTerm.payment_status == "Pending")
-        .filter(PaymentTerm.due_date > current_datetime)
+    pending_payment = db.execute(
+        select(PaymentTerm.id, PaymentTerm.amount, PaymentTerm.due_date, PaymentTerm.user_id, PaymentTerm.loan_id)
+        .where(PaymentTerm.user_id == user_id)
+        .where(PaymentTerm.payment_status == "Pending")
+        .where(PaymentTerm.due_date > current_datetime)
         .order_by(PaymentTerm.due_date.asc())
-        .first()
-    )
-
-    if pending_payment:
-        return {
-            "id": pending_payment.id,
-            "amount": pending_payment.amount,
-            "due_date": pending_payment.due_date,
-            "user_id": pending_payment.user_id,
-            "loan_id": pending_payment.loan_id
-        }
-    else:
-        return {"message": "No pending payments with future due dates found."}
+        .limit(1)
+    ).first()
+    if not pending_payment:
+        return None
+
+    # The same datetime on every backend, for the ETag and the cache
+    pending_payment = pending_payment._asdict()
+    pending_payment["due_date"] = as_datetime(pending_payment["due_date"])
+    return pending_payment
     
 @app.post("/payments/make-payment/")
 async def make_payment(
@@ -243,34 +686,309 @@ async def make_payment(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
+    result = await run_db(db, apply_payment, payment_data, current_user["id"])
+    record_write(current_user["id"])
+    return result
+
+
+def apply_payment(db: Session, payment_data: MakePayment, user_id: int):
     # Retrieve the payment record from the database
-    payment = db.query(PaymentTerm).filter(PaymentTerm.user_id == current_user["id"]).filter(PaymentTerm.id == payment_data.payment_id).first()
+    payment = db.query(PaymentTerm).filter(PaymentTerm.user_id == user_id).filter(PaymentTerm.id == payment_data.payment_id).first()
 
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
 
     # Check if the payment amount is greater than or equal to the due amount
-    if payment_data.amount >= payment.amount:
-        # Mark the payment as paid
-        payment.payment_status = "Paid"
-        db.commit()
+    if payment_data.amount < payment.amount:
+        return {"message": "Transiction failed. Payment amount is less than the due amount."}
 
-        # Check if all payments related to the loan are paid
-        check_loan_paid(db, payment.loan_id)
+    for _ in range(PAYMENT_ATTEMPTS):
+        # Lock the loan before its installment, the order apply_loan_payment
+        # takes them in, so concurrent payments of a loan cannot deadlock
+        # (MySQL). SQLite ignores FOR UPDATE; settle_installment's
+        # compare-and-set catches a loan changed since this read there.
+        loan = db.execute(
+            select(Loan.status, Loan.amount, Loan.outstanding_balance, Loan.remaining_installments)
+            .where(Loan.id == payment.loan_id)
+            .with_for_update()
+        ).one()
+
+        # Mark the payment as paid, unless a concurrent request already did
+        marked = db.execute(
+            update(PaymentTerm)
+            .where(PaymentTerm.id == payment.id)
+            .where(PaymentTerm.payment_status != "Paid")
+            .values(payment_status="Paid")
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+        if marked:
+            if loan.remaining_installments > 0:
+                if not settle_installment(db, payment.loan_id, payment.amount, loan.remaining_installments):
+                    db.rollback()
+                    continue
+                remaining, balance = loan.remaining_installments - 1, loan.outstanding_balance - payment.amount
+            else:
+                remaining, balance = count_loan_counters(db, payment.loan_id)
+            closed = remaining <= 0
+
+            changes = SummaryChanges()
+            changes.installment(user_id, payment.due_date, payment.amount, sign=-1)
+            changes.loan(user_id, *loan, sign=-1)
+            changes.loan(user_id, "Paid" if closed else loan.status, loan.amount, balance, remaining)
+            publish(db, "payment.made", {
+                "user_id": user_id,
+                "loan_id": payment.loan_id,
+                "payments": [payment.id],
+                "amount": payment.amount,
+                "closed": closed,
+            }, changes)
+            bump_data_versions(db, [user_id])
+        db.commit()
+        next_due_cache.invalidate(user_id)
 
         return {"message": "Payment successful. Payment marked as Paid."}
-    else:
-        return {"message": "Transiction failed. Payment amount is less than the due amount."}
-    
-# Function to check if all payments related to a loan are paid
-def check_loan_paid(db: Session, loan_id: int):
-    # Query the payments related to the loan
-    payments = db.query(PaymentTerm).filter(PaymentTerm.loan_id == loan_id).all()
-
-    # Check if all payments are marked as "Paid"
-    if all(payment.payment_status == "Paid" for payment in payments):
-        # Update the loan as "Paid" if all payments are paid
-        loan = db.query(Loan).filter(Loan.id == loan_id).first()
-        if loan:
-            loan.status = "Paid"
-            db.commit()
\ No newline at end of file
+
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Loan is being paid by another request, please retry",
+    )
+
+
+# Count a paid installment against its loan's counters, closing the loan when it
+# was the last one. A single UPDATE, so it needs no SELECT of the loan or its
+# other installments. Applies only while the loan still has the remaining
+# installments the caller read; returns whether it did.
+def settle_installment(db: Session, loan_id: int, amount, remaining: int):
+    return db.execute(
+        update(Loan)
+        .where(Loan.id == loan_id)
+        .where(Loan.remaining_installments == remaining)
+        # status is assigned first: MySQL evaluates SET left to right, so it has
+        # to see remaining_installments before the decrement
+        .ordered_values(
+            (Loan.status, case((Loan.remaining_installments <= 1, "Paid"), else_=Loan.status)),
+            (Loan.remaining_installments, Loan.remaining_installments - 1),
+            (Loan.outstanding_balance, Loan.outstanding_balance - amount),
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+# Set the counters of a loan that has none, written before migration 0002 and
+# not reconciled, from its unpaid installments, instead of taking its zero
+# count for the last installment. Closes the loan if none are left. Returns
+# (remaining_installments, outstanding_balance).
+def count_loan_counters(db: Session, loan_id: int):
+    db.execute(
+        update(Loan)
+        .where(Loan.id == loan_id)
+        .values(**loan_counter_values())
+        .execution_options(synchronize_session=False)
+    )
+    remaining, balance = db.execute(
+        select(Loan.remaining_installments, Loan.outstanding_balance).where(Loan.id == loan_id)
+    ).one()
+    if remaining <= 0:
+        db.execute(
+            update(Loan).where(Loan.id == loan_id).values(status="Paid").execution_options(synchronize_session=False)
+        )
+    return remaining, balance
+
+
+# Endpoint to pay any amount towards a loan. It settles the loan's unpaid
+# installments in due date order, as many as the amount covers in full, in one
+# transaction.
+@app.post("/payments/prepay/")
+async def prepay_loan(
+    payment_data: LoanPayment,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    result = await run_db(db, apply_loan_payment, payment_data, current_user["id"])
+    record_write(current_user["id"])
+    return result
+
+
+def apply_loan_payment(db: Session, payment_data: LoanPayment, user_id: int):
+    for _ in range(PAYMENT_ATTEMPTS):
+        # Lock the loan and its unpaid installments until commit. SQLite ignores
+        # FOR UPDATE; the compare-and-set on remaining_installments below makes
+        # concurrent payments safe there too.
+        loan = db.execute(
+            select(Loan.id, Loan.status, Loan.amount, Loan.remaining_installments, Loan.outstanding_balance)
+            .where(Loan.id == payment_data.loan_id)
+            .where(Loan.user_id == user_id)
+            .with_for_update()
+        ).first()
+        if not loan:
+            raise HTTPException(status_code=404, detail="Loan not found")
+
+        installments = db.execute(
+            select(PaymentTerm.id, PaymentTerm.amount, PaymentTerm.due_date)
+            .where(PaymentTerm.loan_id == loan.id)
+            .where(PaymentTerm.payment_status != "Paid")
+            .order_by(PaymentTerm.due_date.asc(), PaymentTerm.id.asc())
+            .with_for_update()
+        ).all()
+        if not installments:
+            db.rollback()
+            return {"message": "Loan has no unpaid installments."}
+
+        # Settle installments while the amount covers them in full (to the cent)
+        unapplied = payment_data.amount
+        paid = []
+        for installment in installments:
+            if round(unapplied - installment.amount, 2) < 0:
+                break
+            unapplied -= installment.amount
+            paid.append(installment)
+
+        if not paid:
+            db.rollback()
+            return {"message": "Transiction failed. Payment amount is less than the due amount."}
+
+        applied = sum(installment.amount for installment in paid)
+        # A loan without counters (see count_loan_counters) is counted from
+        # the unpaid installments just read
+        if loan.remaining_installments > 0:
+            counted, balance = loan.remaining_installments, loan.outstanding_balance
+        else:
+            counted, balance = len(installments), sum(installment.amount for installment in installments)
+        remaining_installments = counted - len(paid)
+        values = {
+            "remaining_installments": remaining_installments,
+            "outstanding_balance": balance - applied,
+        }
+        if remaining_installments <= 0:
+            values["status"] = "Paid"
+
+        # Every payment decrements remaining_installments in its own transaction,
+        # so an unchanged count means no other payment settled anything since the
+        # installments were read
+        claimed = db.execute(
+            update(Loan)
+            .where(Loan.id == loan.id)
+            .where(Loan.remaining_installments == loan.remaining_installments)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        marked = claimed and db.execute(
+            update(PaymentTerm)
+            .where(PaymentTerm.id.in_([installment.id for installment in paid]))
+            .where(PaymentTerm.payment_status != "Paid")
+            .values(payment_status="Paid")
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if marked != len(paid):
+            db.rollback()
+            continue
+
+        changes = SummaryChanges()
+        for installment in paid:
+            changes.installment(user_id, installment.due_date, installment.amount, sign=-1)
+        changes.loan(user_id, loan.status, loan.amount, loan.outstanding_balance, loan.remaining_installments,
+                     sign=-1)
+        changes.loan(user_id, values.get("status", loan.status), loan.amount, balance - applied,
+                     remaining_installments)
+        publish(db, "payment.made", {
+            "user_id": user_id,
+            "loan_id": loan.id,
+            "payments": [installment.id for installment in paid],
+            "amount": round(applied, 2),
+            "closed": remaining_installments <= 0,
+        }, changes)
+        bump_data_versions(db, [user_id])
+        db.commit()
+        next_due_cache.invalidate(user_id)
+        return {
+            "message": "Payment successful.",
+            "paid_installments": [installment.id for installment in paid],
+            "amount_applied": round(applied, 2),
+            "unapplied_amount": round(unapplied, 2),
+            "remaining_installments": remaining_installments,
+            "outstanding_balance": round(balance - applied, 2),
+        }
+
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Loan is being paid by another request, please retry",
+    )
+
+
+# Endpoint for admins to download every loan or installment as CSV, Parquet or
+# an Arrow IPC stream, optionally of one status and a date range (loan start
+# date, installment due date), and with the archived rows if include_archived.
+# Rows are streamed from a server-side cursor.
+@app.get("/export/{table}")
+async def export_table(
+    table: str,
+    export_format: str = Query("csv", alias="format"),
+    loan_status: Optional[str] = Query(None, alias="status"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    include_archived: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)):
+
+    if not current_user["admin"]:
+        return {"message": "User is not permitted."}
+    if table not in EXPORT_TABLES or export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+
+    media_type, extension = EXPORT_FORMATS[export_format]
+    encoder = make_encoder(table, export_format)
+    statement = export_statement(table, loan_status, since, until, include_archived)
+    return StreamingResponse(
+        with_trailer(stream_chunks(db, statement, encoder.encode, EXPORT_CHUNK), encoder),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table}.{extension}"'},
+    )
+
+
+# Endpoint for admins to bulk-load users, loans or existing schedules from an
+# NDJSON or CSV body (format=csv, or a text/csv content type). Records that
+# fail validation are listed by line in the response; the rest are inserted.
+@app.post("/ingest/{kind}")
+async def ingest_records(
+    kind: str,
+    request: Request,
+    record_format: Optional[str] = Query(None, alias="format"),
+    chunk_size: int = Query(INGEST_CHUNK, ge=1, le=MAX_INGEST_CHUNK),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)):
+
+    if not current_user["admin"]:
+        return {"message": "User is not permitted."}
+    if kind not in INGEST_KINDS:
+        raise HTTPException(status_code=404, detail="Unknown record kind")
+
+    if record_format is None:
+        record_format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+    body = (await request.body()).decode("utf-8")
+    report = await ingest(db, kind, parse_records(body.splitlines(), record_format), password_hasher, chunk_size)
+
+    for user_id in report.user_ids:
+        next_due_cache.invalidate(user_id)
+    record_write(current_user["id"])
+    return report.as_dict()
+
+
+# Endpoint for admins to get portfolio totals: loans, principal and outstanding
+# balance by status, and unpaid installments overdue and due in each of the
+# next `weeks` weeks. Served from the summary tables of app/analytics.py.
+@app.get("/analytics/portfolio")
+async def get_portfolio_analytics(
+    weeks: int = Query(ANALYTICS_WEEKS, ge=1, le=MAX_ANALYTICS_WEEKS),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)):
+
+    if not current_user["admin"]:
+        return {"message": "User is not permitted."}
+    return await run_db(db, portfolio_summary, weeks)
+
+
+# Prometheus metrics of this worker process
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
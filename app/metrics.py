@@ -0,0 +1,235 @@
+import threading
+from bisect import bisect_left
+
+# Prometheus text exposition format served by GET /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self.samples()
+        return lines
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._callbacks = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn, **labels):
+        # Read the value from fn() whenever the metrics are scraped
+        with self._lock:
+            self._callbacks[self._key(labels)] = fn
+
+    def value(self, **labels):
+        key = self._key(labels)
+        if key in self._callbacks:
+            return self._callbacks[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            callbacks = dict(self._callbacks)
+        for key, fn in callbacks.items():
+            self.set(fn(), **dict(zip(self.labelnames, key)))
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def sum(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return entry[1] if entry else 0.0
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # Registering a name twice returns the metric registered first
+        return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Connection pool metrics, labelled by engine
+DB_POOL_SIZE = gauge("db_pool_size", "Configured pool size.", ["engine"])
+DB_POOL_CHECKED_OUT = gauge("db_pool_checked_out", "Connections currently in use.", ["engine"])
+DB_POOL_CHECKED_IN = gauge("db_pool_checked_in", "Idle connections in the pool.", ["engine"])
+DB_POOL_OVERFLOW = gauge(
+    "db_pool_overflow", "Connections open beyond pool_size (negative while the pool fills).", ["engine"]
+)
+DB_POOL_CHECKOUTS = counter("db_pool_checkouts_total", "Connection checkouts.", ["engine"])
+DB_POOL_OVERFLOW_CHECKOUTS = counter(
+    "db_pool_overflow_checkouts_total", "Checkouts served by an overflow connection.", ["engine"]
+)
+DB_POOL_TIMEOUTS = counter(
+    "db_pool_timeouts_total", "Checkouts that gave up after pool_timeout.", ["engine"]
+)
+DB_POOL_INVALIDATIONS = counter(
+    "db_pool_invalidations_total", "Connections discarded as disconnected or stale.", ["engine"]
+)
+DB_POOL_CHECKOUT_WAIT = histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", ["engine"]
+)
+DB_READ_ROUTING = counter(
+    "db_read_routing_total", "Read-only requests by the database that served them.", ["target"]
+)
+
+# Request metrics, labelled by method and route template
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+HTTP_REQUEST_DURATION = histogram(
+    "http_request_duration_seconds", "Time to serve a request, body included.", ["method", "route", "status"]
+)
+DB_STATEMENTS_PER_REQUEST = histogram(
+    "db_statements_per_request", "SQL statements sent while serving a request.", ["method", "route"],
+    buckets=STATEMENT_BUCKETS,
+)
+DB_TIME_PER_REQUEST = histogram(
+    "db_time_per_request_seconds", "Time spent executing SQL while serving a request.", ["method", "route"]
+)
+DB_STATEMENT_BUDGET_EXCEEDED = counter(
+    "db_statement_budget_exceeded_total",
+    "Requests that sent more SQL statements than DB_STATEMENT_BUDGET, a likely N+1 query pattern.",
+    ["method", "route"],
+)
+
+# In-process caches, labelled by cache name
+CACHE_HITS = counter("cache_hits_total", "Cache lookups answered from the cache.", ["cache"])
+CACHE_MISSES = counter("cache_misses_total", "Cache lookups that missed or found an expired entry.", ["cache"])
+CACHE_EVICTIONS = counter("cache_evictions_total", "Entries evicted to stay within maxsize.", ["cache"])
+CACHE_ENTRIES = gauge("cache_entries", "Entries currently cached.", ["cache"])
+
+# Overdue sweeper
+OVERDUE_MARKED = counter("overdue_installments_marked_total", "Overdue Pending installments marked Late.")
+OVERDUE_SWEEP_LAG = gauge(
+    "overdue_sweep_lag_seconds", "How long the oldest overdue Pending installment had waited when the last sweep started."
+)
+OVERDUE_SWEEP_DURATION = histogram("overdue_sweep_duration_seconds", "Time taken by each overdue sweep.")
+
+# Archival of settled loans
+ARCHIVED_ROWS = counter("archived_rows_total", "Rows moved from the hot tables into their history tables.", ["table"])
+ARCHIVE_DURATION = histogram("archive_duration_seconds", "Time taken by each archival run.")
+
+# Outbox worker
+OUTBOX_PROCESSED = counter("outbox_events_processed_total", "Outbox events processed and deleted.", ["kind"])
+OUTBOX_FAILED = counter("outbox_events_failed_total", "Failed attempts to process an outbox event.", ["kind"])
+OUTBOX_LAG = gauge("outbox_lag_seconds", "How long the oldest waiting outbox event had waited when the last run started.")
+OUTBOX_BATCH_DURATION = histogram("outbox_batch_duration_seconds", "Time taken by each batch of outbox events.")
+
+# Rate limiting and database admission control
+RATE_LIMITED = counter("rate_limited_requests_total", "Requests turned away with 429 by a rate limiter.", ["limiter"])
+DB_ADMISSION_IN_FLIGHT = gauge("db_admission_in_flight", "Requests holding or waiting for a database session.")
+DB_ADMISSION_REJECTED = counter(
+    "db_admission_rejected_total", "Requests turned away with 503 because the database pool was saturated."
+)
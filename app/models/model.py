@@ -1,35 +1,68 @@
-from pydantic import BaseModel
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from datetime import date, datetime
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field, root_validator
+from sqlalchemy import JSON, Column, Date, DateTime, ForeignKey, Index, Integer, Numeric, String, Text, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
 from ..db import Base
 
+# Most loans a single /loans/decision/batch request may decide
+MAX_DECISION_BATCH = 10000
+
+# Longest loan, in weekly installments
+MAX_LOAN_TERMS = 12
+
+# Most loans priced by one POST /loans/quote, and the most installments of each
+MAX_QUOTE_LOANS = 10000
+MAX_QUOTE_TERMS = 520
+# Schedules are priced as one loans x longest terms grid, which this bounds
+MAX_QUOTE_INSTALLMENTS = 200000
+
+# Rows the global data version is spread over (keep in step with migration 0005)
+DATA_VERSION_SHARDS = 16
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(255), unique=True, index=True)
-    password = Column(String(255), unique=True, index=True)
+    password = Column(String(255))
     email = Column(String(255), unique=True, index=True)
     admin = Column(Integer)
+    # Bumped by every write to the user's loans or installments; see app/versions.py
+    data_version = Column(Integer, default=0, server_default="0", nullable=False)
     loans = relationship("Loan", back_populates="user")
     payment_status = relationship("PaymentTerm", back_populates="user")
 
 class Loan(Base):
     __tablename__ = "loans"
+    # Ids are never handed out again, even once the loan is archived
+    __table_args__ = {"sqlite_autoincrement": True}
     id = Column(Integer, primary_key=True, index=True)
-    amount = Column(Integer)
+    amount = Column(Numeric(10, 2, asdecimal=False))
     terms = Column(Integer)
     start_date = Column(DateTime, default=func.now())
     status = Column(String(255))
+    # Installments not yet paid and their total, kept up to date by make_payment
+    remaining_installments = Column(Integer, default=0, server_default="0", nullable=False)
+    outstanding_balance = Column(Numeric(10, 2, asdecimal=False), default=0, server_default="0", nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User", back_populates="loans")
     payment_status = relationship("PaymentTerm", back_populates="loan")
 
 class PaymentTerm(Base):
     __tablename__ = "payment_status"
+    # Keep in step with the migrations in Database/migrations
+    __table_args__ = (
+        Index("ix_payment_status_user_status_due", "user_id", "payment_status", "due_date"),
+        Index("ix_payment_status_loan_status_due", "loan_id", "payment_status", "due_date"),
+        Index("ix_payment_status_status_due", "payment_status", "due_date"),
+        {"sqlite_autoincrement": True},
+    )
     id = Column(Integer, primary_key=True, index=True)
-    amount = Column(Integer)
+    # Installments are amortized to the cent by app/schedule.py
+    amount = Column(Numeric(10, 2, asdecimal=False))
     due_date = Column(DateTime)
     payment_status = Column(String(255))
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -37,6 +70,77 @@ class PaymentTerm(Base):
     loan_id = Column(Integer, ForeignKey("loans.id"))
     loan = relationship("Loan", back_populates="payment_status")
 
+# Settled loans and their installments, moved out of the hot tables by
+# app/archive.py with their ids, plus when they were moved
+class LoanHistory(Base):
+    __tablename__ = "loans_history"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    amount = Column(Numeric(10, 2, asdecimal=False))
+    terms = Column(Integer)
+    start_date = Column(DateTime)
+    status = Column(String(255))
+    remaining_installments = Column(Integer, default=0, server_default="0", nullable=False)
+    outstanding_balance = Column(Numeric(10, 2, asdecimal=False), default=0, server_default="0", nullable=False)
+    user_id = Column(Integer, index=True)
+    archived_at = Column(DateTime, nullable=False)
+
+class PaymentTermHistory(Base):
+    __tablename__ = "payment_status_history"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    amount = Column(Numeric(10, 2, asdecimal=False))
+    due_date = Column(DateTime)
+    payment_status = Column(String(255))
+    user_id = Column(Integer)
+    loan_id = Column(Integer, index=True)
+    archived_at = Column(DateTime, nullable=False)
+
+class OutboxEvent(Base):
+    # Payment and approval events, written in the transaction of the change
+    # they describe and deleted by app/outbox.py once processed. attempts and
+    # last_error record failed processing.
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(64), nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)
+    last_error = Column(Text)
+
+class DataVersion(Base):
+    # Shards of the version of all loan data, summed for admin ETags. A write
+    # bumps the shards of the users it touched, so writers for different users
+    # rarely queue on the same row.
+    __tablename__ = "data_versions"
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, default=0, server_default="0", nullable=False)
+
+
+@event.listens_for(DataVersion.__table__, "after_create")
+def add_data_version_shards(target, connection, **kw):
+    connection.execute(target.insert(), [{"shard": shard, "version": 0} for shard in range(DATA_VERSION_SHARDS)])
+
+
+# Portfolio totals kept up to date by the writes that change them; see
+# app/analytics.py. Rows are split by shard (user_id % DATA_VERSION_SHARDS) for
+# the same reason as DataVersion, and summed when read.
+class LoanSummary(Base):
+    # Loans, their principal and what is left to pay, by status
+    __tablename__ = "loan_summary"
+    status = Column(String(255), primary_key=True)
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    loans = Column(Integer, default=0, server_default="0", nullable=False)
+    amount = Column(Numeric(16, 2, asdecimal=False), default=0, server_default="0", nullable=False)
+    outstanding_balance = Column(Numeric(16, 2, asdecimal=False), default=0, server_default="0", nullable=False)
+    remaining_installments = Column(Integer, default=0, server_default="0", nullable=False)
+
+class CollectionSummary(Base):
+    # Unpaid (Pending or Late) installments by due day
+    __tablename__ = "collection_summary"
+    due_date = Column(Date, primary_key=True)
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    installments = Column(Integer, default=0, server_default="0", nullable=False)
+    amount = Column(Numeric(16, 2, asdecimal=False), default=0, server_default="0", nullable=False)
+
 
 class UserCreate(BaseModel):
     username: str
@@ -51,9 +155,35 @@ class LoanApprove(BaseModel):
     id: int
     decision: int
 
+class LoanBatchDecision(BaseModel):
+    ids: List[int] = Field(..., min_items=1, max_items=MAX_DECISION_BATCH)
+    decision: int
+
+class LoanQuote(BaseModel):
+    amount: float = Field(..., gt=0)
+    terms: int = Field(..., ge=1, le=MAX_QUOTE_TERMS)
+    # Yearly interest as a fraction, 0.12 for 12%
+    annual_rate: float = Field(0, ge=0, le=10)
+    frequency: Literal["weekly", "biweekly", "monthly"] = "weekly"
+
+class LoanQuoteBatch(BaseModel):
+    loans: List[LoanQuote] = Field(..., min_items=1, max_items=MAX_QUOTE_LOANS)
+    # First due dates are one period after start_date, today by default
+    start_date: Optional[date] = None
+    include_schedules: bool = True
+
+    @root_validator(skip_on_failure=True)
+    def check_size(cls, values):
+        loans = values["loans"]
+        if len(loans) * max(loan.terms for loan in loans) > MAX_QUOTE_INSTALLMENTS:
+            raise ValueError(
+                f"loans times the longest terms must not exceed {MAX_QUOTE_INSTALLMENTS}; split the request"
+            )
+        return values
+
 class LoanView(BaseModel):
     id: int
-    amount: int
+    amount: float
     terms: int
     status: str
     user_id: int
@@ -64,4 +194,33 @@ class UserLogin(BaseModel):
 
 class MakePayment(BaseModel):
     payment_id: int
-    amount: float
\ No newline at end of file
+    amount: float
+
+class LoanPayment(BaseModel):
+    loan_id: int
+    amount: float = Field(..., gt=0)
+
+
+# Records accepted by the bulk ingestion of app/ingest.py
+class LoanImport(BaseModel):
+    # Give loans an id to attach their existing schedule to them
+    id: Optional[int] = Field(None, ge=1)
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    amount: int = Field(..., gt=0)
+    terms: int = Field(..., ge=1, le=MAX_LOAN_TERMS)
+    start_date: Optional[datetime] = None
+    status: str = "Waiting for approval"
+
+    @root_validator(skip_on_failure=True)
+    def check_borrower(cls, values):
+        if (values["user_id"] is None) == (values["username"] is None):
+            raise ValueError("give exactly one of user_id and username")
+        return values
+
+class PaymentImport(BaseModel):
+    id: Optional[int] = Field(None, ge=1)
+    loan_id: int
+    amount: float = Field(..., gt=0)
+    due_date: datetime
+    payment_status: Literal["Pending", "Paid", "Late", "Failed"] = "Pending"
@@ -0,0 +1,212 @@
+"""Process the outbox of payment and approval events.
+
+Runs until the outbox is empty, or every --interval seconds:
+
+    python -m app.outbox [--batch-size 500] [--interval 0]
+
+Payments, prepayments and loan decisions add an event to the outbox table in
+the transaction that makes the change, so an event exists exactly when its
+change was committed. They also leave their changes to the portfolio totals
+in the event rather than writing the summary tables themselves. The worker
+takes events oldest first, batch_size at a time, and in one transaction per
+batch adds their totals, runs the handlers registered for their kinds and
+deletes them. Every event is therefore processed at least once, and what the
+worker writes to this database happens exactly once. Handlers with effects
+elsewhere (receipts, ledger postings, notifications) should be idempotent,
+keyed by event id.
+
+A batch that fails is retried one event at a time. A failing event is left in
+the table with its error and retried by later runs, up to OUTBOX_MAX_ATTEMPTS
+attempts.
+
+The API drains the outbox in-process every OUTBOX_INTERVAL seconds (default
+1); set it to 0 to leave that to the CLI.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .analytics import SummaryChanges
+from .db import database
+from .models.model import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Seconds between in-process drains; 0 leaves processing to the CLI
+OUTBOX_INTERVAL = float(os.environ.get("OUTBOX_INTERVAL", 1))
+# Events processed per transaction
+OUTBOX_BATCH = int(os.environ.get("OUTBOX_BATCH", 500))
+# Failed attempts after which an event is no longer retried
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+
+# Functions called with (db, events) for each batch of events of a kind, in
+# the batch's transaction
+HANDLERS = defaultdict(list)
+
+
+def handles(kind: str):
+    # Register a handler for events of kind:
+    #
+    #     @handles("payment.made")
+    #     def send_receipts(db, events): ...
+    def register(handler):
+        HANDLERS[kind].append(handler)
+        return handler
+    return register
+
+
+def publish(db: Session, kind: str, payload: dict, changes: SummaryChanges = None):
+    # Add an event to the outbox in db's transaction. changes are added to the
+    # portfolio totals when the event is processed instead of now.
+    if changes is not None:
+        payload = dict(payload, totals=changes.to_payload())
+    db.execute(insert(OutboxEvent).values(kind=kind, payload=payload, created_at=datetime.now()))
+
+
+def handle_events(db: Session, events):
+    # Process events in db's transaction: their totals in one upsert per
+    # summary table, then each kind's handlers, then delete them. Raises if
+    # another worker has processed any of them meanwhile.
+    changes = SummaryChanges()
+    by_kind = defaultdict(list)
+    for event in events:
+        if "totals" in event.payload:
+            changes.add_payload(event.payload["totals"])
+        by_kind[event.kind].append(event)
+    changes.apply(db)
+    for kind, group in by_kind.items():
+        for handler in HANDLERS[kind]:
+            handler(db, group)
+
+    ids = [event.id for event in events]
+    deleted = db.execute(
+        delete(OutboxEvent).where(OutboxEvent.id.in_(ids)).execution_options(synchronize_session=False)
+    ).rowcount
+    if deleted != len(ids):
+        raise RuntimeError("outbox events were processed by another worker")
+    return by_kind
+
+
+def process_outbox(db: Session, batch_size: int = OUTBOX_BATCH, now: datetime = None):
+    # Process every event that is waiting, batch_size per transaction. Events
+    # are locked as they are read and locked ones skipped (MySQL), so several
+    # workers can drain the outbox together.
+    now = now or datetime.now()
+    waiting = OutboxEvent.attempts < OUTBOX_MAX_ATTEMPTS
+
+    oldest = db.execute(select(func.min(OutboxEvent.created_at)).where(waiting)).scalar()
+    lag = max((now - oldest).total_seconds(), 0.0) if oldest is not None else 0.0
+    metrics.OUTBOX_LAG.set(lag)
+
+    start = time.perf_counter()
+    processed = failed = 0
+    last_id = 0
+    columns = (OutboxEvent.id, OutboxEvent.kind, OutboxEvent.payload, OutboxEvent.created_at)
+    while True:
+        events = db.execute(
+            select(*columns)
+            .where(waiting, OutboxEvent.id > last_id)
+            .order_by(OutboxEvent.id.asc())
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not events:
+            break
+        last_id = events[-1].id
+
+        batch_start = time.perf_counter()
+        try:
+            done = [handle_events(db, events)]
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.warning("Outbox batch of %d events failed; retrying them one at a time", len(events), exc_info=True)
+            done = []
+            for event in events:
+                # Locked again, unless another worker took it meanwhile
+                event = db.execute(
+                    select(*columns).where(OutboxEvent.id == event.id).with_for_update(skip_locked=True)
+                ).first()
+                if event is None:
+                    continue
+                try:
+                    done.append(handle_events(db, [event]))
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    logger.exception("Outbox event %d (%s) failed", event.id, event.kind)
+                    db.execute(
+                        update(OutboxEvent)
+                        .where(OutboxEvent.id == event.id)
+                        .values(attempts=OutboxEvent.attempts + 1, last_error=repr(e)[:1000])
+                    )
+                    db.commit()
+                    failed += 1
+                    metrics.OUTBOX_FAILED.inc(kind=event.kind)
+        metrics.OUTBOX_BATCH_DURATION.observe(time.perf_counter() - batch_start)
+
+        for by_kind in done:
+            for kind, group in by_kind.items():
+                processed += len(group)
+                metrics.OUTBOX_PROCESSED.inc(len(group), kind=kind)
+
+        if len(events) < batch_size:
+            break
+
+    seconds = time.perf_counter() - start
+    return {
+        "processed": processed,
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "events_per_second": round(processed / seconds, 2) if seconds else 0.0,
+        "lag_seconds": round(lag, 3),
+    }
+
+
+def process_once(batch_size: int = OUTBOX_BATCH):
+    db = database.session()
+    try:
+        return process_outbox(db, batch_size)
+    finally:
+        db.close()
+
+
+async def run_outbox_worker(interval: float = OUTBOX_INTERVAL, batch_size: int = OUTBOX_BATCH):
+    # In-process worker. Batches run on a worker thread so the event loop
+    # keeps serving requests; a failed run is logged and retried next time.
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, process_once, batch_size)
+        except Exception:
+            logger.exception("Outbox processing failed")
+        await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH)
+    parser.add_argument("--interval", type=float, default=0.0, help="drain every this many seconds")
+    args = parser.parse_args()
+
+    while True:
+        result = process_once(args.batch_size)
+        print(
+            f"Processed {result['processed']} events ({result['failed']} failed) in {result['seconds']}s "
+            f"({result['events_per_second']} events/s); the oldest had waited {result['lag_seconds']}s."
+        )
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Rebuild the loans' installment counters from payment_status.
+
+    python -m app.reconcile [--chunk-size 1000]
+"""
+import argparse
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from .db import database
+from .models.model import Loan, PaymentTerm
+
+
+def loan_counter_values():
+    # remaining_installments and outstanding_balance of each updated loan,
+    # counted from its unpaid installments by correlated subqueries
+    unpaid = (PaymentTerm.loan_id == Loan.id) & (PaymentTerm.payment_status != "Paid")
+    return {
+        "remaining_installments": select(func.count(PaymentTerm.id)).where(unpaid).scalar_subquery(),
+        "outstanding_balance": select(func.coalesce(func.sum(PaymentTerm.amount), 0)).where(unpaid).scalar_subquery(),
+    }
+
+
+def reconcile_loan_counters(db: Session, chunk_size: int = 1000):
+    # Recompute remaining_installments and outstanding_balance with one
+    # set-based UPDATE per range of loan ids, committing after each range so
+    # no lock is held across the whole table
+    min_id, max_id = db.execute(select(func.min(Loan.id), func.max(Loan.id))).one()
+    if min_id is None:
+        return 0
+
+    reconciled = 0
+    for start in range(min_id - 1, max_id, chunk_size):
+        reconciled += db.execute(
+            update(Loan)
+            .where(Loan.id > start, Loan.id <= start + chunk_size)
+            .values(**loan_counter_values())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+    return reconciled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = database.session()
+    try:
+        reconciled = reconcile_loan_counters(db, args.chunk_size)
+    finally:
+        db.close()
+    print(f"Reconciled counters of {reconciled} loans.")
+
+
+if __name__ == "__main__":
+    main()
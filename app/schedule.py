@@ -0,0 +1,200 @@
+"""Repayment schedules, computed with NumPy for many loans at once.
+
+Loans are amortized at a fixed installment: each period is charged interest on
+the balance at the periodic rate (annual_rate / periods per year), and the rest
+of the installment repays principal. Amounts are kept in whole cents. The
+installment is rounded to the cent and the last one absorbs what rounding left
+over, so every schedule repays its principal exactly. A zero rate splits the
+principal into equal installments.
+
+The engine works on arrays of loans: one vectorized step per period, whatever
+the number of loans. Approving loans and POST /loans/quote both use it.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+# Periods per year, and the days between due dates (None for calendar months)
+FREQUENCIES = {
+    "weekly": (52, 7),
+    "biweekly": (26, 14),
+    "monthly": (12, None),
+}
+
+
+class Schedules(NamedTuple):
+    # One row per loan and one column per period, in cents. Columns past a
+    # loan's terms are zero.
+    terms: np.ndarray
+    payment: np.ndarray
+    principal: np.ndarray
+    interest: np.ndarray
+    balance: np.ndarray
+
+    def mask(self):
+        # True for the periods each loan actually has
+        return np.arange(self.payment.shape[1]) < self.terms[:, None]
+
+
+def to_cents(amounts):
+    return np.floor(np.asarray(amounts, dtype=float) * 100 + 0.5)
+
+
+def from_cents(values):
+    return (values / 100).tolist()
+
+
+def round_half_up(values):
+    return np.floor(values + 0.5)
+
+
+def amortize(amounts, terms, annual_rates=0.0, frequencies="weekly"):
+    # amounts in currency units; annual_rates as fractions (0.12 for 12%);
+    # frequencies names of FREQUENCIES, one per loan or one for all
+    principal = to_cents(amounts)
+    terms = np.asarray(terms, dtype=np.int64)
+    loans = len(principal)
+    periods_per_year = np.array(
+        [FREQUENCIES[frequency][0] for frequency in np.broadcast_to(frequencies, loans)], dtype=float
+    )
+    rates = np.broadcast_to(np.asarray(annual_rates, dtype=float), loans) / periods_per_year
+
+    # The level installment: P * r / (1 - (1 + r)^-n), or P / n at a zero rate
+    interest_free = rates == 0
+    safe_rates = np.where(interest_free, 1.0, rates)
+    installment = np.where(
+        interest_free,
+        principal / terms,
+        principal * safe_rates / (1 - (1 + safe_rates) ** -terms.astype(float)),
+    )
+    installment = round_half_up(installment)
+
+    max_terms = int(terms.max()) if loans else 0
+    shape = (loans, max_terms)
+    payment = np.zeros(shape)
+    repaid = np.zeros(shape)
+    interest = np.zeros(shape)
+    balance = np.zeros(shape)
+
+    remaining = principal.copy()
+    for period in range(max_terms):
+        active = period < terms
+        last = period == terms - 1
+        charged = np.where(active, round_half_up(remaining * rates), 0)
+        # The last installment pays off whatever is left, and no installment
+        # repays more than is owed
+        paid_down = np.where(last, remaining, np.clip(installment - charged, 0, remaining))
+        paid_down = np.where(active, paid_down, 0)
+        remaining = remaining - paid_down
+
+        payment[:, period] = paid_down + charged
+        repaid[:, period] = paid_down
+        interest[:, period] = charged
+        balance[:, period] = np.where(active, remaining, 0)
+
+    return Schedules(terms, payment, repaid, interest, balance)
+
+
+def due_dates(start, terms: int, frequency: str):
+    # The due dates of periods 1..terms of a loan starting at start, as
+    # datetime64. Monthly dates keep start's day of the month, or the last
+    # day of shorter months.
+    start = np.datetime64(start)
+    periods = np.arange(1, terms + 1)
+    step = FREQUENCIES[frequency][1]
+    if step is not None:
+        return start + periods * np.timedelta64(step, "D")
+
+    day = start.astype("datetime64[D]")
+    month = day.astype("datetime64[M]")
+    day_of_month = day - month.astype("datetime64[D]")
+    time_of_day = start - day
+    months = month + periods
+    month_lengths = (months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")
+    days = months.astype("datetime64[D]") + np.minimum(day_of_month, month_lengths - np.timedelta64(1, "D"))
+    return days + time_of_day
+
+
+def schedule_due_dates(start, terms, frequencies, max_terms: int):
+    # due_dates for every loan, one row per loan. Loans share start, so each
+    # frequency's dates are computed once.
+    frequencies = np.broadcast_to(np.asarray(frequencies, dtype=object), len(terms))
+    dates = None
+    for frequency in set(frequencies.tolist()):
+        row = due_dates(start, max_terms, frequency)
+        if dates is None:
+            dates = np.empty((len(terms), max_terms), dtype=row.dtype)
+        dates[frequencies == frequency] = row
+    return dates if dates is not None else np.empty((0, max_terms), dtype="datetime64[D]")
+
+
+def installment_rows(loans, date):
+    # PaymentTerm column values for the installments of approved loans: weekly
+    # and interest free, due from a week after date
+    if not loans:
+        return []
+    schedules = amortize([loan.amount for loan in loans], [loan.terms for loan in loans])
+    mask = schedules.mask()
+    dates = schedule_due_dates(np.datetime64(date, "us"), schedules.terms, "weekly", mask.shape[1])
+
+    loan_index = np.nonzero(mask)[0].tolist()
+    return [
+        {
+            "amount": amount,
+            "due_date": due_date,
+            "payment_status": "Pending",
+            "user_id": loans[i].user_id,
+            "loan_id": loans[i].id,
+        }
+        for i, amount, due_date in zip(
+            loan_index, from_cents(schedules.payment[mask]), dates[mask].tolist()
+        )
+    ]
+
+
+def quote_loans(quotes, start, include_schedules: bool = True):
+    # Price loans given as (amount, terms, annual_rate, frequency) without
+    # storing anything. Returns one JSON-ready dict per loan.
+    if not quotes:
+        return []
+    amounts, terms, rates, frequencies = (list(column) for column in zip(*quotes))
+    schedules = amortize(amounts, terms, rates, np.array(frequencies, dtype=object))
+    mask = schedules.mask()
+
+    installments = from_cents(schedules.payment[:, 0])
+    total_interest = from_cents(schedules.interest.sum(axis=1))
+    total_paid = from_cents(schedules.payment.sum(axis=1))
+
+    results = [
+        {
+            "amount": amount,
+            "terms": loan_terms,
+            "annual_rate": rate,
+            "frequency": frequency,
+            "installment": installment,
+            "total_interest": interest,
+            "total_paid": paid,
+        }
+        for amount, loan_terms, rate, frequency, installment, interest, paid in zip(
+            amounts, terms, rates, frequencies, installments, total_interest, total_paid
+        )
+    ]
+    if not include_schedules:
+        return results
+
+    dates = np.datetime_as_string(
+        schedule_due_dates(np.datetime64(start, "D"), schedules.terms, frequencies, mask.shape[1])
+    )
+    columns = {
+        "due_date": dates[mask].tolist(),
+        "payment": from_cents(schedules.payment[mask]),
+        "principal": from_cents(schedules.principal[mask]),
+        "interest": from_cents(schedules.interest[mask]),
+        "balance": from_cents(schedules.balance[mask]),
+    }
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    offset = 0
+    for result, loan_terms in zip(results, terms):
+        result["schedule"] = rows[offset:offset + loan_terms]
+        offset += loan_terms
+    return results
@@ -0,0 +1,156 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+# scrypt work factor: each hash costs 2**cost iterations and 128 * 8 * 2**cost bytes
+PASSWORD_HASH_COST = int(os.environ.get("PASSWORD_HASH_COST", 14))
+# "thread" (hashlib releases the GIL while hashing) or "process"
+PASSWORD_HASH_EXECUTOR = os.environ.get("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+# Hashes running or queued before new logins and registrations are turned away
+PASSWORD_HASH_MAX_PENDING = int(
+    os.environ.get("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 8)
+)
+
+SCRYPT_BLOCK_SIZE = 8
+SCRYPT_PARALLELISM = 1
+# Highest cost a stored hash may name: above it scrypt needs more memory than
+# hashlib accepts
+MAX_SCRYPT_COST = 19
+
+
+def _b64encode(data: bytes):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password: str, salt: bytes, cost: int):
+    return hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=salt,
+        n=2 ** cost,
+        r=SCRYPT_BLOCK_SIZE,
+        p=SCRYPT_PARALLELISM,
+        maxmem=256 * SCRYPT_BLOCK_SIZE * 2 ** cost,
+        dklen=32,
+    )
+
+
+def hash_password(password: str, cost: int = PASSWORD_HASH_COST):
+    # Stored as scrypt$<cost>$<salt>$<hash>
+    salt = os.urandom(16)
+    return f"scrypt${cost}${_b64encode(salt)}${_b64encode(_scrypt(password, salt, cost))}"
+
+
+def verify_password(password: str, stored: str):
+    if not is_password_hash(stored):
+        # Passwords stored in plain text before hashing was introduced
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+
+    parsed = parse_password_hash(stored)
+    if parsed is None:
+        # A malformed hash matches no password
+        return False
+    cost, salt, expected = parsed
+    return hmac.compare_digest(_scrypt(password, salt, cost), expected)
+
+
+def is_password_hash(stored: str):
+    # Anything in the scrypt$ format is a hash, well formed or not, so a
+    # malformed one is never compared as a plain text password
+    return stored.startswith("scrypt$")
+
+
+def parse_password_hash(stored: str):
+    # (cost, salt, digest) of a scrypt$<cost>$<salt>$<hash> value, or None
+    # when it is malformed
+    parts = stored.split("$")
+    if len(parts) != 4 or parts[0] != "scrypt" or not parts[1].isdigit():
+        return None
+    cost = int(parts[1])
+    try:
+        salt = base64.b64decode(parts[2], validate=True)
+        digest = base64.b64decode(parts[3], validate=True)
+    except ValueError:
+        return None
+    if not 1 <= cost <= MAX_SCRYPT_COST or not salt or len(digest) != 32:
+        return None
+    return cost, salt, digest
+
+
+class PasswordHasher:
+    # Runs hashing and verification on a bounded worker pool so the CPU-heavy
+    # work never runs on the event loop, and sheds load with a 503 once
+    # max_pending hashes are already in flight.
+
+    def __init__(
+        self,
+        cost: int = PASSWORD_HASH_COST,
+        workers: int = PASSWORD_HASH_WORKERS,
+        executor: str = PASSWORD_HASH_EXECUTOR,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+    ):
+        self.cost = cost
+        self.workers = workers
+        self.executor_kind = executor
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hash"
+                )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        # Only called from the event loop, so the counter needs no lock
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts in progress, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str):
+        return await self._run(hash_password, password, self.cost)
+
+    async def hash_many(self, passwords):
+        # Bulk imports hash on the same pool without the admission limit,
+        # keeping at most `workers` hashes queued at a time so logins queued
+        # behind them wait for one round of hashes, not for the whole batch
+        loop = asyncio.get_running_loop()
+        hashes = []
+        for i in range(0, len(passwords), self.workers):
+            hashes += await asyncio.gather(*(
+                loop.run_in_executor(self.executor, hash_password, password, self.cost)
+                for password in passwords[i:i + self.workers]
+            ))
+        return hashes
+
+    async def verify(self, password: str, stored: str):
+        return await self._run(verify_password, password, stored)
+
+    def needs_rehash(self, stored: str):
+        # Plain text passwords and hashes made at another cost get rehashed on login
+        parsed = parse_password_hash(stored)
+        return parsed is None or parsed[0] != self.cost
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,125 @@
+"""Serve the API from several worker processes.
+
+    python -m app serve [--host 127.0.0.1] [--port 8000] [--workers 4]
+
+Workers share one listening socket and each run their own event loop, pools
+and caches. With a read replica and more than one worker, the workers share
+their read-your-writes window through a SQLite file (READ_YOUR_WRITES_STORE,
+a temporary file unless set), so a user's reads follow their writes whichever
+worker took them. They use uvloop and httptools when those are installed, and
+asyncio and h11 otherwise.
+
+The pools of every worker together stay within DB_MAX_CONNECTIONS when it is
+set: each worker's DB_POOL_SIZE and DB_MAX_OVERFLOW are lowered until workers
+x engines x (pool size + overflow) fits, where engines is 2 with
+DATABASE_ASYNC (the sync engine still serves scripts and the sweeper) and 1
+otherwise. Replicas are separate servers and are not counted.
+
+On SIGTERM or SIGINT a worker stops accepting connections, lets the requests
+in flight finish for up to SERVE_DRAIN_SECONDS, and closes its pools.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from .db import DATABASE_ASYNC, DATABASE_REPLICA_URL, DB_MAX_OVERFLOW, DB_POOL_SIZE
+
+# uvicorn's own logger, so these lines come out with its formatting
+logger = logging.getLogger("uvicorn.error")
+
+# Worker processes; defaults to one per CPU
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", os.cpu_count() or 1))
+# Connections the primary database accepts from all workers; 0 means no limit
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", 0))
+# Seconds a stopping worker waits for requests in flight
+SERVE_DRAIN_SECONDS = float(os.environ.get("SERVE_DRAIN_SECONDS", 30))
+
+
+def pool_sizes(workers: int, engines: int, max_connections: int = DB_MAX_CONNECTIONS,
+               pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+    # (pool_size, max_overflow) per engine of each worker, so that all of them
+    # open at most max_connections. Pool size gives way last.
+    if not max_connections:
+        return pool_size, max_overflow
+    per_engine = max_connections // (workers * engines)
+    if per_engine < 1:
+        raise ValueError(
+            f"DB_MAX_CONNECTIONS={max_connections} cannot give {workers} workers "
+            f"{engines} connection(s) each; lower --workers"
+        )
+    size = min(pool_size, per_engine)
+    return size, min(max_overflow, per_engine - size)
+
+
+class DrainingServer(uvicorn.Server):
+    # A second signal no longer forces an immediate exit: Ctrl+C reaches the
+    # workers and then the supervisor terminates them, which would cut every
+    # drain short. The drain ends when its requests finish or after
+    # drain_seconds instead.
+
+    drain_seconds = SERVE_DRAIN_SECONDS
+
+    def handle_exit(self, sig, frame):
+        if self.should_exit:
+            return
+        self.should_exit = True
+        timer = threading.Timer(self.drain_seconds, self.stop_draining)
+        timer.daemon = True
+        timer.start()
+
+    def stop_draining(self):
+        if self.server_state.connections or self.server_state.tasks:
+            logger.warning("Requests still in flight after %.0fs; closing them", self.drain_seconds)
+        self.force_exit = True
+
+
+def shared_writers_store(workers: int, replica_url=DATABASE_REPLICA_URL, environ=os.environ):
+    # The READ_YOUR_WRITES_STORE the workers should share: the configured
+    # one, a new temporary file when several workers route reads to a
+    # replica, or None when one process keeps the window
+    if environ.get("READ_YOUR_WRITES_STORE") or not replica_url or workers < 2:
+        return environ.get("READ_YOUR_WRITES_STORE")
+    return os.path.join(tempfile.mkdtemp(prefix="serve-"), "writers.db")
+
+
+def serve(host: str, port: int, workers: int, log_level: str = "info", loop: str = "auto", http: str = "auto"):
+    engines = 2 if DATABASE_ASYNC else 1
+    pool_size, max_overflow = pool_sizes(workers, engines)
+    # Workers are spawned, so they read their pool sizes and store from the
+    # environment
+    os.environ["DB_POOL_SIZE"] = str(pool_size)
+    os.environ["DB_MAX_OVERFLOW"] = str(max_overflow)
+    writers_store = shared_writers_store(workers)
+    if writers_store:
+        os.environ["READ_YOUR_WRITES_STORE"] = writers_store
+
+    config = uvicorn.Config(
+        "app.main:app", host=host, port=port, workers=workers, log_level=log_level,
+        loop=loop, http=http, lifespan="on",
+    )
+    logger.info(
+        "Serving with %d workers, each with %d engine(s) of pool_size=%d, max_overflow=%d",
+        workers, engines, pool_size, max_overflow,
+    )
+    if writers_store:
+        logger.info("Workers share their read-your-writes window through %s", writers_store)
+    server = DrainingServer(config=config)
+    # Always supervise, so one worker is served the same way as many
+    Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default="auto")
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default="auto")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.workers, args.log_level, args.loop, args.http)
@@ -0,0 +1,122 @@
+"""Mark overdue Pending installments Late.
+
+Runs one sweep, or one every --interval seconds:
+
+    python -m app.sweeper [--chunk-size 1000] [--pause 0] [--interval 0]
+
+The API runs the same sweep in-process every OVERDUE_SWEEP_INTERVAL seconds
+when that is set.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .db import database
+from .models.model import PaymentTerm
+
+logger = logging.getLogger(__name__)
+
+# Seconds between in-process sweeps; 0 leaves sweeping to the CLI
+OVERDUE_SWEEP_INTERVAL = float(os.environ.get("OVERDUE_SWEEP_INTERVAL", 0))
+OVERDUE_SWEEP_CHUNK = int(os.environ.get("OVERDUE_SWEEP_CHUNK", 1000))
+
+
+def sweep_overdue_installments(db: Session, now: datetime = None, chunk_size: int = 1000, pause: float = 0.0):
+    # Mark Pending installments due before now as Late, chunk_size rows per
+    # transaction. Each chunk's ids come off the (payment_status, due_date)
+    # index oldest first and are updated by primary key, so no statement scans
+    # the table and no lock is held longer than one chunk. The UPDATE skips
+    # rows paid since they were read; its status check is != so that it cannot
+    # steer the planner off the primary key.
+    now = now or datetime.now()
+    overdue = (PaymentTerm.payment_status == "Pending") & (PaymentTerm.due_date <= now)
+
+    oldest = db.execute(select(func.min(PaymentTerm.due_date)).where(overdue)).scalar()
+    lag = (now - oldest).total_seconds() if oldest is not None else 0.0
+    metrics.OVERDUE_SWEEP_LAG.set(lag)
+
+    start = time.perf_counter()
+    marked = 0
+    while True:
+        ids = db.execute(
+            select(PaymentTerm.id).where(overdue).order_by(PaymentTerm.due_date.asc()).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        count = db.execute(
+            update(PaymentTerm)
+            .where(PaymentTerm.id.in_(ids))
+            .where(PaymentTerm.payment_status != "Paid")
+            .values(payment_status="Late")
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        marked += count
+        metrics.OVERDUE_MARKED.inc(count)
+
+        if len(ids) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    seconds = time.perf_counter() - start
+    metrics.OVERDUE_SWEEP_DURATION.observe(seconds)
+    return {
+        "marked": marked,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(marked / seconds, 2) if seconds else 0.0,
+        "lag_seconds": round(lag, 3),
+    }
+
+
+def sweep_once(chunk_size: int = OVERDUE_SWEEP_CHUNK, pause: float = 0.0):
+    db = database.session()
+    try:
+        return sweep_overdue_installments(db, chunk_size=chunk_size, pause=pause)
+    finally:
+        db.close()
+
+
+async def run_sweeper(interval: float = OVERDUE_SWEEP_INTERVAL, chunk_size: int = OVERDUE_SWEEP_CHUNK):
+    # In-process schedule. Sweeps run on a worker thread so the event loop
+    # keeps serving requests; a failed sweep is logged and retried next time.
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            result = await loop.run_in_executor(None, sweep_once, chunk_size)
+            if result["marked"]:
+                logger.info("Marked %(marked)d installments Late (%(rows_per_second).0f rows/s, "
+                            "lag %(lag_seconds).0fs)", result)
+        except Exception:
+            logger.exception("Overdue sweep failed")
+        await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=OVERDUE_SWEEP_CHUNK)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between chunks")
+    parser.add_argument("--interval", type=float, default=0.0, help="sweep every this many seconds")
+    args = parser.parse_args()
+
+    while True:
+        result = sweep_once(args.chunk_size, args.pause)
+        print(
+            f"Marked {result['marked']} installments Late in {result['seconds']}s "
+            f"({result['rows_per_second']} rows/s); the oldest was {result['lag_seconds']}s overdue."
+        )
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
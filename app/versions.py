@@ -0,0 +1,87 @@
+"""Data versions behind the ETags of the polled read endpoints.
+
+Every write to a user's loans or installments bumps users.data_version and the
+user's data_versions shard in the writing transaction. A user's own reads are
+tagged with their version; an admin's view of every loan with the sum of the
+shards. A poll carrying a current ETag is answered 304 after one version
+lookup, without running the endpoint's query.
+"""
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from .db import as_datetime
+from .models.model import DATA_VERSION_SHARDS, DataVersion, User
+
+# Users whose versions are bumped per statement
+BUMP_CHUNK = 1000
+
+# Clients may keep the body but must revalidate it before every use
+REVALIDATE = "private, no-cache"
+
+
+def bump_data_versions(db: Session, user_ids):
+    # Call after the transaction's writes and before its commit. Rows are
+    # locked in id order, so concurrent bumps cannot deadlock each other.
+    user_ids = sorted(set(user_ids))
+    for i in range(0, len(user_ids), BUMP_CHUNK):
+        db.execute(
+            update(User)
+            .where(User.id.in_(user_ids[i:i + BUMP_CHUNK]))
+            .values(data_version=User.data_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+    shards = sorted({user_id % DATA_VERSION_SHARDS for user_id in user_ids})
+    if shards:
+        db.execute(
+            update(DataVersion)
+            .where(DataVersion.shard.in_(shards))
+            .values(version=DataVersion.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def user_data_version(db: Session, user_id: int):
+    return db.execute(select(User.data_version).where(User.id == user_id)).scalar() or 0
+
+
+def global_data_version(db: Session):
+    return db.execute(select(func.sum(DataVersion.version))).scalar() or 0
+
+
+def parse_etags(if_none_match):
+    # The entity tags of an If-None-Match header, weak or strong alike
+    if not if_none_match:
+        return []
+    tags = []
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tags.append(tag)
+    return tags
+
+
+def etag_matches(if_none_match, etag: str):
+    return any(tag in ("*", etag) for tag in parse_etags(if_none_match))
+
+
+def loans_etag(admin: bool, version: int):
+    # Per URL, so limit and after need no part of their own
+    return f'"{"a" if admin else "u"}{version}"'
+
+
+def next_due_etag(version: int, payment):
+    # Carries the due date, so a tag expires when its installment falls due
+    # even though that is not a write
+    due = int(as_datetime(payment["due_date"]).timestamp()) if payment else 0
+    return f'"{version}-{due}"'
+
+
+def current_next_due_etag(if_none_match, version: int, now):
+    # The client's next_due_etag when version and now still vouch for it,
+    # decided without looking the installment up; otherwise None
+    for tag in parse_etags(if_none_match):
+        tag_version, _, due = tag.strip('"').partition("-")
+        if tag_version == str(version) and due.isdigit() and (due == "0" or int(due) > now.timestamp()):
+            return tag
+    return None
@@ -0,0 +1,86 @@
+"""Read-your-writes window of the read replica.
+
+A user who wrote within the last READ_YOUR_WRITES_SECONDS has their reads
+served by the primary, which the replica may not have caught up with yet.
+The window is kept in this process, or in a SQLite file shared by the worker
+processes of one host when READ_YOUR_WRITES_STORE names one, so a read is
+routed the same way whichever worker took the write. python -m app serve
+gives its workers a shared file when a replica is configured.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from .cache import TTLCache
+from .db import READ_YOUR_WRITES_SECONDS
+
+# SQLite file holding the last write of each user for every worker process on
+# this host
+READ_YOUR_WRITES_STORE = os.environ.get("READ_YOUR_WRITES_STORE")
+# Users tracked by the in-process store
+READ_YOUR_WRITES_USERS = int(os.environ.get("READ_YOUR_WRITES_USERS", 100000))
+
+
+class MemoryWriters:
+    # Writers of one process
+
+    def __init__(self, window: float = READ_YOUR_WRITES_SECONDS, maxsize: int = READ_YOUR_WRITES_USERS):
+        self.window = window
+        self._writers = TTLCache(maxsize, ttl=window)
+
+    def record(self, user_id: int, now: float = None):
+        self._writers.set(user_id, True)
+
+    def wrote_recently(self, user_id: int, now: float = None):
+        return bool(self._writers.get(user_id))
+
+    def clear(self):
+        self._writers.clear()
+
+
+class SqliteWriters:
+    # Writers shared by the processes of one host through a local SQLite file.
+    # A write is one upsert of the user's row, a read one primary key lookup;
+    # neither needs a transaction of its own.
+
+    PRUNE_EVERY = 10000
+
+    def __init__(self, path: str, window: float = READ_YOUR_WRITES_SECONDS):
+        self.path = path
+        self.window = window
+        self._local = threading.local()
+        self._records = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS writers (user_id INTEGER PRIMARY KEY, written REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def record(self, user_id: int, now: float = None):
+        now = time.time() if now is None else now
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO writers VALUES (?, ?)", (user_id, now))
+        self._records += 1
+        if self._records % self.PRUNE_EVERY == 0:
+            # Writes older than the window no longer route anything
+            connection.execute("DELETE FROM writers WHERE written < ?", (now - self.window,))
+
+    def wrote_recently(self, user_id: int, now: float = None):
+        now = time.time() if now is None else now
+        row = self._connection().execute("SELECT written FROM writers WHERE user_id = ?", (user_id,)).fetchone()
+        return row is not None and row[0] > now - self.window
+
+    def clear(self):
+        self._connection().execute("DELETE FROM writers")
+
+
+def make_writers(store: str = READ_YOUR_WRITES_STORE):
+    return SqliteWriters(store) if store else MemoryWriters()